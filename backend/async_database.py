@@ -0,0 +1,276 @@
+"""
+Async database access for the request path using SQLAlchemy's asyncio engine with asyncpg.
+Mirrors the data-access helpers in database.py so DB waits don't block the event loop.
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Dict
+import numpy as np
+from sqlalchemy import event, select, update, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from pgvector import Vector, HalfVector
+from database import (
+    DATABASE_URL, User, Conversation, Message,
+    BEGIN_TURN_SQL, turn_message_rows, finish_turn_statement, history_query,
+    similar_messages_query, user_memories_query, append_to_history_buffer
+)
+from history_buffer import get_history_buffer, HistoryEntry
+from read_replicas import get_replica_router, LAG_QUERY, REPLICA_LAG_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def to_async_url(url: str) -> str:
+    """Convert a PostgreSQL URL to use the asyncpg driver."""
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+# Database configuration
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+# Create async engine
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, pool_pre_ping=True, pool_size=10, max_overflow=20
+)
+
+# Create async session factory
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+# Async read replicas, in the same order as the router's URLs
+async_replica_engines = [
+    create_async_engine(to_async_url(url), pool_pre_ping=True, pool_size=10, max_overflow=20)
+    for url in get_replica_router().urls
+]
+AsyncReplicaSessionLocals = [
+    async_sessionmaker(replica_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    for replica_engine in async_replica_engines
+]
+
+
+def _encode_vector(value):
+    """Encode vectors in pgvector's binary format, accepting SQLAlchemy's text form."""
+    if isinstance(value, str):
+        value = Vector.from_text(value)
+    return Vector._to_db_binary(value)
+
+
+def _encode_halfvec(value):
+    """Encode half precision vectors in pgvector's binary format, accepting SQLAlchemy's text form."""
+    if isinstance(value, str):
+        value = HalfVector.from_text(value)
+    return HalfVector._to_db_binary(value)
+
+
+def _decode_halfvec(value):
+    """Decode half precision vectors into float32 NumPy arrays, like full precision ones."""
+    return HalfVector._from_db_binary(value).to_numpy().astype(np.float32)
+
+
+async def _register_vector(connection):
+    """Register binary vector codecs so results decode straight into NumPy arrays."""
+    await connection.set_type_codec(
+        "vector",
+        schema="public",
+        encoder=_encode_vector,
+        decoder=Vector._from_db_binary,
+        format="binary"
+    )
+    try:
+        await connection.set_type_codec(
+            "halfvec",
+            schema="public",
+            encoder=_encode_halfvec,
+            decoder=_decode_halfvec,
+            format="binary"
+        )
+    except ValueError:
+        # halfvec arrived in pgvector 0.7
+        pass
+
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    """Register pgvector types on each new asyncpg connection."""
+    dbapi_connection.run_async(_register_vector)
+
+
+for _replica_engine in async_replica_engines:
+    event.listen(_replica_engine.sync_engine, "connect", _on_connect)
+
+
+async def get_async_db():
+    """Dependency for getting an async database session."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def run_read_async(db: AsyncSession, execute, key=None):
+    """
+    Async variant of database.run_read.
+
+    execute takes a session and returns the awaitable result of session.execute;
+    rows are fetched inside the replica session before it closes.
+    """
+    router = get_replica_router()
+    index = router.choose(key)
+    if index is None:
+        return (await execute(db)).all()
+
+    try:
+        async with AsyncReplicaSessionLocals[index]() as replica:
+            return (await execute(replica)).all()
+    except Exception as e:
+        logger.error(f"Read replica {index} query failed, retrying on primary: {e}")
+        router.record_failure(index)
+        return (await execute(db)).all()
+
+
+# Async utility functions for database operations
+async def get_or_create_user_async(db: AsyncSession, whatsapp_number: str):
+    """Get existing user or create new one."""
+    user = (await db.execute(
+        select(User).where(User.whatsapp_number == whatsapp_number)
+    )).scalars().first()
+    if not user:
+        user = User(whatsapp_number=whatsapp_number)
+        db.add(user)
+        await db.commit()
+        await db.refresh(user)
+    else:
+        user.last_interaction = datetime.utcnow()
+        user.total_messages += 1
+        await db.commit()
+    return user
+
+
+async def get_active_conversation_async(db: AsyncSession, user_id: uuid.UUID):
+    """Get or create active conversation for user."""
+    conversation = (await db.execute(
+        select(Conversation).where(
+            Conversation.user_id == user_id,
+            Conversation.is_active == True
+        )
+    )).scalars().first()
+
+    if not conversation:
+        conversation = Conversation(user_id=user_id)
+        db.add(conversation)
+        await db.commit()
+        await db.refresh(conversation)
+
+    return conversation
+
+
+async def save_message_async(db: AsyncSession, conversation_id: uuid.UUID, user_id: uuid.UUID,
+                             role: str, content: str, embedding=None, contains_crisis=False):
+    """Save a message and bump the conversation counter atomically."""
+    message = Message(
+        conversation_id=conversation_id,
+        user_id=user_id,
+        role=role,
+        content=content,
+        embedding=embedding,
+        contains_crisis_keywords=contains_crisis
+    )
+    db.add(message)
+
+    await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(message_count=Conversation.message_count + 1, last_message_at=datetime.utcnow())
+    )
+
+    await db.commit()
+    get_history_buffer().append(conversation_id, role, content, message.timestamp)
+    get_replica_router().mark_written(conversation_id, user_id)
+    return message
+
+
+async def get_conversation_history_async(db: AsyncSession, conversation_id: uuid.UUID,
+                                         limit: int = 10):
+    """Get recent conversation history, served from the ring buffer when hot."""
+    history_buffer = get_history_buffer()
+    cached = history_buffer.get(conversation_id, limit)
+    if cached is not None:
+        return cached
+
+    # Cold start: one indexed read that also fills the buffer
+    query_limit = max(limit, history_buffer.capacity)
+    messages = await run_read_async(
+        db, lambda session: session.execute(history_query(conversation_id, query_limit)),
+        key=conversation_id
+    )
+
+    messages = list(reversed(messages))  # Return in chronological order
+    history_buffer.fill(conversation_id, messages, query_limit)
+    return [HistoryEntry(msg.role, msg.content, msg.timestamp) for msg in messages[-limit:]]
+
+
+async def begin_turn_async(db: AsyncSession, whatsapp_number: str):
+    """Async variant of database.begin_turn."""
+    turn = (await db.execute(BEGIN_TURN_SQL, {
+        "new_user_id": uuid.uuid4(),
+        "new_conversation_id": uuid.uuid4(),
+        "whatsapp_number": whatsapp_number,
+        "now": datetime.utcnow()
+    })).one()
+
+    # Commit right away so the user row lock is not held during the LLM call
+    await db.commit()
+    return turn
+
+
+async def finish_turn_async(db: AsyncSession, conversation_id: uuid.UUID, user_id: uuid.UUID,
+                            messages: List[Dict], crisis: bool = False) -> List[uuid.UUID]:
+    """Async variant of database.finish_turn."""
+    now = datetime.utcnow()
+    rows = turn_message_rows(conversation_id, user_id, messages, now)
+    await db.execute(finish_turn_statement(conversation_id, user_id, rows, now, crisis))
+    await db.commit()
+    append_to_history_buffer(conversation_id, rows)
+    get_replica_router().mark_written(conversation_id, user_id)
+    return [row["id"] for row in rows]
+
+
+async def search_similar_messages_async(db: AsyncSession, user_id: uuid.UUID, embedding,
+                                        limit: int = 5, window_conversation_id: uuid.UUID = None,
+                                        window_start: datetime = None, role: str = "user"):
+    """Search one user's past messages by vector similarity."""
+    query = similar_messages_query(user_id, embedding, limit, window_conversation_id, window_start, role)
+    return await run_read_async(db, lambda session: session.execute(query), key=user_id)
+
+
+async def load_user_memories_async(db: AsyncSession, user_id: uuid.UUID, limit: int = 2000,
+                                   role: str = "user"):
+    """Load a user's most recent embedded messages for the in-memory memory index."""
+    query = user_memories_query(user_id, limit, role)
+    return await run_read_async(db, lambda session: session.execute(query), key=user_id)
+
+
+async def check_replica_lag():
+    """Measure replay lag on every replica and report it to the router."""
+    router = get_replica_router()
+    for index, replica_engine in enumerate(async_replica_engines):
+        try:
+            async with replica_engine.connect() as connection:
+                lag = (await connection.execute(text(LAG_QUERY))).scalar()
+            router.record_lag(index, float(lag))
+        except Exception as e:
+            logger.error(f"Lag check failed for read replica {index}: {e}")
+            router.record_lag(index, None)
+
+
+async def run_replica_lag_monitor(interval: float = REPLICA_LAG_CHECK_INTERVAL):
+    """Periodically measure replica lag until cancelled; replicas serve reads only while monitored."""
+    logger.info(f"Read replica lag monitor started for {len(async_replica_engines)} replicas")
+
+    while True:
+        await check_replica_lag()
+        await asyncio.sleep(interval)
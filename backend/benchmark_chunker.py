@@ -0,0 +1,78 @@
+"""
+Benchmark the TextChunker against langchain's RecursiveCharacterTextSplitter, sized in characters and in tokens.
+Chunks the bundled PDFs with each and compares time, chunk counts, token sizes and sentence alignment.
+"""
+
+import sys
+import time
+import statistics
+from pathlib import Path
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from text_chunker import TextChunker, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, get_token_counter
+from pdf_cache import load_pdf
+
+PDF_DIRECTORY = sys.argv[1] if len(sys.argv) > 1 else "knowledge_base"
+ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+SENTENCE_ENDINGS = (".", "!", "?", "…", "\"", "”", "’", ")")
+
+
+def recursive_split(splitter, documents):
+    """Chunk texts of the previous splitter."""
+    return [chunk.page_content for chunk in splitter.split_documents(documents)]
+
+
+def native_split(chunker, documents):
+    """Chunk texts of TextChunker."""
+    pages = [(document.metadata.get("page", i), document.page_content) for i, document in enumerate(documents)]
+    return [chunk.content for chunk in chunker.split_pages(pages)]
+
+
+def run(name: str, split, documents_by_file, count_tokens):
+    """Time ROUNDS passes over every file and print chunk statistics."""
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        chunks = [text for documents in documents_by_file for text in split(documents)]
+        timings.append(time.perf_counter() - start)
+
+    tokens = count_tokens(chunks)
+    ends_sentence = sum(1 for text in chunks if text.rstrip().endswith(SENTENCE_ENDINGS))
+    print(f"{name}")
+    print(f"  best of {ROUNDS}: {min(timings) * 1000:.1f} ms")
+    print(f"  chunks: {len(chunks)}")
+    print(f"  tokens per chunk: mean {statistics.mean(tokens):.0f}, "
+          f"stdev {statistics.pstdev(tokens):.0f}, min {min(tokens)}, max {max(tokens)}")
+    print(f"  over {CHUNK_MAX_TOKENS} tokens: {sum(1 for count in tokens if count > CHUNK_MAX_TOKENS)}")
+    print(f"  total tokens to embed: {sum(tokens)}")
+    print(f"  ending on a sentence boundary: {ends_sentence / len(chunks):.1%}")
+    print()
+
+
+if __name__ == "__main__":
+    # Extraction is the same for both, so load the pages once outside the timings
+    documents_by_file = [load_pdf(path) for path in sorted(Path(PDF_DIRECTORY).glob("*.pdf"))]
+    characters = sum(len(document.page_content) for documents in documents_by_file for document in documents)
+    print(f"{len(documents_by_file)} PDFs, {characters:,} characters\n")
+
+    count_tokens = get_token_counter()
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    run("RecursiveCharacterTextSplitter (1000 chars, 200 overlap)",
+        lambda documents: recursive_split(splitter, documents), documents_by_file, count_tokens)
+    # The same splitter sized in tokens, which measures every candidate piece it merges
+    token_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_MAX_TOKENS,
+        chunk_overlap=CHUNK_OVERLAP_TOKENS,
+        length_function=lambda text: count_tokens([text])[0],
+        separators=["\n\n", "\n", " ", ""]
+    )
+    run(f"RecursiveCharacterTextSplitter ({CHUNK_MAX_TOKENS} tokens, {CHUNK_OVERLAP_TOKENS} overlap)",
+        lambda documents: recursive_split(token_splitter, documents), documents_by_file, count_tokens)
+    chunker = TextChunker(count_tokens=count_tokens)
+    run(f"TextChunker ({chunker.max_tokens} tokens, {chunker.overlap_tokens} overlap)",
+        lambda documents: native_split(chunker, documents), documents_by_file, count_tokens)
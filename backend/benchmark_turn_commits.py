@@ -0,0 +1,93 @@
+"""
+Benchmark database round trips and commits per chat turn.
+Compares the legacy per-call helpers with begin_turn/finish_turn against DATABASE_URL.
+"""
+
+import sys
+import time
+import random
+import uuid
+from sqlalchemy import event
+from database import (
+    engine, SessionLocal, init_db, User, Conversation, Message,
+    get_or_create_user, get_active_conversation, save_message,
+    begin_turn, finish_turn
+)
+
+TURNS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+counters = {"statements": 0, "commits": 0}
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    counters["statements"] += 1
+
+
+@event.listens_for(engine, "commit")
+def count_commit(conn):
+    counters["commits"] += 1
+
+
+def fake_embedding():
+    """Random vector standing in for an OpenAI embedding."""
+    return [random.random() for _ in range(1536)]
+
+
+def legacy_turn(db, number: str):
+    """Bookkeeping as done by the original per-call helpers."""
+    user = get_or_create_user(db, number)
+    conversation = get_active_conversation(db, user.id)
+    save_message(db, conversation.id, user.id, "user", "How do I cut down on scrolling?", fake_embedding())
+    save_message(db, conversation.id, user.id, "assistant", "What draws you to your phone?", fake_embedding())
+
+
+def consolidated_turn(db, number: str):
+    """Bookkeeping through begin_turn/finish_turn."""
+    turn = begin_turn(db, number)
+    finish_turn(db, turn.conversation_id, turn.user_id, [
+        {"role": "user", "content": "How do I cut down on scrolling?", "embedding": fake_embedding()},
+        {"role": "assistant", "content": "What draws you to your phone?", "embedding": fake_embedding()}
+    ])
+
+
+def run(name: str, turn_func, number: str):
+    """Run TURNS turns and print per-turn averages."""
+    db = SessionLocal()
+    counters.update(statements=0, commits=0)
+    start = time.perf_counter()
+    try:
+        for _ in range(TURNS):
+            turn_func(db, number)
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"{name:<14} statements/turn={counters['statements'] / TURNS:.1f} "
+          f"commits/turn={counters['commits'] / TURNS:.1f} "
+          f"ms/turn={elapsed * 1000 / TURNS:.1f}")
+
+
+def cleanup(numbers):
+    """Remove benchmark users and their data."""
+    db = SessionLocal()
+    try:
+        user_ids = [u.id for u in db.query(User.id).filter(User.whatsapp_number.in_(numbers))]
+        db.query(Message).filter(Message.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.query(Conversation).filter(Conversation.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.query(User).filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    init_db()
+    numbers = [f"benchmark:{uuid.uuid4().hex[:12]}" for _ in range(2)]
+
+    print(f"Running {TURNS} turns per strategy...")
+    try:
+        run("legacy", legacy_turn, numbers[0])
+        run("consolidated", consolidated_turn, numbers[1])
+    finally:
+        cleanup(numbers)
@@ -5,16 +5,19 @@ Handles response generation, crisis detection, and conversation management.
 
 import os
 import re
+import asyncio
 from typing import List, Dict, Optional
-from openai import OpenAI
-from sqlalchemy.orm import Session
+from openai import AsyncOpenAI
+from sqlalchemy.ext.asyncio import AsyncSession
 from rag_system import TherapeuticRAG
-from database import (
-    get_or_create_user, 
-    get_active_conversation, 
-    save_message,
-    get_conversation_history
-)
+from summarizer import HISTORY_WINDOW_MESSAGES, unsummarized_history
+from model_router import get_model_router
+from user_memory import get_memory_index, USER_MEMORY_ENABLED
+from rate_limiter import get_rate_limiter
+from user_cache import get_user_cache, TurnContext
+from write_behind import get_write_behind
+from storage import get_storage
+from embedding_spaces import get_space_registry, LEGACY_SPACE
 import logging
 
 logger = logging.getLogger(__name__)
@@ -44,84 +47,186 @@ If you're in immediate danger, please call 911 or go to your nearest emergency r
 
 I'm here to support you with digital wellness, but professional crisis counselors are better equipped to help with these intense feelings. Would you like to talk about what's bringing you to reach out today?"""
     
+    # Response when a user or the service has exhausted its rate limit
+    RATE_LIMIT_RESPONSE = """I'm receiving a lot of messages right now and need a short pause before I can reply thoughtfully. Please send your message again in a few minutes.
+
+If you're experiencing a mental health crisis, please contact the 988 Suicide & Crisis Lifeline (call or text 988)."""
+    
     def __init__(self, openai_api_key: str):
         """Initialize chatbot with OpenAI client and RAG system."""
-        self.client = OpenAI(api_key=openai_api_key)
+        self.client = AsyncOpenAI(api_key=openai_api_key)
         self.rag = TherapeuticRAG(openai_api_key)
-        self.model = "gpt-4-turbo-preview"  # Using GPT-4 Turbo for better responses
+        self.router = get_model_router()  # Routes turns between fast and large models
+        self.memory = get_memory_index()  # Per-user index of past messages
+        self.limiter = get_rate_limiter()  # Per-user and global request/token budgets
+        self.user_cache = get_user_cache()  # whatsapp_number -> user and active conversation
+        self.write_behind = get_write_behind()  # Batches message inserts across requests
+        self.storage = get_storage()  # PostgreSQL or embedded SQLite + NumPy
     
     def detect_crisis(self, message: str) -> bool:
         """Detect if message contains crisis-related keywords."""
         message_lower = message.lower()
         return any(keyword in message_lower for keyword in self.CRISIS_KEYWORDS)
     
-    def generate_response(self, db: Session, whatsapp_number: str, 
-                         user_message: str) -> Dict:
+    async def retrieve_memories(self, db: AsyncSession, user_id, query_embedding: List[float],
+                                conversation_id, history_messages: List, k: int = 3) -> List[str]:
+        """Retrieve the user's relevant past messages that the prompt's history window does not hold."""
+        if not USER_MEMORY_ENABLED:
+            return []
+        try:
+            # Memories are user messages, so the window starts at its oldest user message
+            window = [msg.timestamp for msg in history_messages if msg.role == "user"]
+            results = await self.memory.search_async(
+                db, user_id, query_embedding, k=k, window_conversation_id=conversation_id,
+                window_start=window[0] if window else None
+            )
+            return [result["content"] for result in results]
+        except Exception as e:
+            logger.error(f"Error retrieving user memories: {e}")
+            return []
+    
+    @staticmethod
+    def split_embeddings(message: Dict) -> Dict:
+        """Turn a message's per-space vectors into the legacy column and the other spaces' vectors."""
+        message = dict(message)
+        vectors = dict(message.pop("embeddings", None) or {})
+        embedding = vectors.pop(LEGACY_SPACE, None)
+        if embedding is not None:
+            # Tag vectors with the model that made them
+            message["embedding"] = embedding
+            message["embedding_model"] = get_space_registry().get(LEGACY_SPACE).model
+        message["space_embeddings"] = vectors
+        return message
+    
+    async def persist_turn(self, db: AsyncSession, turn, messages: List[Dict],
+                           crisis: bool = False) -> List:
+        """Persist a turn's messages through the write-behind buffer, or directly when it is off."""
+        messages = [self.split_embeddings(message) for message in messages]
+        if self.write_behind.running:
+            return await self.write_behind.aenqueue_turn(
+                turn.conversation_id, turn.user_id, messages, crisis=crisis
+            )
+        return await self.storage.finish_turn(
+            db, turn.conversation_id, turn.user_id, messages, crisis=crisis
+        )
+    
+    async def generate_response(self, db: AsyncSession, whatsapp_number: str,
+                                user_message: str) -> Dict:
         """
         Generate therapeutic response using RAG and GPT-4.
         
         Returns:
-            Dict with 'response', 'is_crisis', and 'user_id'
+            Dict with 'response', 'is_crisis', and 'user_id', plus
+            'rate_limited' naming the exhausted limit when throttled
         """
         try:
-            # Get or create user
-            user = get_or_create_user(db, whatsapp_number)
-            
             # Check for crisis content
             is_crisis = self.detect_crisis(user_message)
             
+            # Enforce rate limits before any embedding or completion call;
+            # crisis messages always receive the crisis response
+            if not is_crisis:
+                exhausted_limit = self.limiter.check(whatsapp_number)
+                if exhausted_limit:
+                    return {
+                        "response": self.RATE_LIMIT_RESPONSE,
+                        "is_crisis": False,
+                        "user_id": None,
+                        "rate_limited": exhausted_limit
+                    }
+            
+            # Record embedding token usage against this user
+            track_usage = lambda tokens: self.limiter.record_usage(
+                whatsapp_number, embedding_tokens=tokens
+            )
+            
+            # Resolve user and active conversation from cache, else in one round trip
+            turn = self.user_cache.get(whatsapp_number)
+            if turn is None:
+                turn = await self.storage.begin_turn(db, whatsapp_number)
+                self.user_cache.set(whatsapp_number, turn)
+            
+            # Embed in every written space; reads use the active one
+            active, written = get_space_registry().snapshot()
+            
             if is_crisis:
                 logger.warning(f"Crisis content detected from {whatsapp_number}")
-                user.crisis_flag = True
-                db.commit()
                 
-                # Get or create conversation
-                conversation = get_active_conversation(db, user.id)
-                
-                # Save user message
-                user_embedding = self.rag.create_embedding(user_message)
-                save_message(
-                    db, conversation.id, user.id, "user", 
-                    user_message, user_embedding, contains_crisis=True
+                # Save user message and crisis response, flagging the user
+                user_vectors, crisis_vectors = await asyncio.gather(
+                    self.rag.acreate_space_embeddings(user_message, on_usage=track_usage, spaces=written),
+                    self.rag.acreate_space_embeddings(self.CRISIS_RESPONSE, on_usage=track_usage, spaces=written)
                 )
-                
-                # Save crisis response
-                crisis_embedding = self.rag.create_embedding(self.CRISIS_RESPONSE)
-                save_message(
-                    db, conversation.id, user.id, "assistant",
-                    self.CRISIS_RESPONSE, crisis_embedding
+                user_embedding = user_vectors[active.name]
+                message_ids = await self.persist_turn(db, turn, [
+                    {"role": "user", "content": user_message, "embeddings": user_vectors,
+                     "contains_crisis_keywords": True},
+                    {"role": "assistant", "content": self.CRISIS_RESPONSE, "embeddings": crisis_vectors}
+                ], crisis=True)
+                # Write the new crisis_flag through, since the flagged row may not be flushed yet
+                self.user_cache.set(whatsapp_number, TurnContext(
+                    turn.user_id, True, turn.conversation_id, turn.summary, turn.summarized_through
+                ))
+                self.memory.add(
+                    turn.user_id, message_ids[0], turn.conversation_id, user_message, user_embedding
                 )
                 
                 return {
                     "response": self.CRISIS_RESPONSE,
                     "is_crisis": True,
-                    "user_id": str(user.id)
+                    "user_id": str(turn.user_id)
                 }
             
             # Normal therapeutic response flow
-            # Get or create conversation
-            conversation = get_active_conversation(db, user.id)
-            
-            # Retrieve conversation history
-            history_messages = get_conversation_history(db, conversation.id, limit=10)
+            # Retrieve the conversation history the rolling summary does not cover yet
+            history_messages = await self.storage.get_conversation_history(
+                db, turn.conversation_id, limit=HISTORY_WINDOW_MESSAGES
+            )
             conversation_history = [
                 {"role": msg.role, "content": msg.content}
-                for msg in history_messages
+                for msg in unsummarized_history(history_messages, turn.summarized_through)
             ]
             
-            # Retrieve relevant context from knowledge base
-            relevant_contexts = self.rag.retrieve_relevant_context(
-                db, user_message, k=5
+            # Embed the message once for retrieval, memory search and storage
+            user_vectors = await self.rag.acreate_space_embeddings(
+                user_message, on_usage=track_usage, spaces=written
             )
+            user_embedding = user_vectors[active.name]
+            
+            # Acknowledgements and small talk skip both searches; history carries those turns
+            scored_contexts, memories = [], []
+            search, _ = self.rag.gate.needs_retrieval(user_message)
+            if search:
+                # Retrieve relevant context from knowledge base
+                scored_contexts = await self.rag.aretrieve_scored_context(
+                    db, user_message, query_embedding=user_embedding
+                )
+                
+                # Retrieve the user's own relevant past messages
+                memories = await self.retrieve_memories(
+                    db, turn.user_id, user_embedding, turn.conversation_id, history_messages
+                )
+            relevant_contexts = [result["content"] for result in scored_contexts]
             
             # Build prompt with context
             prompt = self.rag.build_prompt_with_context(
-                user_message, relevant_contexts, conversation_history
+                user_message, relevant_contexts, conversation_history,
+                conversation_summary=turn.summary,
+                memories=memories
             )
             
-            # Generate response with GPT-4
-            response = self.client.chat.completions.create(
-                model=self.model,
+            # Pick a model for this turn
+            routing = self.router.route(
+                user_message,
+                conversation_history,
+                retrieval_scores=[result["similarity"] for result in scored_contexts],
+                crisis_flag=bool(turn.crisis_flag)
+            )
+            
+            # Generate response with the routed model
+            response = await self.router.atimed_completion(
+                self.client,
+                routing["model"],
                 messages=[
                     {"role": "system", "content": prompt},
                     {"role": "user", "content": user_message}
@@ -132,20 +237,19 @@ I'm here to support you with digital wellness, but professional crisis counselor
                 frequency_penalty=0.3
             )
             
+            self.limiter.record_completion(whatsapp_number, response)
             bot_response = response.choices[0].message.content.strip()
             
-            # Save user message
-            user_embedding = self.rag.create_embedding(user_message)
-            save_message(
-                db, conversation.id, user.id, "user",
-                user_message, user_embedding
+            # Save user message and bot response in one transaction
+            bot_vectors = await self.rag.acreate_space_embeddings(
+                bot_response, on_usage=track_usage, spaces=written
             )
-            
-            # Save bot response
-            bot_embedding = self.rag.create_embedding(bot_response)
-            save_message(
-                db, conversation.id, user.id, "assistant",
-                bot_response, bot_embedding
+            message_ids = await self.persist_turn(db, turn, [
+                {"role": "user", "content": user_message, "embeddings": user_vectors},
+                {"role": "assistant", "content": bot_response, "embeddings": bot_vectors}
+            ])
+            self.memory.add(
+                turn.user_id, message_ids[0], turn.conversation_id, user_message, user_embedding
             )
             
             logger.info(f"Generated response for {whatsapp_number}")
@@ -153,7 +257,7 @@ I'm here to support you with digital wellness, but professional crisis counselor
             return {
                 "response": bot_response,
                 "is_crisis": False,
-                "user_id": str(user.id)
+                "user_id": str(turn.user_id)
             }
         
         except Exception as e:
@@ -0,0 +1,222 @@
+"""
+Near-duplicate elimination for knowledge chunks at index time.
+MinHash signatures over word shingles with LSH banding find chunks that are near-copies of each other;
+each group collapses into one canonical chunk that keeps links to every source it came from.
+"""
+
+import os
+import re
+import json
+import zlib
+import logging
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Deduplication configuration
+CHUNK_DEDUP_ENABLED = os.getenv("CHUNK_DEDUP_ENABLED", "true").lower() == "true"
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.8"))  # Estimated Jaccard similarity
+CHUNK_DEDUP_SHINGLE_WORDS = int(os.getenv("CHUNK_DEDUP_SHINGLE_WORDS", "5"))
+CHUNK_DEDUP_PERMUTATIONS = 128
+CHUNK_DEDUP_BANDS = 16  # 16 bands of 8 rows catch pairs above about 0.7 similarity
+
+# Mersenne prime above the 32-bit shingle hashes, for universal hashing
+_PRIME = np.uint64((1 << 61) - 1)
+_MASK = np.uint64(0xFFFFFFFF)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, size: int = CHUNK_DEDUP_SHINGLE_WORDS) -> np.ndarray:
+    """Distinct 32-bit hashes of the text's overlapping word n-grams."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        words = words + [""] * (size - len(words))
+    shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+
+class MinHasher:
+    """MinHash signatures from a fixed family of random hash permutations."""
+
+    def __init__(self, permutations: int = CHUNK_DEDUP_PERMUTATIONS, seed: int = 1):
+        """Draw the permutation coefficients; the same seed gives comparable signatures."""
+        generator = np.random.default_rng(seed)
+        # Coefficients below 2^29 keep a * hash + b below 2^61 in uint64
+        self.a = generator.integers(1, 1 << 29, size=permutations, dtype=np.uint64)
+        self.b = generator.integers(0, 1 << 29, size=permutations, dtype=np.uint64)
+        self.permutations = permutations
+
+    def signature(self, text: str) -> np.ndarray:
+        """Minimum of each permutation over the text's shingles."""
+        hashes = shingle_hashes(text)
+        # One (shingles x permutations) matrix instead of a Python loop per permutation
+        permuted = (np.outer(hashes, self.a) + self.b) % _PRIME & _MASK
+        return permuted.min(axis=0)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """Signature matrix with one row per text."""
+        return np.vstack([self.signature(text) for text in texts]) if texts else np.empty((0, self.permutations))
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(first == second))
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int = CHUNK_DEDUP_BANDS) -> set:
+    """Pairs of rows whose signatures agree on every row of at least one band."""
+    rows_per_band = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = {}
+        chunk = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        for index, key in enumerate(chunk):
+            buckets.setdefault(key.tobytes(), []).append(index)
+        for members in buckets.values():
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    pairs.add((members[i], members[j]))
+    return pairs
+
+
+def _find(parents: List[int], index: int) -> int:
+    """Union-find root with path halving."""
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+
+def _source(chunk: Dict) -> Dict:
+    """Citation of a chunk: file, chunk index and page when known."""
+    metadata = json.loads(chunk.get("doc_metadata") or "{}")
+    source = {"source_file": chunk["source_file"], "chunk_index": chunk["chunk_index"]}
+    if "page" in metadata:
+        source["page"] = metadata["page"]
+    return source
+
+
+def deduplicate_chunks(chunks: List[Dict], threshold: float = CHUNK_DEDUP_THRESHOLD,
+                       hasher: Optional[MinHasher] = None) -> Tuple[List[Dict], Dict]:
+    """
+    Collapse near-duplicate chunks, returning the kept chunks and a report.
+
+    The longest chunk of each group is kept; its doc_metadata gains a "duplicates"
+    list citing the chunks folded into it.
+    """
+    hasher = hasher or MinHasher()
+    signatures = hasher.signatures([chunk["content"] for chunk in chunks])
+
+    parents = list(range(len(chunks)))
+    for i, j in candidate_pairs(signatures):
+        # Banding only proposes pairs; keep the ones whose estimate clears the threshold
+        if similarity(signatures[i], signatures[j]) >= threshold:
+            parents[_find(parents, i)] = _find(parents, j)
+
+    groups: Dict[int, List[int]] = {}
+    for index in range(len(chunks)):
+        groups.setdefault(_find(parents, index), []).append(index)
+
+    kept = []
+    for members in sorted(groups.values()):
+        canonical = max(members, key=lambda index: len(chunks[index]["content"]))
+        chunk = dict(chunks[canonical])
+        duplicates = [_source(chunks[index]) for index in members if index != canonical]
+        if duplicates:
+            metadata = json.loads(chunk.get("doc_metadata") or "{}")
+            metadata["duplicates"] = duplicates
+            chunk["doc_metadata"] = json.dumps(metadata)
+        kept.append((canonical, chunk))
+    kept = [chunk for _, chunk in sorted(kept, key=lambda item: item[0])]
+
+    removed = len(chunks) - len(kept)
+    removed_chars = sum(len(chunk["content"]) for chunk in chunks) - sum(len(chunk["content"]) for chunk in kept)
+    report = {
+        "chunks": len(chunks),
+        "kept": len(kept),
+        "removed": removed,
+        "reduction": round(removed / len(chunks), 4) if chunks else 0.0,
+        "groups_with_duplicates": sum(1 for members in groups.values() if len(members) > 1),
+        "cross_source_groups": sum(
+            1 for members in groups.values()
+            if len({chunks[index]["source_file"] for index in members}) > 1
+        ),
+        # Each removed chunk also saves an embedding call and a 1536-float vector
+        "removed_chars": removed_chars,
+        "removed_vector_bytes": removed * 1536 * 4
+    }
+    return kept, report
+
+
+def redundant_slot_rate(results: List[str], threshold: float = CHUNK_DEDUP_THRESHOLD,
+                        hasher: Optional[MinHasher] = None) -> float:
+    """Share of retrieved chunks that are near-copies of a higher-ranked result."""
+    if len(results) < 2:
+        return 0.0
+    hasher = hasher or MinHasher()
+    signatures = hasher.signatures(results)
+    redundant = sum(
+        1 for i in range(1, len(results))
+        if any(similarity(signatures[i], signatures[j]) >= threshold for j in range(i))
+    )
+    return redundant / len(results)
+
+
+def retrieval_diversity(version: Optional[int] = None, samples: int = 100, k: int = 5) -> Dict:
+    """
+    Measure how many top-k slots near-copies take up in a knowledge version.
+
+    Queries with the stored vectors of sampled chunks; comparing a build without
+    deduplication to one with it shows the retrieval diversity gained.
+    """
+    from sqlalchemy import select, func
+    from database import engine, KnowledgeDocument, vector_binary, knowledge_search_query, knowledge_version_filter
+
+    hasher = MinHasher()
+    with engine.connect() as connection:
+        queries = connection.execute(
+            select(vector_binary(KnowledgeDocument.embedding))
+            .where(knowledge_version_filter(version), KnowledgeDocument.embedding.isnot(None))
+            .order_by(func.random()).limit(samples)
+        ).scalars().all()
+        rates = [
+            redundant_slot_rate(
+                [row.content for row in connection.execute(
+                    knowledge_search_query(embedding.tolist(), k, version=version)
+                )],
+                hasher=hasher
+            )
+            for embedding in queries
+        ]
+
+    return {
+        "samples": len(rates),
+        "k": k,
+        "redundant_slot_rate": round(float(np.mean(rates)), 4) if rates else None,
+        "distinct_results_per_query": round(k * (1 - float(np.mean(rates))), 2) if rates else None
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # python chunk_dedup.py [report [PDF_DIRECTORY] | diversity [VERSION]]
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if command == "diversity":
+        print(json.dumps(retrieval_diversity(int(sys.argv[2]) if len(sys.argv) > 2 else None), indent=2))
+    else:
+        from rag_system import TherapeuticRAG
+        rag = TherapeuticRAG(os.getenv("OPENAI_API_KEY", "unused"))
+        chunks = rag.load_pdf_documents(sys.argv[2] if len(sys.argv) > 2 else "knowledge_base", deduplicate=False)
+        started = time.perf_counter()
+        _, report = deduplicate_chunks(chunks)
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,399 @@
+"""
+Embedded single-node storage backend: SQLite in WAL mode for relational data and
+memory-mapped NumPy matrices for embeddings. Needs no database server.
+"""
+
+import os
+import uuid
+import sqlite3
+import threading
+import logging
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict
+import numpy as np
+from storage import StorageBackend
+from user_cache import TurnContext
+from history_buffer import HistoryEntry
+from embedding_space_types import LEGACY_SPACE
+
+logger = logging.getLogger(__name__)
+
+# Embedded storage configuration
+EMBEDDED_DATA_DIR = os.getenv("EMBEDDED_DATA_DIR", "data/embedded")
+EMBEDDED_VECTOR_DIM = int(os.getenv("EMBEDDED_VECTOR_DIM", "1536"))
+
+# Row shapes matching what the PostgreSQL queries return
+KnowledgeRow = namedtuple("KnowledgeRow", ["content", "distance"])
+MemoryRow = namedtuple("MemoryRow", ["id", "conversation_id", "content", "timestamp", "embedding"])
+SimilarMessageRow = namedtuple("SimilarMessageRow", ["id", "conversation_id", "content", "timestamp", "distance"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    whatsapp_number TEXT UNIQUE NOT NULL,
+    name TEXT,
+    first_interaction TEXT,
+    last_interaction TEXT,
+    total_messages INTEGER DEFAULT 0,
+    is_active INTEGER DEFAULT 1,
+    crisis_flag INTEGER DEFAULT 0,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    started_at TEXT,
+    last_message_at TEXT,
+    message_count INTEGER DEFAULT 0,
+    is_active INTEGER DEFAULT 1,
+    summary TEXT,
+    summarized_message_count INTEGER DEFAULT 0,
+    summarized_through TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_active ON conversations (user_id) WHERE is_active = 1;
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    vector_row INTEGER,
+    sentiment_score REAL,
+    contains_crisis_keywords INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp ON messages (conversation_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_user_memories ON messages (user_id, role, timestamp DESC)
+    WHERE vector_row IS NOT NULL;
+CREATE TABLE IF NOT EXISTS knowledge_documents (
+    id TEXT PRIMARY KEY,
+    source_file TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    vector_row INTEGER,
+    doc_metadata TEXT,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS vector_stores (
+    name TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so a dot product is cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def embedding_space_snapshot():
+    """Active and written embedding spaces, read from the registry only when the backend starts."""
+    from embedding_spaces import get_space_registry  # Imports the PostgreSQL modules
+    return get_space_registry().snapshot()
+
+
+class MmapVectorStore:
+    """
+    Append-only matrix of unit-length float32 vectors in a memory-mapped file.
+
+    The number of committed rows lives in SQLite and is updated in the same transaction
+    as the rows that reference them, so vectors written before a crash are simply overwritten.
+    """
+
+    def __init__(self, path: str, dim: int, count: int = 0):
+        """Map the file, creating it if needed."""
+        self.path = path
+        self.dim = dim
+        self.count = count
+        self._matrix = None
+        self._map(max(count, 1024))
+
+    def _map(self, capacity: int):
+        """Grow the file to at least capacity rows and map it."""
+        row_bytes = self.dim * 4
+        current = os.path.getsize(self.path) // row_bytes if os.path.exists(self.path) else 0
+        if current < capacity:
+            with open(self.path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        else:
+            capacity = current
+        self._matrix = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def append(self, vectors) -> int:
+        """Write vectors after the committed rows and return the first row number."""
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        start = self.count
+        if start + len(vectors) > len(self._matrix):
+            self._matrix.flush()
+            self._map(max(2 * len(self._matrix), start + len(vectors)))
+        self._matrix[start:start + len(vectors)] = vectors
+        self._matrix.flush()
+        return start
+
+    def get(self, rows: List[int]) -> np.ndarray:
+        """Copy out the given rows."""
+        return np.asarray(self._matrix[rows])
+
+    def search(self, query, k: int):
+        """Return (rows, similarities) of the k most similar committed vectors."""
+        if self.count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = _normalize(np.asarray([query], dtype=np.float32))[0]
+        similarities = self._matrix[:self.count] @ query
+        k = min(k, self.count)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return top, similarities[top]
+
+
+class EmbeddedStorage(StorageBackend):
+    """Single-process storage on local files; calls take microseconds, so they run inline."""
+
+    name = "embedded"
+
+    def __init__(self, data_dir: str = EMBEDDED_DATA_DIR, dim: int = EMBEDDED_VECTOR_DIM):
+        """Open the SQLite database and vector files under data_dir."""
+        self.data_dir = data_dir
+        self.dim = dim
+        self._lock = threading.Lock()
+        self.db = None
+        self.vectors: Dict[str, MmapVectorStore] = {}
+
+    def init(self):
+        """Open files and create the schema."""
+        self._check_embedding_space()
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(self.data_dir, "chatbot.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # Durable at WAL checkpoints, safe against corruption
+        self.db.executescript(SCHEMA)
+
+        for name in ("messages", "knowledge"):
+            row = self.db.execute("SELECT count FROM vector_stores WHERE name = ?", (name,)).fetchone()
+            self.vectors[name] = MmapVectorStore(
+                os.path.join(self.data_dir, f"{name}.f32"), self.dim, row[0] if row else 0
+            )
+        logger.info(f"Embedded storage ready in {self.data_dir}")
+
+    @asynccontextmanager
+    async def session(self):
+        """The embedded backend keeps no per-request state."""
+        yield self
+
+    def _check_embedding_space(self):
+        """
+        Refuse to start unless only the legacy space is in use: the vector files hold one
+        fixed-dimension matrix per table, and vectors of other spaces would be dropped.
+        """
+        active, written = embedding_space_snapshot()
+        others = [space.name for space in written if space.name != LEGACY_SPACE]
+        if active.name != LEGACY_SPACE or others:
+            raise RuntimeError(
+                f"Embedded storage only supports the {LEGACY_SPACE} embedding space, "
+                f"but {', '.join(others or [active.name])} is in use"
+            )
+        if active.dimension != self.dim:
+            raise RuntimeError(
+                f"Embedded storage holds {self.dim}-dimensional vectors, "
+                f"but the {LEGACY_SPACE} embedding space has {active.dimension} dimensions"
+            )
+
+    def _commit_vectors(self, name: str, added: int) -> int:
+        """
+        Record appended vectors inside the caller's transaction and return the new count,
+        which the caller applies to the store only once the transaction has committed.
+        """
+        count = self.vectors[name].count + added
+        self.db.execute(
+            "INSERT INTO vector_stores (name, count) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET count = excluded.count",
+            (name, count)
+        )
+        return count
+
+    async def begin_turn(self, db, whatsapp_number: str) -> TurnContext:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                user_id, crisis_flag = self.db.execute(
+                    "INSERT INTO users (id, whatsapp_number, first_interaction, last_interaction, created_at) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (whatsapp_number) DO UPDATE SET last_interaction = excluded.last_interaction "
+                    "RETURNING id, crisis_flag",
+                    (str(uuid.uuid4()), whatsapp_number, now, now, now)
+                ).fetchone()
+
+                conversation = self.db.execute(
+                    "SELECT id, summary FROM conversations WHERE user_id = ? AND is_active = 1 LIMIT 1",
+                    (user_id,)
+                ).fetchone()
+                if conversation is None:
+                    conversation = (str(uuid.uuid4()), None)
+                    self.db.execute(
+                        "INSERT INTO conversations (id, user_id, started_at, last_message_at) VALUES (?, ?, ?, ?)",
+                        (conversation[0], user_id, now, now)
+                    )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+        return TurnContext(uuid.UUID(user_id), bool(crisis_flag), uuid.UUID(conversation[0]), conversation[1])
+
+    async def finish_turn(self, db, conversation_id, user_id, messages: List[Dict],
+                          crisis: bool = False) -> List:
+        now = datetime.utcnow()
+        ids = [uuid.uuid4() for _ in messages]
+        embedded = [i for i, message in enumerate(messages) if message.get("embedding") is not None]
+
+        with self._lock:
+            vector_rows = {}
+            if embedded:
+                start = self.vectors["messages"].append([messages[i]["embedding"] for i in embedded])
+                vector_rows = {i: start + offset for offset, i in enumerate(embedded)}
+
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany(
+                    "INSERT INTO messages (id, conversation_id, user_id, role, content, timestamp, "
+                    "vector_row, contains_crisis_keywords) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (str(ids[i]), str(conversation_id), str(user_id), message["role"], message["content"],
+                         (now + timedelta(microseconds=i)).isoformat(), vector_rows.get(i),
+                         int(message.get("contains_crisis_keywords", False)))
+                        for i, message in enumerate(messages)
+                    ]
+                )
+                self.db.execute(
+                    "UPDATE conversations SET message_count = message_count + ?, last_message_at = ? WHERE id = ?",
+                    (len(messages), now.isoformat(), str(conversation_id))
+                )
+                self.db.execute(
+                    "UPDATE users SET total_messages = total_messages + 1, last_interaction = ?, "
+                    "crisis_flag = crisis_flag OR ? WHERE id = ?",
+                    (now.isoformat(), int(crisis), str(user_id))
+                )
+                count = self._commit_vectors("messages", len(embedded)) if embedded else None
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            if count is not None:
+                self.vectors["messages"].count = count
+
+        return ids
+
+    async def get_conversation_history(self, db, conversation_id, limit: int = 10) -> List:
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT role, content, timestamp FROM messages WHERE conversation_id = ? "
+                "ORDER BY timestamp DESC LIMIT ?",
+                (str(conversation_id), limit)
+            ).fetchall()
+        return [
+            HistoryEntry(role, content, datetime.fromisoformat(timestamp))
+            for role, content, timestamp in reversed(rows)
+        ]
+
+    async def search_knowledge(self, db, embedding, k: int = 5) -> List:
+        with self._lock:
+            rows, similarities = self.vectors["knowledge"].search(embedding, k)
+            if len(rows) == 0:
+                return []
+            contents = dict(self.db.execute(
+                f"SELECT vector_row, content FROM knowledge_documents "
+                f"WHERE vector_row IN ({','.join('?' * len(rows))})",
+                [int(row) for row in rows]
+            ).fetchall())
+        return [
+            KnowledgeRow(contents[int(row)], 1.0 - float(similarity))
+            for row, similarity in zip(rows, similarities) if int(row) in contents
+        ]
+
+    async def load_user_memories(self, db, user_id, limit: int = 2000, role: str = "user") -> List:
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT id, conversation_id, content, timestamp, vector_row FROM messages "
+                "WHERE user_id = ? AND role = ? AND vector_row IS NOT NULL "
+                "ORDER BY timestamp DESC LIMIT ?",
+                (str(user_id), role, limit)
+            ).fetchall()
+            embeddings = self.vectors["messages"].get([row[4] for row in rows]) if rows else []
+        return [
+            MemoryRow(uuid.UUID(message_id), uuid.UUID(conversation_id), content,
+                      datetime.fromisoformat(timestamp), embedding)
+            for (message_id, conversation_id, content, timestamp, _), embedding in zip(rows, embeddings)
+        ]
+
+    async def search_similar_messages(self, db, user_id, embedding, limit: int = 5, window_conversation_id=None,
+                                      window_start=None, role: str = "user") -> List:
+        memories = [
+            memory for memory in await self.load_user_memories(db, user_id, role=role)
+            if window_start is None or memory.conversation_id != window_conversation_id
+            or memory.timestamp < window_start
+        ]
+        if not memories:
+            return []
+        query = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        similarities = np.stack([memory.embedding for memory in memories]) @ query
+        top = np.argsort(-similarities)[:limit]
+        return [
+            SimilarMessageRow(memories[i].id, memories[i].conversation_id, memories[i].content,
+                              memories[i].timestamp, 1.0 - float(similarities[i]))
+            for i in top
+        ]
+
+    def count_knowledge_documents(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT count(*) FROM knowledge_documents").fetchone()[0]
+
+    def add_knowledge_documents(self, documents: List[Dict]):
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            start = self.vectors["knowledge"].append([document["embedding"] for document in documents])
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany(
+                    "INSERT INTO knowledge_documents (id, source_file, chunk_index, content, vector_row, "
+                    "doc_metadata, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (str(uuid.uuid4()), document["source_file"], document["chunk_index"],
+                         document["content"], start + i, document.get("doc_metadata"), now)
+                        for i, document in enumerate(documents)
+                    ]
+                )
+                count = self._commit_vectors("knowledge", len(documents))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            self.vectors["knowledge"].count = count
+
+    def statistics(self) -> Dict:
+        with self._lock:
+            counts = [
+                self.db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                for table in ("users", "messages", "knowledge_documents")
+            ]
+        return {
+            "total_users": counts[0],
+            "total_messages": counts[1],
+            "knowledge_base_documents": counts[2],
+            "source": "exact",
+            "as_of": datetime.utcnow().isoformat()
+        }
+
+    async def close(self):
+        with self._lock:
+            for store in self.vectors.values():
+                store._matrix.flush()
+            if self.db:
+                self.db.close()
+                self.db = None
@@ -0,0 +1,280 @@
+"""
+Resumable backfill of message vectors, per embedding space.
+Pages through messages by (timestamp, id), embeds missing vectors in large concurrent
+batches through the embedding scheduler, and writes them back in bulk.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+from openai import OpenAI
+from sqlalchemy import text
+from database import SessionLocal, get_watermark
+from embedding_spaces import (
+    LEGACY_SPACE, EmbeddingSpace, get_space_registry,
+    space_tables, space_vector_inserts, knowledge_vector_inserts
+)
+from embedding_scheduler import get_embedding_scheduler
+from user_memory import get_memory_index
+
+logger = logging.getLogger(__name__)
+
+# Backfill configuration
+EMBEDDING_BACKFILL_ENABLED = os.getenv("EMBEDDING_BACKFILL_ENABLED", "false").lower() == "true"
+EMBEDDING_BACKFILL_PAGE_SIZE = int(os.getenv("EMBEDDING_BACKFILL_PAGE_SIZE", "2000"))  # Rows per keyset page
+EMBEDDING_BACKFILL_REQUEST_SIZE = int(os.getenv("EMBEDDING_BACKFILL_REQUEST_SIZE", "250"))  # Texts per API call
+EMBEDDING_BACKFILL_INTERVAL_SECONDS = int(os.getenv("EMBEDDING_BACKFILL_INTERVAL_SECONDS", "600"))
+EMBEDDING_BACKFILL_SETTLE_SECONDS = int(os.getenv("EMBEDDING_BACKFILL_SETTLE_SECONDS", "120"))
+
+BACKFILL_JOB = "embedding_backfill"
+
+
+class EmbeddingBackfill:
+    """
+    Embeds messages with no vector in a space, one keyset page at a time.
+
+    The legacy space only fills in missing vectors with its registered model, never
+    re-embedding in place, since retrieval reads the whole column with one model. A model
+    change goes through a new space: it writes to its own tables, backfills knowledge
+    chunks too, and is only activated once its coverage is complete.
+    """
+
+    # Keyset page of messages after the watermark with no vector
+    FETCH_QUERY = text("""
+        SELECT id, timestamp, user_id, content FROM messages
+        WHERE timestamp >= :after_timestamp
+          AND (timestamp, id) > (:after_timestamp, :after_id)
+          AND timestamp < :settled_before
+          AND embedding IS NULL
+        ORDER BY timestamp, id
+        LIMIT :limit
+    """)
+
+    # One statement per page, matching on the full key so each row stays in its partition
+    UPDATE_QUERY = text("""
+        UPDATE messages SET embedding = CAST(embedded.embedding AS vector), embedding_model = :model
+        FROM unnest(CAST(:ids AS uuid[]), CAST(:timestamps AS timestamp[]), CAST(:embeddings AS text[]))
+            AS embedded(id, timestamp, embedding)
+        WHERE messages.id = embedded.id AND messages.timestamp = embedded.timestamp
+          AND messages.embedding IS NULL
+    """)
+
+    # Keyset page of messages after the watermark with no vector in a space's table
+    SPACE_FETCH_QUERY = """
+        SELECT id, timestamp, user_id, conversation_id, role, content FROM messages
+        WHERE timestamp >= :after_timestamp
+          AND (timestamp, id) > (:after_timestamp, :after_id)
+          AND timestamp < :settled_before
+          AND NOT EXISTS (
+              SELECT 1 FROM {table} vectors
+              WHERE vectors.message_id = messages.id AND vectors.timestamp = messages.timestamp
+          )
+        ORDER BY timestamp, id
+        LIMIT :limit
+    """
+
+    # Knowledge chunks with no vector in a space's table; few enough to need no watermark
+    SPACE_KNOWLEDGE_QUERY = """
+        SELECT id, version, content FROM knowledge_documents
+        WHERE NOT EXISTS (SELECT 1 FROM {table} vectors WHERE vectors.document_id = knowledge_documents.id)
+        ORDER BY id
+        LIMIT :limit
+    """
+
+    def __init__(self, client: OpenAI, space: Optional[EmbeddingSpace] = None,
+                 page_size: int = EMBEDDING_BACKFILL_PAGE_SIZE,
+                 request_size: int = EMBEDDING_BACKFILL_REQUEST_SIZE,
+                 settle_seconds: int = EMBEDDING_BACKFILL_SETTLE_SECONDS):
+        """Initialize with an OpenAI client, target space (legacy by default) and batching settings."""
+        self.client = client
+        self.space = space or get_space_registry().get(LEGACY_SPACE)
+        self.model = self.space.model
+        self.dimension = self.space.dimension
+        self.page_size = page_size
+        self.request_size = request_size
+        self.settle_seconds = settle_seconds
+        # Shared with every other job embedding with this model, so they split its rate limits
+        self.scheduler = get_embedding_scheduler(self.model, client)
+        # One watermark per space; the legacy one keeps its per-model name from earlier versions
+        if self.space.name == LEGACY_SPACE:
+            self.job = f"{BACKFILL_JOB}:{self.model}"
+        else:
+            self.job = f"{BACKFILL_JOB}:{self.space.name}"
+            message_table, knowledge_table = space_tables(self.space)
+            self.space_fetch_query = text(self.SPACE_FETCH_QUERY.format(table=message_table.name))
+            self.space_knowledge_query = text(self.SPACE_KNOWLEDGE_QUERY.format(table=knowledge_table.name))
+        self._last_cycle: Dict = {}
+
+    def embed_all(self, rows) -> List[List[float]]:
+        """Embed the content of rows through the model's rate-limit-aware scheduler, keeping their order."""
+        return self.scheduler.embed(
+            [row.content for row in rows], self.dimension, subject=BACKFILL_JOB, request_size=self.request_size
+        )
+
+    def run_once(self, db) -> int:
+        """Embed one page, then write it and advance the watermark in one transaction. Returns rows embedded."""
+        watermark = get_watermark(db, self.job)
+        params = {
+            "after_timestamp": watermark.last_timestamp or datetime.min,
+            "after_id": str(watermark.last_id or "00000000-0000-0000-0000-000000000000"),
+            "settled_before": datetime.utcnow() - timedelta(seconds=self.settle_seconds),
+            "limit": self.page_size
+        }
+        if self.space.name == LEGACY_SPACE:
+            rows = db.execute(self.FETCH_QUERY, params).all()
+        else:
+            rows = db.execute(self.space_fetch_query, params).all()
+        if not rows:
+            db.rollback()
+            return 0
+        # Don't hold a transaction open across the API calls
+        db.commit()
+
+        embeddings = self.embed_all(rows)
+
+        if self.space.name == LEGACY_SPACE:
+            db.execute(self.UPDATE_QUERY, {
+                "ids": [str(row.id) for row in rows],
+                "timestamps": [row.timestamp for row in rows],
+                "embeddings": [json.dumps(embedding) for embedding in embeddings],
+                "model": self.model
+            })
+        else:
+            for statement in space_vector_inserts({self.space.name: [
+                {"message_id": row.id, "timestamp": row.timestamp, "user_id": row.user_id,
+                 "conversation_id": row.conversation_id, "role": row.role, "embedding": embedding}
+                for row, embedding in zip(rows, embeddings)
+            ]}):
+                db.execute(statement)
+        watermark.last_timestamp = rows[-1].timestamp
+        watermark.last_id = rows[-1].id
+        watermark.processed = (watermark.processed or 0) + len(rows)
+        db.commit()
+
+        # Cached memory indexes may lack the new vectors
+        memory = get_memory_index()
+        for user_id in {row.user_id for row in rows}:
+            memory.evict(user_id)
+        return len(rows)
+
+    def run_knowledge_once(self, db) -> int:
+        """Embed one page of knowledge chunks missing from a non-legacy space. Returns chunks embedded."""
+        rows = db.execute(self.space_knowledge_query, {"limit": self.page_size}).all()
+        db.commit()
+        if not rows:
+            return 0
+
+        embeddings = self.embed_all(rows)
+        for statement in knowledge_vector_inserts(
+            [(row.id, row.version, {self.space.name: embedding}) for row, embedding in zip(rows, embeddings)]
+        ):
+            db.execute(statement)
+        db.commit()
+        return len(rows)
+
+    def run_cycle(self) -> int:
+        """Drain messages (and knowledge chunks, outside the legacy space) needing vectors page by page."""
+        db = SessionLocal()
+        total = 0
+        started = time.monotonic()
+
+        try:
+            while True:
+                embedded = self.run_once(db)
+                total += embedded
+                if embedded < self.page_size:
+                    break
+            while self.space.name != LEGACY_SPACE:
+                embedded = self.run_knowledge_once(db)
+                total += embedded
+                if embedded < self.page_size:
+                    break
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error in embedding backfill cycle: {e}")
+        finally:
+            db.close()
+
+        elapsed = time.monotonic() - started
+        self._last_cycle = {
+            "embedded": total,
+            "space": self.space.name,
+            "model": self.model,
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+            "finished_at": datetime.utcnow().isoformat()
+        }
+        if total:
+            logger.info(
+                f"Embedded {total} rows into space {self.space.name} ({self.model}) in {elapsed:.1f}s "
+                f"({self._last_cycle['messages_per_second']} rows/s)"
+            )
+        return total
+
+    def reset(self):
+        """Start the next cycle from the oldest message."""
+        db = SessionLocal()
+        try:
+            watermark = get_watermark(db, self.job)
+            watermark.last_timestamp = None
+            watermark.last_id = None
+            watermark.processed = 0
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        """Return throughput of the last cycle."""
+        return dict(self._last_cycle)
+
+
+# Singleton instances, one per embedding space
+_backfill_instances: Dict[str, EmbeddingBackfill] = {}
+
+
+def get_embedding_backfill(space_name: str = LEGACY_SPACE) -> EmbeddingBackfill:
+    """Get or create the embedding backfill instance for a space."""
+    if space_name not in _backfill_instances:
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        if not openai_api_key or openai_api_key == "your_openai_api_key_here":
+            raise ValueError("OPENAI_API_KEY environment variable not set")
+
+        space = get_space_registry().get(space_name)
+        if space is None:
+            raise ValueError(f"Unknown embedding space {space_name!r}")
+        _backfill_instances[space_name] = EmbeddingBackfill(OpenAI(api_key=openai_api_key), space)
+
+    return _backfill_instances[space_name]
+
+
+async def run_embedding_backfill_loop(interval: int = EMBEDDING_BACKFILL_INTERVAL_SECONDS):
+    """Periodically backfill every written space in a worker thread until cancelled."""
+    logger.info(f"Embedding backfill started (every {interval}s)")
+
+    while True:
+        for space in get_space_registry().written():
+            await asyncio.to_thread(get_embedding_backfill(space.name).run_cycle)
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # `python embedding_backfill.py [SPACE] [restart]`; restart walks all messages again from the oldest
+    arguments = sys.argv[1:]
+    restart = "restart" in arguments
+    names = [argument for argument in arguments if argument != "restart"]
+    backfill = get_embedding_backfill(names[0] if names else LEGACY_SPACE)
+    if restart:
+        backfill.reset()
+    backfill.run_cycle()
+    print(backfill.stats())
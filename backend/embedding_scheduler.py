@@ -0,0 +1,340 @@
+"""
+Rate-limit-aware scheduling of bulk embedding requests.
+Packs texts into token-sized requests and admits them against a sliding one-minute window of the
+embedding model's own request and token limits, learned from response headers. Concurrency adapts
+to 429s, and failed requests are retried with jittered exponential backoff.
+"""
+
+import os
+import re
+import time
+import random
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Callable
+from openai import OpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from embedding_spaces import embedding_options
+from rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Provider limits per model until response headers report the real ones
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "3000"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+EMBEDDING_RATE_HEADROOM = float(os.getenv("EMBEDDING_RATE_HEADROOM", "0.9"))  # Share of each limit to use
+# Request packing and concurrency
+EMBEDDING_REQUEST_SIZE = int(os.getenv("EMBEDDING_REQUEST_SIZE", "100"))  # Texts per API call
+EMBEDDING_REQUEST_MAX_TOKENS = int(os.getenv("EMBEDDING_REQUEST_MAX_TOKENS", "50000"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+# Also spend the chat rate limiter's spare global budget, for deployments where chat and
+# embeddings share one provider limit; providers usually limit each model separately
+EMBEDDING_SHARE_CHAT_BUDGET = os.getenv("EMBEDDING_SHARE_CHAT_BUDGET", "false").lower() == "true"
+
+WINDOW_SECONDS = 60.0
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# Errors worth retrying with backoff rather than failing the job
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate limit reset header such as "20ms", "1s" or "6m0s"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts) if parts else None
+
+
+def retry_after(headers) -> Optional[float]:
+    """Seconds the provider asked to wait, from retry-after-ms or retry-after."""
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+class EmbeddingScheduler:
+    """
+    Runs embedding requests for one model as fast as its rate limits allow.
+
+    Requests are admitted while the last minute's requests and tokens stay under the
+    limits, and while fewer than the adaptive concurrency are in flight. The same
+    instance is shared by every job embedding with the model, so they share the budget.
+    With share_chat_budget, each request must also fit the chat rate limiter's spare
+    global budget.
+    """
+
+    def __init__(self, client: OpenAI, model: str,
+                 requests_per_minute: int = EMBEDDING_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = EMBEDDING_TOKENS_PER_MINUTE,
+                 max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                 request_size: int = EMBEDDING_REQUEST_SIZE,
+                 request_max_tokens: int = EMBEDDING_REQUEST_MAX_TOKENS,
+                 max_retries: int = EMBEDDING_MAX_RETRIES,
+                 share_chat_budget: bool = EMBEDDING_SHARE_CHAT_BUDGET):
+        """Initialize with an OpenAI client, the model and the starting limits."""
+        # The client's own retries would hide 429s from the scheduler
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.request_size = request_size
+        self.request_max_tokens = request_max_tokens
+        self.max_retries = max_retries
+        self.share_chat_budget = share_chat_budget
+        self.limiter = get_rate_limiter()
+        self._count_tokens = None
+
+        self._condition = threading.Condition()
+        # [admitted_at, tokens] of requests in the last minute; tokens are corrected from usage
+        self._window = deque()
+        self._window_tokens = 0
+        self._in_flight = 0
+        self._concurrency = float(max(1, max_concurrency // 2))
+        self._paused_until = 0.0
+        self._stats = dict.fromkeys(
+            ["requests", "texts", "tokens", "estimated_tokens", "rate_limited", "retries", "failures"], 0
+        )
+
+    def estimate_tokens(self, texts: List[str]) -> List[int]:
+        """Token count of each text, from tiktoken or its approximation."""
+        if self._count_tokens is None:
+            # text_chunker falls back to an approximation when tiktoken's encoding is unavailable
+            from text_chunker import get_token_counter
+            self._count_tokens = get_token_counter()
+        return self._count_tokens(texts)
+
+    def request_token_cap(self) -> int:
+        """Most estimated tokens one request may carry and still be admitted."""
+        cap = min(self.request_max_tokens, int(self.tokens_per_minute * EMBEDDING_RATE_HEADROOM))
+        if self.share_chat_budget and self.limiter.enabled:
+            cap = min(cap, int(self.limiter.background_token_capacity()))
+        return cap
+
+    def _batches(self, texts: List[str], request_size: int) -> List[tuple]:
+        """
+        (start, texts, estimated tokens) of each request, within the size and token caps.
+
+        Raises ValueError for a text larger than the token cap on its own, since its
+        request could never be admitted.
+        """
+        cap = self.request_token_cap()
+        batches = []
+        start = 0
+        tokens = 0
+        for index, count in enumerate(self.estimate_tokens(texts)):
+            if count > cap:
+                raise ValueError(f"Text {index} is estimated at {count} tokens, over the {cap}-token request cap")
+            if index > start and (index - start >= request_size or tokens + count > cap):
+                batches.append((start, texts[start:index], tokens))
+                start, tokens = index, 0
+            tokens += count
+        if start < len(texts):
+            batches.append((start, texts[start:], tokens))
+        return batches
+
+    def _expire(self, now: float):
+        """Drop window entries older than a minute."""
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _admit(self, tokens: int) -> list:
+        """Block until the window, pause and concurrency limit allow a request, then record it."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                # Re-read each time, since response headers may have updated the limits
+                request_limit = self.requests_per_minute * EMBEDDING_RATE_HEADROOM
+                token_limit = self.tokens_per_minute * EMBEDDING_RATE_HEADROOM
+                waits = []
+                if now < self._paused_until:
+                    waits.append(self._paused_until - now)
+                if self._in_flight >= int(self._concurrency):
+                    waits.append(1.0)  # Woken early when a request finishes
+                if len(self._window) >= request_limit or (
+                    self._window and self._window_tokens + tokens > token_limit
+                ):
+                    waits.append(self._window[0][0] + WINDOW_SECONDS - now)
+                if not waits:
+                    entry = [now, tokens]
+                    self._window.append(entry)
+                    self._window_tokens += tokens
+                    self._in_flight += 1
+                    return entry
+                self._condition.wait(max(0.01, min(waits)))
+
+    def _release(self, entry: list, used: int):
+        """Finish a request, correcting its window tokens to what was actually used."""
+        with self._condition:
+            self._in_flight -= 1
+            # Entries already expired out of the window no longer count
+            if self._window and entry[0] >= self._window[0][0]:
+                self._window_tokens += used - entry[1]
+                entry[1] = used
+            self._condition.notify_all()
+
+    def _observe(self, headers):
+        """Adopt the provider's reported limits and pause when it reports them exhausted."""
+        if headers is None:
+            return
+        with self._condition:
+            try:
+                if headers.get("x-ratelimit-limit-requests"):
+                    self.requests_per_minute = int(headers["x-ratelimit-limit-requests"])
+                if headers.get("x-ratelimit-limit-tokens"):
+                    self.tokens_per_minute = int(headers["x-ratelimit-limit-tokens"])
+                # Other clients of the same organization use the limits too
+                for kind, low in (("requests", 1), ("tokens", self.request_max_tokens)):
+                    remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if remaining is not None and reset and int(remaining) < low:
+                        self._paused_until = max(self._paused_until, time.monotonic() + reset)
+            except ValueError:
+                pass
+
+    def _throttle(self, delay: float):
+        """Halve concurrency and pause every worker after a 429."""
+        with self._condition:
+            self._concurrency = max(1.0, self._concurrency / 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._stats["rate_limited"] += 1
+
+    def _succeeded(self):
+        """Additive increase: about one more concurrent request per round of successes."""
+        with self._condition:
+            self._concurrency = min(float(self.max_concurrency), self._concurrency + 1 / self._concurrency)
+            self._condition.notify_all()
+
+    def _request(self, batch: tuple, dimension: int, subject: str,
+                 on_usage: Optional[Callable[[int], None]]) -> List[List[float]]:
+        """Send one request when admitted, retrying transient errors with jittered backoff."""
+        _, texts, estimated = batch
+        for attempt in range(self.max_retries + 1):
+            if self.share_chat_budget:
+                # Wait for spare global budget so live traffic keeps its reserved share
+                while not self.limiter.acquire_background(estimated):
+                    time.sleep(1.0)
+            entry = self._admit(estimated)
+            try:
+                raw = self.client.embeddings.with_raw_response.create(
+                    input=texts, model=self.model, **embedding_options(self.model, dimension)
+                )
+                response = raw.parse()
+            except RETRYABLE_ERRORS as e:
+                self._release(entry, 0)
+                self.limiter.record_background_usage(subject, estimated, 0, self.share_chat_budget)
+                headers = getattr(getattr(e, "response", None), "headers", None)
+                self._observe(headers)
+                # Full jitter keeps workers that failed together from retrying together
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                if isinstance(e, RateLimitError):
+                    delay = max(delay, retry_after(headers) or 0.0)
+                    self._throttle(delay)
+                if attempt == self.max_retries:
+                    with self._condition:
+                        self._stats["failures"] += 1
+                    raise
+                with self._condition:
+                    self._stats["retries"] += 1
+                logger.warning(f"Embedding request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Give back the slot, or the failed request would hold it forever
+                self._release(entry, 0)
+                self.limiter.record_background_usage(subject, estimated, 0, self.share_chat_budget)
+                with self._condition:
+                    self._stats["failures"] += 1
+                raise
+
+            used = response.usage.total_tokens if response.usage else estimated
+            self._release(entry, used)
+            self._observe(raw.headers)
+            self._succeeded()
+            self.limiter.record_background_usage(subject, estimated, used, self.share_chat_budget)
+            if on_usage:
+                on_usage(used)
+            with self._condition:
+                self._stats["requests"] += 1
+                self._stats["texts"] += len(texts)
+                self._stats["tokens"] += used
+                self._stats["estimated_tokens"] += estimated
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed(self, texts: List[str], dimension: int, subject: str = "embedding_scheduler",
+              on_usage: Optional[Callable[[int], None]] = None,
+              request_size: Optional[int] = None) -> List[List[float]]:
+        """
+        Embed texts at the given dimension, returning vectors in input order.
+
+        Raises the last error when a request still fails after max_retries; usage is
+        recorded under subject in the rate limiter.
+        """
+        # The API rejects empty input, so blank texts embed as a single space
+        texts = [content or " " for content in texts]
+        batches = self._batches(texts, request_size or self.request_size)
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(batches)))) as executor:
+            results = executor.map(lambda batch: self._request(batch, dimension, subject, on_usage), batches)
+            for (start, batch_texts, _), vectors in zip(batches, results):
+                embeddings[start:start + len(batch_texts)] = vectors
+        return embeddings
+
+    def stats(self) -> Dict:
+        """Limits, window usage, concurrency and totals."""
+        with self._condition:
+            self._expire(time.monotonic())
+            return {
+                "model": self.model,
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "window_requests": len(self._window),
+                "window_tokens": self._window_tokens,
+                "in_flight": self._in_flight,
+                "concurrency": round(self._concurrency, 2),
+                "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 3),
+                "share_chat_budget": self.share_chat_budget,
+                **self._stats
+            }
+
+
+# Singleton instances, one per model so jobs embedding with a model share its limits
+_schedulers: Dict[str, EmbeddingScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_embedding_scheduler(model: str, client: Optional[OpenAI] = None) -> EmbeddingScheduler:
+    """Get or create the scheduler for a model, using client or one built from OPENAI_API_KEY."""
+    with _schedulers_lock:
+        if model not in _schedulers:
+            if client is None:
+                openai_api_key = os.getenv("OPENAI_API_KEY")
+                if not openai_api_key or openai_api_key == "your_openai_api_key_here":
+                    raise ValueError("OPENAI_API_KEY environment variable not set")
+                client = OpenAI(api_key=openai_api_key)
+            _schedulers[model] = EmbeddingScheduler(client, model)
+        return _schedulers[model]
+
+
+def scheduler_stats() -> Dict[str, Dict]:
+    """Stats of every scheduler created in this process."""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return {scheduler.model: scheduler.stats() for scheduler in schedulers}
@@ -0,0 +1,22 @@
+"""
+Embedding space types shared by the storage backends.
+Kept free of database imports so the embedded backend loads without the PostgreSQL modules.
+"""
+
+import os
+from collections import namedtuple
+
+# Embedding configuration for the legacy space, stored in messages.embedding and knowledge_documents.embedding;
+# the model is fixed when the legacy space is first registered, later changes go through a new space
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_DIMENSION = 1536
+
+EmbeddingSpace = namedtuple("EmbeddingSpace", ["name", "model", "dimension", "state"])
+
+LEGACY_SPACE = "legacy"
+WRITTEN_STATES = ("active", "shadow")
+
+
+def legacy_space(state: str = "active", model: str = EMBEDDING_MODEL) -> EmbeddingSpace:
+    """The space behind the original vector columns, using its registered model once known."""
+    return EmbeddingSpace(LEGACY_SPACE, model, EMBEDDING_DIMENSION, state)
@@ -0,0 +1,596 @@
+"""
+Versioned embedding spaces for message and knowledge vectors.
+A space pairs an embedding model with a dimension, truncated Matryoshka-style for text-embedding-3 models.
+New spaces are dual-written and backfilled next to the active one, compared, then activated atomically.
+"""
+
+import os
+import re
+import time
+import asyncio
+import threading
+import logging
+from datetime import datetime
+from typing import List, Dict, Optional, Callable, Tuple
+import numpy as np
+from sqlalchemy import MetaData, Table, Column, DateTime, String, Integer, Index, select, func, text, or_, literal_column
+from sqlalchemy.dialects.postgresql import UUID, insert
+from database import (
+    engine, SessionLocal, Message, KnowledgeDocument, EmbeddingSpaceRecord,
+    vector_binary, vector_type, knowledge_version_filter
+)
+from storage import STORAGE_BACKEND
+from embedding_space_types import (
+    EMBEDDING_MODEL, EMBEDDING_DIMENSION, EmbeddingSpace, LEGACY_SPACE, WRITTEN_STATES, legacy_space
+)
+
+logger = logging.getLogger(__name__)
+
+# Embedding space configuration
+EMBEDDING_SPACE_REFRESH_SECONDS = float(os.getenv("EMBEDDING_SPACE_REFRESH_SECONDS", "10"))
+EMBEDDING_SPACE_MIN_COVERAGE = float(os.getenv("EMBEDDING_SPACE_MIN_COVERAGE", "0.99"))
+
+SPACE_NAME_PATTERN = re.compile(r"^[a-z][a-z0-9_]{0,29}$")
+
+# Vector tables of non-legacy spaces, kept out of Base.metadata so create_all never sees them
+_space_metadata = MetaData()
+_space_tables: Dict[str, Tuple[Table, Table]] = {}
+
+
+def embedding_options(model: str, dimension: int) -> Dict:
+    """Extra embeddings.create arguments; only text-embedding-3 models accept a dimension."""
+    return {"dimensions": dimension} if model.startswith("text-embedding-3") else {}
+
+
+def truncate_embedding(embedding, dimension: int) -> List[float]:
+    """Keep the first `dimension` values of a Matryoshka embedding, renormalized to unit length."""
+    vector = np.asarray(embedding[:dimension], dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).tolist()
+
+
+def request_dimensions(spaces: List[EmbeddingSpace]) -> Dict[str, int]:
+    """Dimension to request per model: the largest any of its spaces uses, so one call serves them all."""
+    dimensions = {}
+    for space in spaces:
+        dimensions[space.model] = max(dimensions.get(space.model, 0), space.dimension)
+    return dimensions
+
+
+def split_embeddings(model_embeddings: Dict[str, List[float]], spaces: List[EmbeddingSpace]) -> Dict[str, List[float]]:
+    """Map each space to its model's embedding, truncated to the space's dimension."""
+    embeddings = {}
+    for space in spaces:
+        embedding = model_embeddings[space.model]
+        if len(embedding) != space.dimension:
+            embedding = truncate_embedding(embedding, space.dimension)
+        embeddings[space.name] = embedding
+    return embeddings
+
+
+def space_tables(space: EmbeddingSpace) -> Tuple[Table, Table]:
+    """Message and knowledge vector tables of a non-legacy space."""
+    tables = _space_tables.get(space.name)
+    if tables is None:
+        # Message vectors carry the columns per-user retrieval filters on, so it never touches messages
+        message_vectors = Table(
+            f"message_vectors_{space.name}", _space_metadata,
+            Column("message_id", UUID(as_uuid=True), primary_key=True),
+            Column("timestamp", DateTime, primary_key=True),
+            Column("user_id", UUID(as_uuid=True), nullable=False),
+            Column("conversation_id", UUID(as_uuid=True), nullable=False),
+            Column("role", String(20), nullable=False),
+            Column("embedding", vector_type(space.dimension), nullable=False),
+        )
+        Index(
+            f"idx_message_vectors_{space.name}_user",
+            message_vectors.c.user_id, message_vectors.c.role, message_vectors.c.timestamp.desc()
+        )
+        # Knowledge vectors carry their chunk's version; each version has its own partial ANN
+        # index (see knowledge_versions.create_index), like knowledge_documents.embedding
+        knowledge_vectors = Table(
+            f"knowledge_vectors_{space.name}", _space_metadata,
+            Column("document_id", UUID(as_uuid=True), primary_key=True),
+            Column("version", Integer, nullable=False),
+            Column("embedding", vector_type(space.dimension), nullable=False),
+        )
+        tables = _space_tables[space.name] = (message_vectors, knowledge_vectors)
+    return tables
+
+
+def knowledge_index_name(space: EmbeddingSpace, version: int) -> str:
+    """Name of a knowledge version's partial ANN index in a non-legacy space."""
+    return f"idx_knowledge_vectors_{space.name}_v{int(version)}_embedding"
+
+
+def _migrate_knowledge_vectors(connection, space: EmbeddingSpace):
+    """Add the version column to a space's knowledge vectors created before it, replacing the global index."""
+    _, knowledge_table = space_tables(space)
+    table = knowledge_table.name
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS version INTEGER"))
+    connection.execute(text(
+        f"UPDATE {table} SET version = knowledge_documents.version FROM knowledge_documents "
+        f"WHERE knowledge_documents.id = {table}.document_id AND {table}.version IS NULL"
+    ))
+    # Vectors whose chunk is gone can never be returned
+    connection.execute(text(f"DELETE FROM {table} WHERE version IS NULL"))
+    connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN version SET NOT NULL"))
+    connection.execute(text(f"DROP INDEX IF EXISTS idx_knowledge_vectors_{space.name}_embedding"))
+
+
+class SpaceRegistry:
+    """
+    Registered embedding spaces, cached for a short TTL so cutovers reach every process quickly.
+
+    In the server, run_refresh_loop reloads the cache off the event loop and readers only
+    read it. Other processes reload on first read after the TTL.
+    """
+
+    def __init__(self, ttl: float = EMBEDDING_SPACE_REFRESH_SECONDS, enabled: bool = STORAGE_BACKEND == "postgres"):
+        """Initialize with only the legacy space; the registry table is read on first use."""
+        self.ttl = ttl
+        self.enabled = enabled
+        self._spaces: Dict[str, EmbeddingSpace] = {LEGACY_SPACE: legacy_space()}
+        self._loaded_at: Optional[float] = None
+        self._listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._refreshed_in_background = False
+
+    def _current(self):
+        """Load the registry on first use; after that only refresh here when no refresh loop runs."""
+        if self._loaded_at is None or not self._refreshed_in_background:
+            self._refresh()
+
+    async def run_refresh_loop(self):
+        """Reload the registry every TTL in a worker thread until cancelled."""
+        self._refreshed_in_background = True
+        try:
+            while True:
+                await asyncio.to_thread(self._refresh, True)
+                await asyncio.sleep(self.ttl)
+        finally:
+            self._refreshed_in_background = False
+
+    def _refresh(self, force: bool = False):
+        """Reload spaces once the TTL has passed, notifying listeners when the active space changed."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            previous = self._active_name()
+            try:
+                db = SessionLocal()
+                try:
+                    records = db.query(EmbeddingSpaceRecord).all()
+                finally:
+                    db.close()
+            except Exception as e:
+                logger.error(f"Error loading embedding spaces, keeping previous: {e}")
+                self._loaded_at = time.monotonic()
+                return
+
+            spaces = {}
+            for record in records:
+                if record.name == LEGACY_SPACE:
+                    spaces[LEGACY_SPACE] = legacy_space(record.state, record.model)
+                else:
+                    spaces[record.name] = EmbeddingSpace(record.name, record.model, record.dimension, record.state)
+            self._spaces = spaces or {LEGACY_SPACE: legacy_space()}
+            self._loaded_at = time.monotonic()
+            changed = previous != self._active_name()
+
+        if changed:
+            logger.info(f"Active embedding space is now {self.active().name}")
+            for listener in self._listeners:
+                listener()
+
+    def _active_name(self) -> str:
+        """Name of the active space in the current snapshot."""
+        return next((space.name for space in self._spaces.values() if space.state == "active"), LEGACY_SPACE)
+
+    def on_activate(self, listener: Callable[[], None]):
+        """Call listener whenever another space becomes active, e.g. to drop cached vectors."""
+        self._listeners.append(listener)
+
+    def spaces(self) -> List[EmbeddingSpace]:
+        """All registered spaces."""
+        self._current()
+        return list(self._spaces.values())
+
+    def get(self, name: str) -> Optional[EmbeddingSpace]:
+        """A space by name."""
+        self._current()
+        return self._spaces.get(name)
+
+    def active(self) -> EmbeddingSpace:
+        """The space reads use."""
+        return self.snapshot()[0]
+
+    def written(self) -> List[EmbeddingSpace]:
+        """Spaces new vectors are written to."""
+        return self.snapshot()[1]
+
+    def snapshot(self) -> Tuple[EmbeddingSpace, List[EmbeddingSpace]]:
+        """Active and written spaces from one consistent view of the registry."""
+        self._current()
+        spaces = self._spaces
+        fallback = spaces[LEGACY_SPACE]._replace(state="active") if LEGACY_SPACE in spaces else legacy_space()
+        active = next((space for space in spaces.values() if space.state == "active"), fallback)
+        return active, [space for space in spaces.values() if space.state in WRITTEN_STATES]
+
+    def read_space(self, embedding=None) -> EmbeddingSpace:
+        """
+        Space to read with, normally the active one.
+
+        A query vector computed just before a cutover has the old space's dimension;
+        reading the written space it matches keeps that request working.
+        """
+        active, written = self.snapshot()
+        if embedding is None or len(embedding) == active.dimension:
+            return active
+        return next((space for space in written if space.dimension == len(embedding)), active)
+
+    def ensure_tables(self):
+        """Register the legacy space and create vector tables for registered spaces."""
+        with engine.begin() as connection:
+            connection.execute(
+                insert(EmbeddingSpaceRecord).values(
+                    name=LEGACY_SPACE, model=EMBEDDING_MODEL, dimension=EMBEDDING_DIMENSION,
+                    state="active", activated_at=datetime.utcnow()
+                ).on_conflict_do_nothing()
+            )
+        self._refresh(force=True)
+        registered = self._spaces[LEGACY_SPACE].model
+        if registered != EMBEDDING_MODEL:
+            # Re-embedding in place would mix models in one column while queries switch at once
+            logger.warning(
+                f"EMBEDDING_MODEL={EMBEDDING_MODEL} differs from the {LEGACY_SPACE} space's model {registered}, "
+                f"which stays in use; create a space for {EMBEDDING_MODEL}, backfill and activate it instead"
+            )
+        for space in self._spaces.values():
+            if space.name != LEGACY_SPACE and space.state != "retired":
+                _space_metadata.create_all(engine, tables=list(space_tables(space)))
+                with engine.begin() as connection:
+                    _migrate_knowledge_vectors(connection, space)
+
+    def create(self, name: str, model: str, dimension: int) -> EmbeddingSpace:
+        """Register a shadow space, which starts receiving dual writes within one refresh interval."""
+        if not SPACE_NAME_PATTERN.match(name) or name == LEGACY_SPACE:
+            raise ValueError(f"Invalid embedding space name {name!r}")
+        if not model.startswith("text-embedding-3") and dimension != EMBEDDING_DIMENSION:
+            raise ValueError(f"{model} cannot be truncated; only text-embedding-3 models support other dimensions")
+
+        space = EmbeddingSpace(name, model, dimension, "shadow")
+        _space_metadata.create_all(engine, tables=list(space_tables(space)))
+        with engine.begin() as connection:
+            connection.execute(insert(EmbeddingSpaceRecord).values(
+                name=name, model=model, dimension=dimension, state="shadow"
+            ))
+        self._refresh(force=True)
+        # Every kept knowledge version gets its index in the new space
+        from knowledge_versions import get_knowledge_versions  # knowledge_versions imports this module
+        get_knowledge_versions().create_indexes()
+        logger.info(f"Created embedding space {name} ({model}, {dimension} dimensions)")
+        return space
+
+    def coverage(self, name: str) -> Dict[str, float]:
+        """Fraction of messages and knowledge chunks that have a vector in the space."""
+        space = self.get(name)
+        if space is None:
+            raise ValueError(f"Unknown embedding space {name!r}")
+
+        with engine.connect() as connection:
+            messages = connection.execute(select(func.count()).select_from(Message)).scalar()
+            documents = connection.execute(select(func.count()).select_from(KnowledgeDocument)).scalar()
+            if name == LEGACY_SPACE:
+                message_vectors = connection.execute(select(func.count(Message.embedding))).scalar()
+                document_vectors = connection.execute(select(func.count(KnowledgeDocument.embedding))).scalar()
+            else:
+                message_table, knowledge_table = space_tables(space)
+                message_vectors = connection.execute(select(func.count()).select_from(message_table)).scalar()
+                document_vectors = connection.execute(select(func.count()).select_from(knowledge_table)).scalar()
+
+        return {
+            "messages": message_vectors / messages if messages else 1.0,
+            "knowledge_documents": document_vectors / documents if documents else 1.0
+        }
+
+    def activate(self, name: str, min_coverage: float = EMBEDDING_SPACE_MIN_COVERAGE, force: bool = False):
+        """
+        Make a space the one reads use, in a single transaction.
+
+        The previously active space becomes a shadow and keeps receiving writes, so
+        activating it again rolls the cutover back.
+        """
+        space = self.get(name)
+        if space is None or space.state == "retired":
+            raise ValueError(f"Embedding space {name!r} is not registered or is retired")
+        if not force:
+            coverage = self.coverage(name)
+            if min(coverage.values()) < min_coverage:
+                raise ValueError(f"Embedding space {name} is not backfilled enough to activate: {coverage}")
+
+        with engine.begin() as connection:
+            # Lock the registry so concurrent activations serialize
+            connection.execute(text("LOCK TABLE embedding_spaces IN SHARE ROW EXCLUSIVE MODE"))
+            connection.execute(text(
+                "UPDATE embedding_spaces SET state = 'shadow' WHERE state = 'active' AND name <> :name"
+            ), {"name": name})
+            connection.execute(text(
+                "UPDATE embedding_spaces SET state = 'active', activated_at = now() WHERE name = :name"
+            ), {"name": name})
+        self._refresh(force=True)
+        logger.info(f"Activated embedding space {name}")
+
+    def retire(self, name: str):
+        """Stop writing a shadow space; its vectors stay in place."""
+        space = self.get(name)
+        if space is None:
+            raise ValueError(f"Unknown embedding space {name!r}")
+        if space.state == "active":
+            raise ValueError("Activate another space before retiring the active one")
+        with engine.begin() as connection:
+            connection.execute(text(
+                "UPDATE embedding_spaces SET state = 'retired' WHERE name = :name"
+            ), {"name": name})
+        self._refresh(force=True)
+        logger.info(f"Retired embedding space {name}")
+
+    def stats(self) -> Dict:
+        """Return registered spaces and which one is active."""
+        return {
+            "active": self.active().name,
+            "spaces": {space.name: {"model": space.model, "dimension": space.dimension, "state": space.state}
+                       for space in self.spaces()}
+        }
+
+
+def split_space_vectors(rows: List[Dict]) -> Tuple[List[Dict], Dict[str, List[Dict]]]:
+    """Separate message rows from the vectors they carry for non-legacy spaces."""
+    message_rows = []
+    vectors: Dict[str, List[Dict]] = {}
+    for row in rows:
+        message_rows.append({key: value for key, value in row.items() if key != "space_embeddings"})
+        for name, embedding in (row.get("space_embeddings") or {}).items():
+            vectors.setdefault(name, []).append({
+                "message_id": row["id"],
+                "timestamp": row["timestamp"],
+                "user_id": row["user_id"],
+                "conversation_id": row["conversation_id"],
+                "role": row["role"],
+                "embedding": embedding
+            })
+    return message_rows, vectors
+
+
+def space_vector_inserts(vectors: Dict[str, List[Dict]]) -> List:
+    """Idempotent inserts of message vectors into their spaces' tables."""
+    registry = get_space_registry()
+    statements = []
+    for name, rows in vectors.items():
+        space = registry.get(name)
+        if space is None or name == LEGACY_SPACE:
+            continue
+        message_table, _ = space_tables(space)
+        statements.append(insert(message_table).values(rows).on_conflict_do_nothing())
+    return statements
+
+
+def knowledge_vector_inserts(documents: List[Tuple]) -> List:
+    """Idempotent inserts of (document_id, version, {space name: embedding}) into knowledge vector tables."""
+    registry = get_space_registry()
+    vectors: Dict[str, List[Dict]] = {}
+    for document_id, version, embeddings in documents:
+        for name, embedding in embeddings.items():
+            vectors.setdefault(name, []).append(
+                {"document_id": document_id, "version": version, "embedding": embedding}
+            )
+
+    statements = []
+    for name, rows in vectors.items():
+        space = registry.get(name)
+        if space is None or name == LEGACY_SPACE:
+            continue
+        _, knowledge_table = space_tables(space)
+        statements.append(insert(knowledge_table).values(rows).on_conflict_do_nothing())
+    return statements
+
+
+def similar_messages_query(space: EmbeddingSpace, user_id, embedding, limit: int = 5,
+                           window_conversation_id=None, window_start=None, role: str = "user"):
+    """Per-user similarity query over a non-legacy space, shaped like database.similar_messages_query."""
+    message_table, _ = space_tables(space)
+    filters = [message_table.c.user_id == user_id, message_table.c.role == role]
+    if window_conversation_id is not None and window_start is not None:
+        filters.append(or_(message_table.c.conversation_id != window_conversation_id,
+                           message_table.c.timestamp < window_start))
+
+    candidates = select(
+        message_table.c.message_id, message_table.c.timestamp, message_table.c.conversation_id,
+        message_table.c.embedding
+    ).where(*filters).cte("user_vectors").prefix_with("MATERIALIZED")
+
+    distance = candidates.c.embedding.cosine_distance(embedding)
+    nearest = select(
+        candidates.c.message_id, candidates.c.timestamp, candidates.c.conversation_id,
+        distance.label("distance")
+    ).order_by(distance).limit(limit).subquery("nearest")
+
+    return select(
+        nearest.c.message_id.label("id"), nearest.c.conversation_id, Message.content,
+        nearest.c.timestamp, nearest.c.distance
+    ).join(
+        Message, (Message.id == nearest.c.message_id) & (Message.timestamp == nearest.c.timestamp)
+    ).order_by(nearest.c.distance)
+
+
+def user_memories_query(space: EmbeddingSpace, user_id, limit: int = 2000, role: str = "user"):
+    """A user's newest vectors in a non-legacy space, shaped like database.user_memories_query."""
+    message_table, _ = space_tables(space)
+    return select(
+        message_table.c.message_id.label("id"), message_table.c.conversation_id, Message.content,
+        message_table.c.timestamp, vector_binary(message_table.c.embedding)
+    ).join(
+        Message, (Message.id == message_table.c.message_id) & (Message.timestamp == message_table.c.timestamp)
+    ).where(
+        message_table.c.user_id == user_id,
+        message_table.c.role == role
+    ).order_by(message_table.c.timestamp.desc()).limit(limit)
+
+
+def knowledge_neighbors_query(space: EmbeddingSpace, embedding, k: int = 5, version: Optional[int] = None):
+    """Nearest knowledge chunk ids and distances in a space, within one knowledge version."""
+    if space.name == LEGACY_SPACE:
+        distance = KnowledgeDocument.embedding.cosine_distance(embedding)
+        return select(KnowledgeDocument.id.label("document_id"), distance.label("distance")).where(
+            knowledge_version_filter(version)
+        ).order_by(distance).limit(k)
+
+    # Only the version's partial HNSW index is scanned, so other versions never crowd out the top k
+    _, knowledge_table = space_tables(space)
+    if version is None:
+        from knowledge_versions import get_knowledge_versions  # knowledge_versions imports this module
+        version = get_knowledge_versions().active_version()
+    distance = knowledge_table.c.embedding.cosine_distance(embedding)
+    return select(knowledge_table.c.document_id, distance.label("distance")).where(
+        # Inlined rather than bound, so the planner can match the partial index
+        knowledge_table.c.version == literal_column(str(int(version)))
+    ).order_by(distance).limit(k)
+
+
+def knowledge_search_query(space: EmbeddingSpace, embedding, k: int = 5, version: Optional[int] = None):
+    """Knowledge similarity query over a non-legacy space, shaped like database.knowledge_search_query."""
+    # Rank without the content column so the scan stays narrow, then fetch content
+    nearest = knowledge_neighbors_query(space, embedding, k, version).subquery("nearest")
+    return select(KnowledgeDocument.content, nearest.c.distance).join(
+        KnowledgeDocument, KnowledgeDocument.id == nearest.c.document_id
+    ).order_by(nearest.c.distance)
+
+
+def compare_spaces(candidate: str, baseline: Optional[str] = None, samples: int = 200, k: int = 5) -> Dict:
+    """
+    Shadow comparison of retrieval in two spaces.
+
+    Uses recent user messages embedded in both spaces as queries and reports how much of
+    the baseline's top-k knowledge chunks and memories the candidate also returns, plus query latency.
+    """
+    from database import similar_messages_query as legacy_similar_messages_query
+
+    registry = get_space_registry()
+    baseline_space = registry.get(baseline) if baseline else registry.active()
+    candidate_space = registry.get(candidate)
+    if baseline_space is None or candidate_space is None:
+        raise ValueError("Unknown embedding space")
+
+    def message_vectors(space: EmbeddingSpace):
+        """User message vectors in a space, as a subquery."""
+        if space.name == LEGACY_SPACE:
+            return select(
+                Message.id, Message.timestamp, Message.user_id, Message.conversation_id,
+                vector_binary(Message.embedding)
+            ).where(Message.role == "user", Message.embedding.isnot(None)).subquery()
+        message_table, _ = space_tables(space)
+        return select(
+            message_table.c.message_id.label("id"), message_table.c.timestamp, message_table.c.user_id,
+            message_table.c.conversation_id, vector_binary(message_table.c.embedding)
+        ).where(message_table.c.role == "user").subquery()
+
+    def memories(space: EmbeddingSpace, user_id, embedding, conversation_id, timestamp):
+        """The user's nearest messages from before the query message, as memory search sees them."""
+        if space.name == LEGACY_SPACE:
+            return legacy_similar_messages_query(
+                user_id, embedding, k, window_conversation_id=conversation_id, window_start=timestamp, space=space
+            )
+        return similar_messages_query(
+            space, user_id, embedding, k, window_conversation_id=conversation_id, window_start=timestamp
+        )
+
+    baseline_rows = message_vectors(baseline_space)
+    candidate_rows = message_vectors(candidate_space)
+    query = select(
+        baseline_rows.c.id, baseline_rows.c.timestamp, baseline_rows.c.user_id, baseline_rows.c.conversation_id,
+        baseline_rows.c.embedding.label("baseline"), candidate_rows.c.embedding.label("candidate")
+    ).join(
+        candidate_rows,
+        (candidate_rows.c.id == baseline_rows.c.id) & (candidate_rows.c.timestamp == baseline_rows.c.timestamp)
+    ).order_by(baseline_rows.c.timestamp.desc()).limit(samples)
+
+    knowledge_overlap, memory_overlap = [], []
+    timings = {"baseline": 0.0, "candidate": 0.0}
+    with engine.connect() as connection:
+        pairs = connection.execute(query).all()
+        for pair in pairs:
+            results = {}
+            for label, space, embedding in (("baseline", baseline_space, pair.baseline),
+                                            ("candidate", candidate_space, pair.candidate)):
+                vector = embedding.tolist()
+                started = time.perf_counter()
+                documents = connection.execute(knowledge_neighbors_query(space, vector, k)).all()
+                messages = connection.execute(
+                    memories(space, pair.user_id, vector, pair.conversation_id, pair.timestamp)
+                ).all()
+                timings[label] += time.perf_counter() - started
+                results[label] = ({row.document_id for row in documents}, {row.id for row in messages})
+
+            for overlaps, index in ((knowledge_overlap, 0), (memory_overlap, 1)):
+                expected = results["baseline"][index]
+                if expected:
+                    overlaps.append(len(expected & results["candidate"][index]) / len(expected))
+
+    return {
+        "baseline": baseline_space.name,
+        "candidate": candidate_space.name,
+        "samples": len(pairs),
+        "k": k,
+        "knowledge_overlap_at_k": round(float(np.mean(knowledge_overlap)), 4) if knowledge_overlap else None,
+        "memory_overlap_at_k": round(float(np.mean(memory_overlap)), 4) if memory_overlap else None,
+        "baseline_query_ms": round(1000 * timings["baseline"] / len(pairs), 2) if pairs else None,
+        "candidate_query_ms": round(1000 * timings["candidate"] / len(pairs), 2) if pairs else None
+    }
+
+
+# Singleton instance
+_registry_instance: Optional[SpaceRegistry] = None
+
+
+def get_space_registry() -> SpaceRegistry:
+    """Get or create embedding space registry singleton instance."""
+    global _registry_instance
+
+    if _registry_instance is None:
+        _registry_instance = SpaceRegistry()
+
+    return _registry_instance
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # python embedding_spaces.py [list | create NAME MODEL DIMENSION | backfill NAME |
+    #                             compare NAME [BASELINE] | activate NAME [force] | retire NAME]
+    registry = get_space_registry()
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "create":
+        registry.create(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    elif command == "backfill":
+        from embedding_backfill import get_embedding_backfill
+        backfill = get_embedding_backfill(sys.argv[2])
+        backfill.run_cycle()
+        print(json.dumps(backfill.stats(), indent=2))
+    elif command == "compare":
+        print(json.dumps(compare_spaces(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None), indent=2))
+    elif command == "activate":
+        registry.activate(sys.argv[2], force=len(sys.argv) > 3 and sys.argv[3] == "force")
+    elif command == "retire":
+        registry.retire(sys.argv[2])
+
+    print(json.dumps({**registry.stats(), "coverage": {
+        space.name: registry.coverage(space.name) for space in registry.spaces()
+    }}, indent=2))
@@ -0,0 +1,204 @@
+"""
+Streaming exports of conversations and messages for analytics.
+Rows are read through server-side cursors and encoded batch by batch as gzipped JSONL or Parquet.
+"""
+
+import os
+import json
+import zlib
+import uuid
+import logging
+from datetime import datetime
+from typing import Iterator, List, Dict
+import numpy as np
+from sqlalchemy import select, String, Text, DateTime, Integer, Float, Boolean
+from sqlalchemy.dialects.postgresql import UUID
+from database import engine, replica_engines, Conversation, Message, vector_binary
+from read_replicas import get_replica_router
+
+logger = logging.getLogger(__name__)
+
+# Export configuration
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))  # Rows per cursor fetch and output chunk
+EXPORT_API_TOKEN = os.getenv("EXPORT_API_TOKEN")  # Bearer token for the export endpoint; unset disables it
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+EXPORT_TABLES = {"conversations": Conversation, "messages": Message}
+EXPORT_FORMATS = {"jsonl": ".jsonl.gz", "parquet": ".parquet"}
+
+
+def export_columns(table: str, include_embeddings: bool = False) -> List:
+    """Columns to export, with embeddings selected in binary form when requested."""
+    model = EXPORT_TABLES[table]
+    columns = []
+    for column in model.__table__.columns:
+        if column.name == "embedding":
+            if include_embeddings:
+                columns.append(vector_binary(column))
+        else:
+            columns.append(column)
+    return columns
+
+
+def stream_batches(table: str, include_embeddings: bool = False,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict]]:
+    """
+    Yield the table's rows in lists of at most batch_size dicts.
+
+    yield_per makes psycopg2 use a named cursor, so only one batch is held in memory.
+    Rows come in storage order; sorting a full table would cost more than the export.
+    """
+    replica = get_replica_router().choose()
+    export_engine = engine if replica is None else replica_engines[replica]
+
+    with export_engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(
+            select(*export_columns(table, include_embeddings))
+        )
+        for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+
+
+def _json_default(value):
+    """Encode the non-JSON types exported rows contain."""
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+
+def iter_jsonl_gz(batches: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """Encode batches as gzip-compressed JSON lines, one compressed chunk per batch."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for batch in batches:
+        lines = "".join(json.dumps(row, default=_json_default, ensure_ascii=False) + "\n" for row in batch)
+        chunk = compressor.compress(lines.encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are handed out and dropped after each row group."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema(table: str, include_embeddings: bool = False):
+    """Arrow schema for the exported columns."""
+    import pyarrow as pa  # Optional dependency, only needed for Parquet exports
+
+    fields = []
+    for column in export_columns(table, include_embeddings):
+        if column.name == "embedding":
+            arrow_type = pa.list_(pa.float32())
+        elif isinstance(column.type, UUID):
+            arrow_type = pa.string()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us")
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, (String, Text)):
+            arrow_type = pa.string()
+        else:
+            raise TypeError(f"No Parquet type for {table}.{column.name}")
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def iter_parquet(batches: Iterator[List[Dict]], schema) -> Iterator[bytes]:
+    """Encode batches as a Parquet file, one row group per batch."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    string_columns = [field.name for field in schema if field.type == pa.string()]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=EXPORT_PARQUET_COMPRESSION)
+    try:
+        for batch in batches:
+            for row in batch:
+                for name in string_columns:
+                    if isinstance(row[name], uuid.UUID):
+                        row[name] = str(row[name])
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(table: str, fmt: str = "jsonl", include_embeddings: bool = False,
+                batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Stream an encoded export of a table."""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table {table!r}, expected one of {', '.join(EXPORT_TABLES)}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+
+    batches = stream_batches(table, include_embeddings, batch_size)
+    if fmt == "parquet":
+        return iter_parquet(batches, parquet_schema(table, include_embeddings))
+    return iter_jsonl_gz(batches)
+
+
+def export_table(table: str, path: str, fmt: str = "jsonl", include_embeddings: bool = False,
+                 batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Write an export to path and return its size in bytes."""
+    size = 0
+    with open(path, "wb") as f:
+        for chunk in iter_export(table, fmt, include_embeddings, batch_size):
+            f.write(chunk)
+            size += len(chunk)
+    logger.info(f"Exported {table} to {path} ({size} bytes)")
+    return size
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Export conversations or messages")
+    parser.add_argument("table", choices=list(EXPORT_TABLES))
+    parser.add_argument("path", nargs="?", help="Output file, defaults to <table><extension>")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="jsonl")
+    parser.add_argument("--embeddings", action="store_true", help="Include message embeddings")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    export_table(
+        args.table, args.path or args.table + EXPORT_FORMATS[args.format],
+        args.format, args.embeddings, args.batch_size
+    )
@@ -0,0 +1,152 @@
+"""
+In-memory ring buffer of recent messages per conversation.
+Hot conversations serve their sliding history window without querying the messages table.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict, deque, namedtuple
+from typing import List, Dict, Optional
+
+# Buffer configuration
+HISTORY_BUFFER_ENABLED = os.getenv("HISTORY_BUFFER_ENABLED", "true").lower() == "true"
+# Messages kept per conversation; covers the recent window plus messages awaiting the summary
+HISTORY_BUFFER_SIZE = int(os.getenv("HISTORY_BUFFER_SIZE", "16"))
+HISTORY_BUFFER_MAX_BYTES = int(os.getenv("HISTORY_BUFFER_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_BUFFER_TTL = float(os.getenv("HISTORY_BUFFER_TTL", "300"))  # Bounds staleness across workers
+
+# Lightweight history entry with the same attributes the chatbot reads from Message
+HistoryEntry = namedtuple("HistoryEntry", ["role", "content", "timestamp"], defaults=(None,))
+
+
+class _Ring:
+    """Recent messages for one conversation."""
+
+    __slots__ = ("entries", "complete", "size", "loaded_at")
+
+    def __init__(self, entries: List[HistoryEntry], capacity: int, complete: bool):
+        """Initialize ring with chronological entries."""
+        self.entries = deque(entries, maxlen=capacity)
+        # True when the ring holds every message of the conversation
+        self.complete = complete
+        self.size = sum(_entry_size(entry) for entry in self.entries)
+        self.loaded_at = time.monotonic()
+
+
+def _entry_size(entry: HistoryEntry) -> int:
+    """Approximate memory footprint of an entry in bytes."""
+    return len(entry.content) + len(entry.role) + 64
+
+
+class ConversationHistoryBuffer:
+    """Bounded LRU of per-conversation ring buffers with a global memory cap."""
+
+    def __init__(self, capacity: int = HISTORY_BUFFER_SIZE, max_bytes: int = HISTORY_BUFFER_MAX_BYTES,
+                 ttl: float = HISTORY_BUFFER_TTL, enabled: bool = HISTORY_BUFFER_ENABLED):
+        """Initialize empty buffer."""
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._rings: "OrderedDict[object, _Ring]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, conversation_id, limit: int) -> Optional[List[HistoryEntry]]:
+        """Return the last `limit` messages in chronological order, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            ring = self._rings.get(conversation_id)
+            if ring is not None and time.monotonic() - ring.loaded_at > self.ttl:
+                self._remove(conversation_id)
+                ring = None
+
+            if ring is None or (len(ring.entries) < limit and not ring.complete):
+                self._stats["misses"] += 1
+                return None
+
+            self._rings.move_to_end(conversation_id)
+            self._stats["hits"] += 1
+            entries = list(ring.entries)
+            return entries[-limit:] if limit else entries
+
+    def fill(self, conversation_id, messages: List, query_limit: int):
+        """Populate a ring from a chronological database read of up to query_limit rows."""
+        if not self.enabled:
+            return
+
+        entries = [HistoryEntry(msg.role, msg.content, msg.timestamp) for msg in messages]
+        ring = _Ring(entries[-self.capacity:], self.capacity, complete=len(entries) < query_limit)
+
+        with self._lock:
+            self._remove(conversation_id)
+            self._rings[conversation_id] = ring
+            self._bytes += ring.size
+            self._enforce_cap()
+
+    def append(self, conversation_id, role: str, content: str, timestamp=None):
+        """Append a saved message to the conversation's ring if it is buffered."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            ring = self._rings.get(conversation_id)
+            if ring is None:
+                return
+
+            if len(ring.entries) == ring.entries.maxlen:
+                self._bytes -= _entry_size(ring.entries[0])
+                ring.size -= _entry_size(ring.entries[0])
+                ring.complete = False
+
+            entry = HistoryEntry(role, content, timestamp)
+            ring.entries.append(entry)
+            ring.size += _entry_size(entry)
+            self._bytes += _entry_size(entry)
+            self._rings.move_to_end(conversation_id)
+            self._enforce_cap()
+
+    def invalidate(self, conversation_id):
+        """Drop a conversation's ring."""
+        with self._lock:
+            self._remove(conversation_id)
+
+    def _remove(self, conversation_id):
+        """Remove a ring and release its bytes. Caller holds the lock."""
+        ring = self._rings.pop(conversation_id, None)
+        if ring is not None:
+            self._bytes -= ring.size
+
+    def _enforce_cap(self):
+        """Evict least recently used rings until under the memory cap. Caller holds the lock."""
+        while self._bytes > self.max_bytes and self._rings:
+            _, ring = self._rings.popitem(last=False)
+            self._bytes -= ring.size
+            self._stats["evictions"] += 1
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and memory usage."""
+        return {
+            **self._stats,
+            "conversations": len(self._rings),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+# Singleton instance
+_buffer_instance: Optional[ConversationHistoryBuffer] = None
+
+
+def get_history_buffer() -> ConversationHistoryBuffer:
+    """Get or create history buffer singleton instance."""
+    global _buffer_instance
+
+    if _buffer_instance is None:
+        _buffer_instance = ConversationHistoryBuffer()
+
+    return _buffer_instance
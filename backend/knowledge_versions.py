@@ -0,0 +1,402 @@
+"""
+Blue/green versions of the knowledge base.
+Rebuilds go into a new version with its own partial ANN index while the active one keeps serving;
+they are validated, then activated atomically, and the previous version is kept for instant rollback.
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from collections import namedtuple
+from datetime import datetime
+from typing import List, Dict, Optional, Callable
+from sqlalchemy import select, func, text
+from database import (
+    engine, SessionLocal, KnowledgeDocument, KnowledgeVersionRecord,
+    vector_binary, vector_cosine_ops, knowledge_version_filter
+)
+from storage import STORAGE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Version configuration
+KNOWLEDGE_VERSION_REFRESH_SECONDS = float(os.getenv("KNOWLEDGE_VERSION_REFRESH_SECONDS", "10"))
+KNOWLEDGE_VERSION_KEEP = int(os.getenv("KNOWLEDGE_VERSION_KEEP", "2"))  # Inactive versions kept for rollback
+KNOWLEDGE_VERSION_MIN_COUNT_RATIO = float(os.getenv("KNOWLEDGE_VERSION_MIN_COUNT_RATIO", "0.9"))
+KNOWLEDGE_VERSION_MIN_RECALL = float(os.getenv("KNOWLEDGE_VERSION_MIN_RECALL", "0.95"))
+
+KnowledgeVersion = namedtuple("KnowledgeVersion", ["version", "state", "document_count", "activated_at"])
+
+# Version that existing chunks belong to
+INITIAL_VERSION = 1
+
+
+def index_name(version: int) -> str:
+    """Name of a version's partial ANN index."""
+    return f"idx_knowledge_documents_v{version}_embedding"
+
+
+def _autocommit():
+    """Open a connection outside a transaction block, as CONCURRENTLY operations require."""
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+class KnowledgeVersionRegistry:
+    """
+    Knowledge versions and the active pointer, cached for a short TTL so switches reach every process.
+
+    Like the embedding space registry, the server reloads it from run_refresh_loop and
+    readers on the request path never query.
+    """
+
+    def __init__(self, ttl: float = KNOWLEDGE_VERSION_REFRESH_SECONDS,
+                 enabled: bool = STORAGE_BACKEND == "postgres"):
+        """Initialize with the initial version active; the registry table is read on first use."""
+        self.ttl = ttl
+        self.enabled = enabled
+        self._versions: Dict[int, KnowledgeVersion] = {}
+        self._active = INITIAL_VERSION
+        self._loaded_at: Optional[float] = None
+        self._listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._refreshed_in_background = False
+
+    def _current(self):
+        """Load the registry on first use; after that only refresh here when no refresh loop runs."""
+        if self._loaded_at is None or not self._refreshed_in_background:
+            self._refresh()
+
+    async def run_refresh_loop(self):
+        """Reload the registry every TTL in a worker thread until cancelled."""
+        self._refreshed_in_background = True
+        try:
+            while True:
+                await asyncio.to_thread(self._refresh, True)
+                await asyncio.sleep(self.ttl)
+        finally:
+            self._refreshed_in_background = False
+
+    def _refresh(self, force: bool = False):
+        """Reload versions once the TTL has passed, notifying listeners when the active one changed."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            previous = self._active
+            try:
+                db = SessionLocal()
+                try:
+                    records = db.query(KnowledgeVersionRecord).all()
+                finally:
+                    db.close()
+            except Exception as e:
+                logger.error(f"Error loading knowledge versions, keeping previous: {e}")
+                self._loaded_at = time.monotonic()
+                return
+
+            self._versions = {
+                record.version: KnowledgeVersion(
+                    record.version, record.state, record.document_count, record.activated_at
+                )
+                for record in records
+            }
+            self._active = next(
+                (version.version for version in self._versions.values() if version.state == "active"),
+                INITIAL_VERSION
+            )
+            self._loaded_at = time.monotonic()
+            changed = previous != self._active
+
+        if changed:
+            logger.info(f"Active knowledge version is now {self._active}")
+            for listener in self._listeners:
+                listener()
+
+    def on_activate(self, listener: Callable[[], None]):
+        """Call listener whenever another version becomes active, e.g. to drop a cached chunk count."""
+        self._listeners.append(listener)
+
+    def active_version(self) -> int:
+        """The version queries read."""
+        self._current()
+        return self._active
+
+    def versions(self) -> List[KnowledgeVersion]:
+        """All versions, oldest first."""
+        self._current()
+        return [self._versions[version] for version in sorted(self._versions)]
+
+    def get(self, version: int) -> Optional[KnowledgeVersion]:
+        """A version by number."""
+        self._current()
+        return self._versions.get(version)
+
+    def ensure_tables(self):
+        """Register existing chunks as the initial active version and index it."""
+        with engine.begin() as connection:
+            registered = connection.execute(select(func.count()).select_from(KnowledgeVersionRecord)).scalar()
+            if not registered:
+                count = connection.execute(select(func.count()).select_from(KnowledgeDocument)).scalar()
+                connection.execute(KnowledgeVersionRecord.__table__.insert().values(
+                    version=INITIAL_VERSION, state="active", document_count=count,
+                    activated_at=datetime.utcnow()
+                ))
+        self._refresh(force=True)
+        self.create_indexes()
+
+    def create_index(self, version: int):
+        """Build a version's partial HNSW indexes, in the legacy columns and every space, without blocking writes."""
+        from embedding_spaces import get_space_registry, space_tables, knowledge_index_name, LEGACY_SPACE
+
+        with _autocommit() as connection:
+            connection.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(version)} ON knowledge_documents "
+                f"USING hnsw (embedding {vector_cosine_ops()}) WHERE version = {int(version)}"
+            ))
+            for space in get_space_registry().spaces():
+                if space.name != LEGACY_SPACE and space.state != "retired":
+                    _, knowledge_table = space_tables(space)
+                    connection.execute(text(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {knowledge_index_name(space, version)} "
+                        f"ON {knowledge_table.name} USING hnsw (embedding {vector_cosine_ops()}) "
+                        f"WHERE version = {int(version)}"
+                    ))
+
+    def create_indexes(self):
+        """Build the indexes of every version that can be served: the active one and those kept or ready."""
+        for version in self.versions():
+            if version.state in ("active", "inactive", "ready"):
+                self.create_index(version.version)
+
+    def begin_build(self) -> int:
+        """Register a new version in the building state and return its number."""
+        with engine.begin() as connection:
+            # Lock the registry so concurrent builds get distinct numbers
+            connection.execute(text("LOCK TABLE knowledge_versions IN SHARE ROW EXCLUSIVE MODE"))
+            version = (connection.execute(select(func.max(KnowledgeVersionRecord.version))).scalar() or 0) + 1
+            connection.execute(KnowledgeVersionRecord.__table__.insert().values(
+                version=version, state="building", document_count=0
+            ))
+        self._refresh(force=True)
+        return version
+
+    def build(self, pdf_directory: str = "knowledge_base", rag=None) -> int:
+        """Index the PDFs into a new version, build its index and validate it. Returns the version."""
+        if rag is None:
+            from rag_system import TherapeuticRAG  # Imported here to keep this module free of langchain
+            openai_api_key = os.getenv("OPENAI_API_KEY")
+            if not openai_api_key or openai_api_key == "your_openai_api_key_here":
+                raise ValueError("OPENAI_API_KEY environment variable not set")
+            rag = TherapeuticRAG(openai_api_key)
+
+        version = self.begin_build()
+        logger.info(f"Building knowledge version {version} from {pdf_directory}")
+        try:
+            chunks = rag.load_pdf_documents(pdf_directory)
+            rag.index_documents(chunks, version=version)
+            # Built after loading, which is much faster than growing the index row by row
+            self.create_index(version)
+            self.validate(version, expected=len(chunks))
+        except Exception as e:
+            # Left unserved; `drop` removes its rows
+            self._set_state(version, "failed", {"error": str(e)})
+            raise
+        return version
+
+    def validate(self, version: int, expected: Optional[int] = None, samples: int = 50, k: int = 5) -> Dict:
+        """
+        Check a version's row count and sample recall, marking it ready or failed.
+
+        Recall is the share of sampled chunks that a search with their own vector returns in
+        its top k, through the version's index in the active embedding space.
+        """
+        from embedding_spaces import get_space_registry, knowledge_neighbors_query, space_tables, LEGACY_SPACE
+
+        space = get_space_registry().active()
+        if space.name == LEGACY_SPACE:
+            vectors = select(KnowledgeDocument.id, vector_binary(KnowledgeDocument.embedding)).where(
+                KnowledgeDocument.embedding.isnot(None)
+            )
+        else:
+            _, knowledge_table = space_tables(space)
+            vectors = select(KnowledgeDocument.id, vector_binary(knowledge_table.c.embedding)).join(
+                knowledge_table, knowledge_table.c.document_id == KnowledgeDocument.id
+            )
+
+        with engine.connect() as connection:
+            count = connection.execute(
+                select(func.count()).select_from(KnowledgeDocument).where(knowledge_version_filter(version))
+            ).scalar()
+            active_count = connection.execute(
+                select(func.count()).select_from(KnowledgeDocument)
+                .where(knowledge_version_filter(self.active_version()))
+            ).scalar()
+            sample = connection.execute(
+                vectors.where(knowledge_version_filter(version)).order_by(func.random()).limit(samples)
+            ).all()
+            hits = sum(
+                row.id in connection.execute(
+                    knowledge_neighbors_query(space, row.embedding.tolist(), k, version)
+                ).scalars().all()
+                for row in sample
+            )
+
+        recall = hits / len(sample) if sample else 0.0
+        failures = []
+        if count == 0:
+            failures.append("no documents")
+        if expected and count < expected * KNOWLEDGE_VERSION_MIN_COUNT_RATIO:
+            failures.append(f"{count} of {expected} chunks indexed")
+        if version != self.active_version() and active_count and count < active_count * KNOWLEDGE_VERSION_MIN_COUNT_RATIO:
+            failures.append(f"{count} chunks against {active_count} in the active version")
+        if sample and recall < KNOWLEDGE_VERSION_MIN_RECALL:
+            failures.append(f"recall@{k} {recall:.3f} below {KNOWLEDGE_VERSION_MIN_RECALL}")
+
+        validation = {
+            "documents": count,
+            "expected": expected,
+            "active_documents": active_count,
+            "space": space.name,
+            "samples": len(sample),
+            f"recall_at_{k}": round(recall, 4),
+            "failures": failures
+        }
+        self._set_state(version, "failed" if failures else "ready", validation, document_count=count)
+        logger.info(f"Validated knowledge version {version}: {validation}")
+        return validation
+
+    def _set_state(self, version: int, state: str, validation: Dict, document_count: Optional[int] = None):
+        """Record a build's state and validation results."""
+        values = {"state": state, "validation": json.dumps(validation)}
+        if document_count is not None:
+            values["document_count"] = document_count
+        with engine.begin() as connection:
+            connection.execute(
+                KnowledgeVersionRecord.__table__.update()
+                .where(KnowledgeVersionRecord.version == version).values(**values)
+            )
+        self._refresh(force=True)
+
+    def activate(self, version: int, force: bool = False):
+        """
+        Serve a version, in a single transaction.
+
+        The previously active version becomes inactive with its rows and index intact,
+        so activating it again (see rollback) is instant.
+        """
+        target = self.get(version)
+        if target is None:
+            raise ValueError(f"Unknown knowledge version {version}")
+        if target.state == "building" or (target.state == "failed" and not force):
+            raise ValueError(f"Knowledge version {version} is {target.state}; validate it or pass force")
+
+        with engine.begin() as connection:
+            # Lock the registry so concurrent switches serialize
+            connection.execute(text("LOCK TABLE knowledge_versions IN SHARE ROW EXCLUSIVE MODE"))
+            connection.execute(text(
+                "UPDATE knowledge_versions SET state = 'inactive' WHERE state = 'active' AND version <> :version"
+            ), {"version": version})
+            connection.execute(text(
+                "UPDATE knowledge_versions SET state = 'active', activated_at = now() WHERE version = :version"
+            ), {"version": version})
+        self._refresh(force=True)
+        logger.info(f"Activated knowledge version {version}")
+        self.prune()
+
+    def rollback(self) -> int:
+        """Re-activate the most recently active inactive version. Returns its number."""
+        previous = [version for version in self.versions() if version.state == "inactive" and version.activated_at]
+        if not previous:
+            raise ValueError("No previous knowledge version to roll back to")
+        version = max(previous, key=lambda version: version.activated_at).version
+        self.activate(version, force=True)
+        return version
+
+    def drop(self, version: int):
+        """Delete a version's chunks, vectors in other embedding spaces and indexes."""
+        from embedding_spaces import get_space_registry, space_tables, knowledge_index_name, LEGACY_SPACE
+
+        target = self.get(version)
+        if target is None:
+            raise ValueError(f"Unknown knowledge version {version}")
+        if target.state == "active":
+            raise ValueError("Activate another version before dropping the active one")
+
+        spaces = [space for space in get_space_registry().spaces() if space.name != LEGACY_SPACE]
+        with _autocommit() as connection:
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(version)}"))
+            for space in spaces:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {knowledge_index_name(space, version)}"))
+        with engine.begin() as connection:
+            for space in spaces:
+                _, knowledge_table = space_tables(space)
+                connection.execute(knowledge_table.delete().where(knowledge_table.c.version == version))
+            connection.execute(KnowledgeDocument.__table__.delete().where(knowledge_version_filter(version)))
+            connection.execute(
+                KnowledgeVersionRecord.__table__.delete().where(KnowledgeVersionRecord.version == version)
+            )
+        self._refresh(force=True)
+        logger.info(f"Dropped knowledge version {version}")
+
+    def prune(self, keep: int = KNOWLEDGE_VERSION_KEEP):
+        """Drop inactive versions beyond the newest `keep`."""
+        inactive = sorted(
+            (version for version in self.versions() if version.state == "inactive"),
+            key=lambda version: version.activated_at or datetime.min, reverse=True
+        )
+        for version in inactive[keep:]:
+            self.drop(version.version)
+
+    def stats(self) -> Dict:
+        """Return versions and which one is active."""
+        return {
+            "active": self.active_version(),
+            "versions": {
+                version.version: {"state": version.state, "documents": version.document_count}
+                for version in self.versions()
+            }
+        }
+
+
+# Singleton instance
+_registry_instance: Optional[KnowledgeVersionRegistry] = None
+
+
+def get_knowledge_versions() -> KnowledgeVersionRegistry:
+    """Get or create knowledge version registry singleton instance."""
+    global _registry_instance
+
+    if _registry_instance is None:
+        _registry_instance = KnowledgeVersionRegistry()
+
+    return _registry_instance
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # python knowledge_versions.py [list | build [PDF_DIRECTORY] | validate VERSION |
+    #                               activate VERSION [force] | rollback | drop VERSION]
+    registry = get_knowledge_versions()
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "build":
+        registry.build(sys.argv[2] if len(sys.argv) > 2 else "knowledge_base")
+    elif command == "validate":
+        registry.validate(int(sys.argv[2]))
+    elif command == "activate":
+        registry.activate(int(sys.argv[2]), force=len(sys.argv) > 3 and sys.argv[3] == "force")
+    elif command == "rollback":
+        registry.rollback()
+    elif command == "drop":
+        registry.drop(int(sys.argv[2]))
+
+    print(json.dumps(registry.stats(), indent=2))
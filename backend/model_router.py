@@ -0,0 +1,160 @@
+"""
+Adaptive model routing for the therapeutic chatbot.
+Sends short, simple turns to a fast model and escalates complex turns to the large model.
+"""
+
+import os
+import re
+import time
+import logging
+from collections import deque
+from typing import List, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Model configuration
+LARGE_MODEL = os.getenv("LARGE_CHAT_MODEL", "gpt-4-turbo-preview")
+SMALL_MODEL = os.getenv("SMALL_CHAT_MODEL", "gpt-4o-mini")
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+
+# Routing thresholds
+LONG_MESSAGE_CHARS = int(os.getenv("ROUTING_LONG_MESSAGE_CHARS", "280"))
+LONG_HISTORY_CHARS = int(os.getenv("ROUTING_LONG_HISTORY_CHARS", "3000"))
+STRONG_RETRIEVAL_SIMILARITY = float(os.getenv("ROUTING_STRONG_SIMILARITY", "0.85"))
+
+
+def keyword_pattern(keyword: str) -> re.Pattern:
+    """Match a keyword as whole words, so "alone" does not match "standalone"."""
+    words = r"\s+".join(re.escape(word) for word in keyword.split())
+    return re.compile(rf"\b{words}\b")
+
+
+class ModelRouter:
+    """Routing policy that picks a chat model per turn and tracks per-model latency."""
+
+    # Emotionally heavy or crisis-adjacent language that deserves the large model
+    EMOTIONAL_KEYWORDS = [
+        "anxious", "anxiety", "depressed", "depression", "lonely", "alone",
+        "overwhelmed", "panic", "grief", "grieving", "worthless", "ashamed",
+        "shame", "scared", "afraid", "trauma", "abuse", "crying", "hate myself",
+        "exhausted", "numb", "empty", "breakup", "divorce", "lost my", "can't cope",
+        "falling apart", "give up", "burnout", "angry at myself"
+    ]
+
+    # Number of latency samples kept per model for percentile reporting
+    LATENCY_WINDOW = 500
+
+    def __init__(self, small_model: str = SMALL_MODEL, large_model: str = LARGE_MODEL,
+                 enabled: bool = MODEL_ROUTING_ENABLED):
+        """Initialize router with model names and empty latency windows."""
+        self.small_model = small_model
+        self.large_model = large_model
+        self.enabled = enabled
+        self._latencies: Dict[str, deque] = {}
+        self._decisions: Dict[str, int] = {"small": 0, "large": 0}
+        self._keyword_patterns = [(keyword, keyword_pattern(keyword)) for keyword in self.EMOTIONAL_KEYWORDS]
+
+    def emotional_signals(self, message: str) -> List[str]:
+        """Return emotional keywords found in the message."""
+        # Typographic apostrophes, as phone keyboards type them, match "can't cope"
+        message_lower = message.lower().replace("\u2019", "'")
+        return [keyword for keyword, pattern in self._keyword_patterns if pattern.search(message_lower)]
+
+    def route(self, user_message: str, conversation_history: List[Dict] = None,
+              retrieval_scores: List[float] = None, crisis_flag: bool = False) -> Dict:
+        """
+        Choose a model for the current turn.
+
+        Returns:
+            Dict with 'model', 'tier' and 'reasons'
+        """
+        reasons = []
+
+        if not self.enabled:
+            reasons.append("routing_disabled")
+
+        if len(user_message) >= LONG_MESSAGE_CHARS:
+            reasons.append("long_message")
+
+        history_chars = sum(len(msg["content"]) for msg in conversation_history or [])
+        if history_chars >= LONG_HISTORY_CHARS:
+            reasons.append("long_history")
+
+        if retrieval_scores and max(retrieval_scores) >= STRONG_RETRIEVAL_SIMILARITY:
+            reasons.append("strong_knowledge_match")
+
+        signals = self.emotional_signals(user_message)
+        if signals:
+            reasons.append(f"emotional:{','.join(signals[:3])}")
+
+        if crisis_flag:
+            reasons.append("crisis_history")
+
+        tier = "large" if reasons else "small"
+        model = self.large_model if tier == "large" else self.small_model
+        self._decisions[tier] += 1
+
+        logger.info(
+            f"Model routing: tier={tier} model={model} "
+            f"reasons={','.join(reasons) or 'simple_turn'} message_chars={len(user_message)} "
+            f"history_chars={history_chars}"
+        )
+
+        return {"model": model, "tier": tier, "reasons": reasons}
+
+    def record_latency(self, model: str, seconds: float):
+        """Record completion latency for a model."""
+        window = self._latencies.setdefault(model, deque(maxlen=self.LATENCY_WINDOW))
+        window.append(seconds)
+        logger.info(f"Completion latency: model={model} latency_ms={seconds * 1000:.0f}")
+
+    def timed_completion(self, client, model: str, **kwargs):
+        """Run a chat completion and record its latency."""
+        start = time.perf_counter()
+        try:
+            return client.chat.completions.create(model=model, **kwargs)
+        finally:
+            self.record_latency(model, time.perf_counter() - start)
+
+    async def atimed_completion(self, client, model: str, **kwargs):
+        """Run a chat completion on an async client and record its latency."""
+        start = time.perf_counter()
+        try:
+            return await client.chat.completions.create(model=model, **kwargs)
+        finally:
+            self.record_latency(model, time.perf_counter() - start)
+
+    def latency_summary(self) -> Dict:
+        """Return routing counts and p50/p95 latency per model in milliseconds."""
+        models = {}
+        for model, window in self._latencies.items():
+            samples = sorted(window)
+            if not samples:
+                continue
+            models[model] = {
+                "samples": len(samples),
+                "p50_ms": round(samples[len(samples) // 2] * 1000),
+                "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000)
+            }
+
+        return {
+            "enabled": self.enabled,
+            "small_model": self.small_model,
+            "large_model": self.large_model,
+            "decisions": dict(self._decisions),
+            "latency": models
+        }
+
+
+# Singleton instance
+_router_instance: Optional[ModelRouter] = None
+
+
+def get_model_router() -> ModelRouter:
+    """Get or create model router singleton instance."""
+    global _router_instance
+
+    if _router_instance is None:
+        _router_instance = ModelRouter()
+
+    return _router_instance
@@ -0,0 +1,322 @@
+"""
+Monthly range partitioning of the messages table.
+Creates future partitions ahead of time, archives expired ones, and converts an existing
+unpartitioned table online by attaching it as the first partition.
+"""
+
+import os
+import re
+import sys
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Dict
+from sqlalchemy import text
+from database import engine, Message, SCHEMA_UPDATES
+from table_stats import install_row_counters, adjust_row_count, create_row_count_triggers, drop_row_count_triggers
+
+logger = logging.getLogger(__name__)
+
+# Partition maintenance configuration
+MESSAGE_PARTITION_PREMAKE_MONTHS = int(os.getenv("MESSAGE_PARTITION_PREMAKE_MONTHS", "3"))
+MESSAGE_PARTITION_RETENTION_MONTHS = int(os.getenv("MESSAGE_PARTITION_RETENTION_MONTHS", "0"))  # 0 keeps all
+MESSAGE_PARTITION_ARCHIVE_MODE = os.getenv("MESSAGE_PARTITION_ARCHIVE_MODE", "detach")  # 'detach' or 'drop'
+MESSAGE_PARTITION_ARCHIVE_SCHEMA = os.getenv("MESSAGE_PARTITION_ARCHIVE_SCHEMA", "archive")
+MESSAGE_PARTITION_INTERVAL_SECONDS = int(os.getenv("MESSAGE_PARTITION_INTERVAL_SECONDS", "21600"))
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+PARENT_TABLE = Message.__tablename__
+LEGACY_TABLE = f"{PARENT_TABLE}_legacy"
+
+
+def month_start(moment: datetime) -> datetime:
+    """Truncate a timestamp to the first instant of its month."""
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    """Shift a month-start timestamp by a number of months."""
+    index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    """Name of the partition holding a given month, e.g. messages_y2025m03."""
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def _autocommit():
+    """Open a connection outside a transaction block, as CONCURRENTLY operations require."""
+    connection = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    connection.execute(text(f"SET lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+    return connection
+
+
+def is_partitioned(connection) -> bool:
+    """Whether the messages table is already a partitioned table."""
+    kind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": PARENT_TABLE}
+    ).scalar()
+    return kind == "p"
+
+
+def list_partitions(connection) -> List[Dict]:
+    """List attached partitions with their bounds and pending detach, oldest first."""
+    rows = connection.execute(text("""
+        SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound,
+               pg_inherits.inhdetachpending AS detach_pending
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.oid = to_regclass(:table)
+    """), {"table": PARENT_TABLE}).all()
+
+    partitions = []
+    for row in rows:
+        # Bounds look like: FOR VALUES FROM ('2025-03-01 00:00:00') TO ('2025-04-01 00:00:00')
+        lower = re.search(r"FROM \('([^']+)'\)", row.bound)
+        upper = re.search(r"TO \('([^']+)'\)", row.bound)
+        partitions.append({
+            "name": row.name,
+            "lower": datetime.fromisoformat(lower.group(1)) if lower else None,
+            "upper": datetime.fromisoformat(upper.group(1)) if upper else None,
+            "detach_pending": row.detach_pending
+        })
+    return sorted(partitions, key=lambda p: p["upper"] or datetime.max)
+
+
+def create_partition(connection, month: datetime) -> bool:
+    """
+    Create and attach the partition for one month. Returns False if it already exists.
+
+    The table is built standalone with a matching CHECK constraint and then attached,
+    which only takes a SHARE UPDATE EXCLUSIVE lock on the parent and skips the validation scan.
+    """
+    name = partition_name(month)
+    attached = connection.execute(
+        text("SELECT relispartition FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name}
+    ).scalar()
+    if attached:
+        return False
+
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    # A table left behind by an attach that hit the lock timeout is reused
+    if attached is None:
+        connection.execute(text(
+            f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        ))
+        connection.execute(text(
+            f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds "
+            f"CHECK (timestamp >= '{lower}' AND timestamp < '{upper}')"
+        ))
+    connection.execute(text(
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    ))
+    connection.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds"))
+    logger.info(f"Created partition {name} [{lower}, {upper})")
+    return True
+
+
+def ensure_partitions(months_ahead: int = MESSAGE_PARTITION_PREMAKE_MONTHS) -> int:
+    """Make sure partitions exist from the current month through months_ahead. Returns number created."""
+    created = 0
+    with _autocommit() as connection:
+        if not is_partitioned(connection):
+            return 0
+
+        # Partitions are contiguous, so only months past the newest bound need creating;
+        # starting from that bound also fills any gap left while maintenance was not running
+        current = month_start(datetime.utcnow())
+        uppers = [p["upper"] for p in list_partitions(connection) if p["upper"]]
+        newest = max(uppers) if uppers else None
+        month = min(current, newest) if newest else current
+
+        last = add_months(current, months_ahead)
+        while month <= last:
+            if (newest is None or month >= newest) and create_partition(connection, month):
+                created += 1
+            month = add_months(month, 1)
+
+    return created
+
+
+def archive_old_partitions(retention_months: int = MESSAGE_PARTITION_RETENTION_MONTHS,
+                           mode: str = MESSAGE_PARTITION_ARCHIVE_MODE) -> List[str]:
+    """
+    Detach partitions whose data is entirely older than the retention window.
+
+    DETACH ... CONCURRENTLY keeps reads and writes on other partitions running. Detached
+    tables move to the archive schema, or are dropped when mode is 'drop'. A detach that was
+    interrupted after its first transaction leaves the partition pending; it is finalized and
+    archived on the next run, whatever the retention.
+    """
+    cutoff = add_months(month_start(datetime.utcnow()), -retention_months) if retention_months > 0 else None
+    archived = []
+    with _autocommit() as connection:
+        if not is_partitioned(connection):
+            return []
+
+        for partition in list_partitions(connection):
+            name = partition["name"]
+            if partition["detach_pending"]:
+                # A pending partition can't be detached again, only finalized
+                connection.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} FINALIZE"))
+            elif cutoff is not None and partition["upper"] is not None and partition["upper"] <= cutoff:
+                connection.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} CONCURRENTLY"))
+            else:
+                continue
+
+            # Detaching bypasses the row counter triggers
+            detached_rows = connection.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+            adjust_row_count(connection, PARENT_TABLE, -detached_rows)
+            if mode == "drop":
+                connection.execute(text(f"DROP TABLE {name}"))
+            else:
+                connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {MESSAGE_PARTITION_ARCHIVE_SCHEMA}"))
+                connection.execute(text(f"ALTER TABLE {name} SET SCHEMA {MESSAGE_PARTITION_ARCHIVE_SCHEMA}"))
+            archived.append(partition)
+            logger.info(f"Archived partition {name} ({mode})")
+
+        if archived:
+            # Vectors of other embedding spaces live outside the partitions
+            vector_tables = connection.execute(text(
+                "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() "
+                "AND tablename LIKE 'message\\_vectors\\_%'"
+            )).scalars().all()
+            for table in vector_tables:
+                for partition in archived:
+                    connection.execute(text(
+                        f"DELETE FROM {table} WHERE timestamp >= :lower AND timestamp < :upper"
+                    ), {"lower": partition["lower"] or datetime.min, "upper": partition["upper"] or datetime.max})
+
+    return [partition["name"] for partition in archived]
+
+
+def migrate_to_partitioned():
+    """
+    Convert an existing unpartitioned messages table without rewriting it.
+
+    Slow steps (index builds, constraint validation) run CONCURRENTLY or with weak locks
+    first; the final swap renames the table, creates the partitioned parent and attaches
+    the old table as the partition for everything before next month, all in one short transaction.
+    Works on a table from before init_db's schema updates as well as after them.
+    """
+    with _autocommit() as connection:
+        if is_partitioned(connection):
+            logger.info("Messages table is already partitioned")
+            return
+
+        boundary = add_months(month_start(datetime.utcnow()), 1)
+        boundary_sql = f"'{boundary.isoformat()}'"
+
+        # ATTACH needs the old table to have every column of the new parent
+        for statement in SCHEMA_UPDATES:
+            if statement.startswith(f"ALTER TABLE {PARENT_TABLE} ADD COLUMN"):
+                connection.execute(text(statement))
+
+        # The parent primary key includes the partition key, so the old table needs a matching index
+        logger.info("Building (id, timestamp) unique index concurrently...")
+        connection.execute(text(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {LEGACY_TABLE}_id_timestamp_key "
+            f"ON {PARENT_TABLE} (id, timestamp)"
+        ))
+
+        # Prebuild the parent's secondary indexes so ATTACH adopts them instead of building under lock
+        for statement in SCHEMA_UPDATES:
+            if statement.startswith("CREATE INDEX IF NOT EXISTS") and f" ON {PARENT_TABLE} " in statement:
+                connection.execute(text(statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)))
+
+        # Validated CHECK constraints let SET NOT NULL and ATTACH skip their full-table scans
+        logger.info("Validating partition bound constraints...")
+        for constraint, condition in [
+            (f"{LEGACY_TABLE}_timestamp_not_null", "timestamp IS NOT NULL"),
+            (f"{LEGACY_TABLE}_bounds", f"timestamp < {boundary_sql}"),
+        ]:
+            connection.execute(text(
+                f"ALTER TABLE {PARENT_TABLE} DROP CONSTRAINT IF EXISTS {constraint}"
+            ))
+            connection.execute(text(
+                f"ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT {constraint} CHECK ({condition}) NOT VALID"
+            ))
+            connection.execute(text(f"ALTER TABLE {PARENT_TABLE} VALIDATE CONSTRAINT {constraint}"))
+        connection.execute(text(f"ALTER TABLE {PARENT_TABLE} ALTER COLUMN timestamp SET NOT NULL"))
+
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+
+        # Index names are schema-wide, so move the old ones out of the way first
+        index_names = connection.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+        ), {"table": PARENT_TABLE}).scalars().all()
+        connection.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {LEGACY_TABLE}"))
+        for index_name in index_names:
+            if not index_name.startswith(LEGACY_TABLE):
+                connection.execute(text(f"ALTER INDEX {index_name} RENAME TO {index_name}_legacy"))
+
+        # Partitions can't carry the row counter triggers; they move to the parent below,
+        # in this transaction, so the counter misses no writes and keeps its total
+        counted = drop_row_count_triggers(connection, PARENT_TABLE, LEGACY_TABLE)
+
+        # Swap the id-only primary key for the prebuilt (id, timestamp) index
+        primary_key = connection.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'"
+        ), {"table": LEGACY_TABLE}).scalar()
+        if primary_key:
+            connection.execute(text(f"ALTER TABLE {LEGACY_TABLE} DROP CONSTRAINT {primary_key}"))
+        connection.execute(text(
+            f"ALTER TABLE {LEGACY_TABLE} ADD CONSTRAINT {LEGACY_TABLE}_pkey "
+            f"PRIMARY KEY USING INDEX {LEGACY_TABLE}_id_timestamp_key"
+        ))
+
+        Message.__table__.create(connection)
+        for statement in SCHEMA_UPDATES:
+            if f" ON {PARENT_TABLE} " in statement:
+                connection.execute(text(statement))
+
+        connection.execute(text(
+            f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {LEGACY_TABLE} "
+            f"FOR VALUES FROM (MINVALUE) TO ({boundary_sql})"
+        ))
+        if counted:
+            create_row_count_triggers(connection, PARENT_TABLE)
+
+    created = ensure_partitions()
+    install_row_counters()  # Seeds the counter when the old table had none
+    logger.info(f"Messages table partitioned; legacy rows before {boundary:%Y-%m-%d} "
+                f"kept in {LEGACY_TABLE}, {created} monthly partitions created")
+
+
+def run_partition_maintenance() -> Dict:
+    """Create upcoming partitions and archive expired ones."""
+    try:
+        created = ensure_partitions()
+        archived = archive_old_partitions()
+        return {"created": created, "archived": archived}
+    except Exception as e:
+        logger.error(f"Error in partition maintenance: {e}")
+        return {"created": 0, "archived": [], "error": str(e)}
+
+
+async def run_partition_maintenance_loop(interval: int = MESSAGE_PARTITION_INTERVAL_SECONDS):
+    """Periodically run partition maintenance in a worker thread until cancelled."""
+    logger.info(f"Partition maintenance started (every {interval}s)")
+
+    while True:
+        result = await asyncio.to_thread(run_partition_maintenance)
+        if result["created"] or result["archived"]:
+            logger.info(f"Partition maintenance: {result}")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # `python partitions.py migrate` converts an existing table; otherwise run maintenance once
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        migrate_to_partitioned()
+    else:
+        print(run_partition_maintenance())
@@ -0,0 +1,173 @@
+"""
+On-disk cache of extracted PDF text.
+Pages are stored gzip-compressed and keyed by the file's SHA-256 and the extractor version, so a PDF
+is parsed once per content and extractor, however often it is re-ingested or re-chunked.
+"""
+
+import os
+import json
+import gzip
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import List, Dict
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Extraction cache configuration
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "true").lower() == "true"
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "data/pdf_cache")
+
+# Bump when the stored page format changes; library upgrades change the key on their own
+PDF_CACHE_FORMAT = 1
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def extractor_version() -> str:
+    """Versions of everything that shapes the extracted text."""
+    from importlib.metadata import version
+    return f"pypdf-{version('pypdf')}+langchain-community-{version('langchain-community')}+format-{PDF_CACHE_FORMAT}"
+
+
+def file_hash(path: Path) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PdfTextCache:
+    """Extracted pages of PDFs, loaded from the cache when the file and extractor are unchanged."""
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, enabled: bool = PDF_CACHE_ENABLED):
+        """Create the cache directory when enabled."""
+        self.directory = Path(directory)
+        self.enabled = enabled
+        self.extractor = extractor_version()
+        # Entries of other extractor versions never match, so they only take up space until pruned
+        self.suffix = f".{hashlib.sha256(self.extractor.encode()).hexdigest()[:12]}.json.gz"
+        self.hits = 0
+        self.misses = 0
+        if enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _extract(self, path: Path) -> List[Document]:
+        """Parse the PDF into one document per page."""
+        from langchain_community.document_loaders import PyPDFLoader
+        return PyPDFLoader(str(path)).load()
+
+    def load(self, pdf_file) -> List[Document]:
+        """Pages of a PDF as documents, with metadata as PyPDFLoader produces it."""
+        path = Path(pdf_file)
+        if not self.enabled:
+            return self._extract(path)
+
+        entry = self.directory / f"{file_hash(path)}{self.suffix}"
+        if entry.exists():
+            try:
+                with gzip.open(entry, "rt", encoding="utf-8") as file:
+                    pages = json.load(file)["pages"]
+                self.hits += 1
+                # The cached source is wherever the file was first extracted from
+                return [
+                    Document(page_content=page["page_content"], metadata={**page["metadata"], "source": str(path)})
+                    for page in pages
+                ]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Discarding unreadable PDF cache entry {entry.name}: {e}")
+
+        self.misses += 1
+        documents = self._extract(path)
+        payload = {
+            "source": path.name,
+            "extractor": self.extractor,
+            "extracted_at": time.time(),
+            "pages": [{"page_content": document.page_content, "metadata": document.metadata} for document in documents]
+        }
+        # Write then rename, so concurrent loaders never read a partial entry
+        temporary = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        try:
+            with gzip.open(temporary, "wt", encoding="utf-8", compresslevel=6) as file:
+                json.dump(payload, file, ensure_ascii=False)
+            os.replace(temporary, entry)
+        except OSError as e:
+            logger.warning(f"Could not cache extracted text of {path.name}: {e}")
+            temporary.unlink(missing_ok=True)
+        return documents
+
+    def entries(self) -> List[Path]:
+        """Cache files of every extractor version."""
+        return sorted(self.directory.glob("*.json.gz")) if self.directory.exists() else []
+
+    def prune(self) -> int:
+        """Delete entries written by other extractor versions."""
+        stale = [entry for entry in self.entries() if not entry.name.endswith(self.suffix)]
+        for entry in stale:
+            entry.unlink(missing_ok=True)
+        return len(stale)
+
+    def clear(self) -> int:
+        """Delete every entry."""
+        entries = self.entries()
+        for entry in entries:
+            entry.unlink(missing_ok=True)
+        return len(entries)
+
+    def stats(self) -> Dict:
+        """Entry counts, size on disk and this process's hit rate."""
+        entries = self.entries()
+        return {
+            "enabled": self.enabled,
+            "directory": str(self.directory),
+            "extractor": self.extractor,
+            "entries": len(entries),
+            "current_entries": sum(1 for entry in entries if entry.name.endswith(self.suffix)),
+            "bytes": sum(entry.stat().st_size for entry in entries),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Singleton instance
+_pdf_cache = None
+
+
+def get_pdf_cache() -> PdfTextCache:
+    """Get or create the PDF text cache singleton."""
+    global _pdf_cache
+    if _pdf_cache is None:
+        _pdf_cache = PdfTextCache()
+    return _pdf_cache
+
+
+def load_pdf(pdf_file) -> List[Document]:
+    """Pages of a PDF through the shared cache."""
+    return get_pdf_cache().load(pdf_file)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # python pdf_cache.py [stats | warm [PDF_DIRECTORY] | prune | clear]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = get_pdf_cache()
+    if command == "warm":
+        for pdf_file in sorted(Path(sys.argv[2] if len(sys.argv) > 2 else "knowledge_base").glob("*.pdf")):
+            started = time.perf_counter()
+            pages = cache.load(pdf_file)
+            logger.info(f"{pdf_file.name}: {len(pages)} pages in {time.perf_counter() - started:.3f}s")
+    elif command == "prune":
+        logger.info(f"Removed {cache.prune()} stale entries")
+    elif command == "clear":
+        logger.info(f"Removed {cache.clear()} entries")
+    print(json.dumps(cache.stats(), indent=2))
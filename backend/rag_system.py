@@ -5,17 +5,35 @@ Handles PDF processing, embedding generation, and context retrieval.
 
 import os
 import json
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Callable, Optional
 from pathlib import Path
-from openai import OpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
+from openai import OpenAI, AsyncOpenAI
 from sqlalchemy.orm import Session
-from database import KnowledgeDocument, engine, SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import knowledge_search_query, run_read
+from storage import get_storage
+from chunk_dedup import deduplicate_chunks, CHUNK_DEDUP_ENABLED
+from text_chunker import TextChunker
+from pdf_cache import load_pdf
+from embedding_scheduler import get_embedding_scheduler
+from retrieval_gate import get_retrieval_gate, RETRIEVAL_MAX_K
+from embedding_spaces import (
+    EMBEDDING_MODEL, EMBEDDING_DIMENSION, LEGACY_SPACE, EmbeddingSpace,
+    embedding_options, get_space_registry, request_dimensions, split_embeddings
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Prompt size limits; turns older than the recent window are carried by the rolling conversation summary
+RECENT_HISTORY_MESSAGES = int(os.getenv("RECENT_HISTORY_MESSAGES", "6"))
+MAX_HISTORY_MESSAGE_CHARS = int(os.getenv("MAX_HISTORY_MESSAGE_CHARS", "600"))
+# Chunks embedded before each round of writes when indexing
+INDEX_PAGE_SIZE = int(os.getenv("INDEX_PAGE_SIZE", "500"))
+
+INDEX_JOB = "knowledge_index"
+
 
 class TherapeuticRAG:
     """RAG system for retrieving therapeutic knowledge from PDF documents."""
@@ -23,31 +41,72 @@ class TherapeuticRAG:
     def __init__(self, openai_api_key: str):
         """Initialize RAG system with OpenAI client."""
         self.client = OpenAI(api_key=openai_api_key)
-        self.embedding_model = "text-embedding-ada-002"
-        self.embedding_dimension = 1536
-        
-        # Text splitter for chunking documents
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-    
-    def create_embedding(self, text: str) -> List[float]:
-        """Create embedding for given text using OpenAI."""
+        self.async_client = AsyncOpenAI(api_key=openai_api_key)
+        self.embedding_model = EMBEDDING_MODEL
+        self.embedding_dimension = EMBEDDING_DIMENSION
+        
+        # Heading and sentence aware chunker, sized in tokens
+        self.text_chunker = TextChunker()
+        # Similarity floor and adaptive k for retrieved chunks
+        self.gate = get_retrieval_gate()
+    
+    def create_space_embeddings(self, text: str, on_usage: Callable[[int], None] = None,
+                                spaces: Optional[List[EmbeddingSpace]] = None) -> Dict[str, List[float]]:
+        """
+        Embed text for every written embedding space, keyed by space name.
+        
+        Makes one call per model, at the largest dimension its spaces need.
+        """
+        spaces = spaces if spaces is not None else get_space_registry().written()
+        model_embeddings = {}
         try:
-            response = self.client.embeddings.create(
-                input=text,
-                model=self.embedding_model
-            )
-            return response.data[0].embedding
+            for model, dimension in request_dimensions(spaces).items():
+                response = self.client.embeddings.create(
+                    input=text, model=model, **embedding_options(model, dimension)
+                )
+                if on_usage and response.usage:
+                    on_usage(response.usage.total_tokens)
+                model_embeddings[model] = response.data[0].embedding
         except Exception as e:
             logger.error(f"Error creating embedding: {e}")
             raise
+        return split_embeddings(model_embeddings, spaces)
     
-    def load_pdf_documents(self, pdf_directory: str = "knowledge_base"):
-        """Load and process all PDF documents in the directory."""
+    async def acreate_space_embeddings(self, text: str, on_usage: Callable[[int], None] = None,
+                                       spaces: Optional[List[EmbeddingSpace]] = None) -> Dict[str, List[float]]:
+        """Async variant of create_space_embeddings for the request path, calling each model concurrently."""
+        spaces = spaces if spaces is not None else get_space_registry().written()
+        dimensions = request_dimensions(spaces)
+        try:
+            responses = await asyncio.gather(*(
+                self.async_client.embeddings.create(
+                    input=text, model=model, **embedding_options(model, dimension)
+                )
+                for model, dimension in dimensions.items()
+            ))
+        except Exception as e:
+            logger.error(f"Error creating embedding: {e}")
+            raise
+        model_embeddings = {}
+        for model, response in zip(dimensions, responses):
+            if on_usage and response.usage:
+                on_usage(response.usage.total_tokens)
+            model_embeddings[model] = response.data[0].embedding
+        return split_embeddings(model_embeddings, spaces)
+    
+    def create_embedding(self, text: str, on_usage: Callable[[int], None] = None) -> List[float]:
+        """Create embedding for given text in the active space, reporting token usage to on_usage."""
+        active = get_space_registry().active()
+        return self.create_space_embeddings(text, on_usage, spaces=[active])[active.name]
+    
+    async def acreate_embedding(self, text: str, on_usage: Callable[[int], None] = None) -> List[float]:
+        """Async variant of create_embedding for the request path."""
+        active = get_space_registry().active()
+        return (await self.acreate_space_embeddings(text, on_usage, spaces=[active]))[active.name]
+    
+    def load_pdf_documents(self, pdf_directory: str = "knowledge_base",
+                           deduplicate: bool = CHUNK_DEDUP_ENABLED):
+        """Load and process all PDF documents in the directory, collapsing near-duplicate chunks."""
         pdf_path = Path(pdf_directory)
         if not pdf_path.exists():
             logger.warning(f"PDF directory {pdf_directory} does not exist")
@@ -61,18 +120,26 @@ class TherapeuticRAG:
         for pdf_file in pdf_files:
             try:
                 logger.info(f"Processing {pdf_file.name}...")
-                loader = PyPDFLoader(str(pdf_file))
-                documents = loader.load()
+                # Extracted pages are cached by file hash, so unchanged PDFs aren't parsed again
+                documents = load_pdf(pdf_file)
                 
-                # Split documents into chunks
-                chunks = self.text_splitter.split_documents(documents)
+                # Split the whole document at once so chunks can run across page breaks
+                pages = {document.metadata.get("page", i): document.metadata for i, document in enumerate(documents)}
+                chunks = self.text_chunker.split_pages([
+                    (document.metadata.get("page", i), document.page_content) for i, document in enumerate(documents)
+                ])
                 
                 for i, chunk in enumerate(chunks):
+                    # Page, end page and character offsets within them cite the chunk's source
+                    metadata = {
+                        **pages[chunk.page], "end_page": chunk.end_page, "char_start": chunk.char_start,
+                        "char_end": chunk.char_end, "tokens": chunk.tokens, "heading": chunk.heading
+                    }
                     all_chunks.append({
                         "source_file": pdf_file.name,
                         "chunk_index": i,
-                        "content": chunk.page_content,
-                        "doc_metadata": json.dumps(chunk.metadata)
+                        "content": chunk.content,
+                        "doc_metadata": json.dumps(metadata)
                     })
                 
                 logger.info(f"Created {len(chunks)} chunks from {pdf_file.name}")
@@ -81,62 +148,105 @@ class TherapeuticRAG:
                 logger.error(f"Error processing {pdf_file.name}: {e}")
                 continue
         
+        if deduplicate and all_chunks:
+            all_chunks, report = deduplicate_chunks(all_chunks)
+            logger.info(f"Removed {report['removed']} near-duplicate chunks: {report}")
+        
         return all_chunks
     
-    def index_documents(self, db: Session, chunks: List[Dict]):
-        """Create embeddings and store in database."""
+    def index_documents(self, chunks: List[Dict], batch_size: int = 10, version: Optional[int] = None):
+        """Create embeddings and store them in the configured storage backend, optionally as a knowledge version."""
         logger.info(f"Indexing {len(chunks)} document chunks...")
+        storage = get_storage()
+        spaces = get_space_registry().written()
+        dimensions = request_dimensions(spaces)
         
-        for i, chunk in enumerate(chunks):
+        for start in range(0, len(chunks), INDEX_PAGE_SIZE):
+            page = chunks[start:start + INDEX_PAGE_SIZE]
+            texts = [chunk["content"] for chunk in page]
             try:
-                # Create embedding
-                embedding = self.create_embedding(chunk["content"])
-                
-                # Store in database
-                doc = KnowledgeDocument(
-                    source_file=chunk["source_file"],
-                    chunk_index=chunk["chunk_index"],
-                    content=chunk["content"],
-                    embedding=embedding,
-                    doc_metadata=chunk["doc_metadata"]
-                )
-                db.add(doc)
-                
-                if (i + 1) % 10 == 0:
-                    db.commit()
-                    logger.info(f"Indexed {i + 1}/{len(chunks)} chunks")
-            
+                # Chunks get a vector in every written space, so a cutover never finds them missing.
+                # The scheduler batches and paces the requests within each model's rate limits.
+                model_embeddings = {
+                    model: get_embedding_scheduler(model, self.client).embed(texts, dimension, subject=INDEX_JOB)
+                    for model, dimension in dimensions.items()
+                }
             except Exception as e:
-                logger.error(f"Error indexing chunk {i}: {e}")
+                logger.error(f"Error indexing chunks {start}-{start + len(page) - 1}: {e}")
                 continue
+            
+            documents = []
+            for i, chunk in enumerate(page):
+                vectors = split_embeddings({model: embeddings[i] for model, embeddings in model_embeddings.items()}, spaces)
+                documents.append({
+                    "source_file": chunk["source_file"],
+                    "chunk_index": chunk["chunk_index"],
+                    "content": chunk["content"],
+                    "embedding": vectors.pop(LEGACY_SPACE, None),
+                    "space_embeddings": vectors,
+                    "doc_metadata": chunk["doc_metadata"],
+                    **({"version": version} if version is not None else {})
+                })
+            for i in range(0, len(documents), batch_size):
+                storage.add_knowledge_documents(documents[i:i + batch_size])
+            logger.info(f"Indexed {start + len(page)}/{len(chunks)} chunks")
         
-        db.commit()
         logger.info("Document indexing complete!")
     
-    def retrieve_relevant_context(self, db: Session, query: str, k: int = 5) -> List[str]:
-        """Retrieve most relevant context chunks for a query."""
+    def retrieve_scored_context(self, db: Session, query: str, k: int = RETRIEVAL_MAX_K,
+                                query_embedding: List[float] = None) -> List[Dict]:
+        """Retrieve up to k relevant context chunks with their cosine similarity, gated by score."""
         try:
-            # Create embedding for query
-            query_embedding = self.create_embedding(query)
+            # Create embedding for query unless the caller already has one
+            if query_embedding is None:
+                query_embedding = self.create_embedding(query)
             
             # Search for similar documents using pgvector
-            results = db.query(KnowledgeDocument).order_by(
-                KnowledgeDocument.embedding.cosine_distance(query_embedding)
-            ).limit(k).all()
+            query = knowledge_search_query(query_embedding, k)
+            results = run_read(db, lambda session: session.execute(query).all())
             
-            # Extract content from results
-            contexts = [doc.content for doc in results]
+            scored = self.gate.select(self.score_results(results), get_space_registry().active().model)
+            logger.info(f"Retrieved {len(scored)} relevant context chunks")
+            return scored
+        
+        except Exception as e:
+            logger.error(f"Error retrieving context: {e}")
+            return []
+    
+    async def aretrieve_scored_context(self, db: AsyncSession, query: str, k: int = RETRIEVAL_MAX_K,
+                                       query_embedding: List[float] = None) -> List[Dict]:
+        """Async variant of retrieve_scored_context for the request path."""
+        try:
+            if query_embedding is None:
+                query_embedding = await self.acreate_embedding(query)
+            
+            results = await get_storage().search_knowledge(db, query_embedding, k)
             
-            logger.info(f"Retrieved {len(contexts)} relevant context chunks")
-            return contexts
+            scored = self.gate.select(self.score_results(results), get_space_registry().active().model)
+            logger.info(f"Retrieved {len(scored)} relevant context chunks")
+            return scored
         
         except Exception as e:
             logger.error(f"Error retrieving context: {e}")
             return []
     
+    @staticmethod
+    def score_results(results) -> List[Dict]:
+        """Convert (content, distance) rows to content with cosine similarity."""
+        return [
+            {"content": row.content, "similarity": 1.0 - float(row.distance)}
+            for row in results
+        ]
+    
+    def retrieve_relevant_context(self, db: Session, query: str, k: int = RETRIEVAL_MAX_K) -> List[str]:
+        """Retrieve most relevant context chunks for a query."""
+        return [result["content"] for result in self.retrieve_scored_context(db, query, k)]
+    
     def build_prompt_with_context(self, user_message: str, contexts: List[str], 
-                                  conversation_history: List[Dict] = None) -> str:
-        """Build a prompt with retrieved context and conversation history."""
+                                  conversation_history: List[Dict] = None,
+                                  conversation_summary: str = None,
+                                  memories: List[str] = None) -> str:
+        """Build a prompt with retrieved context, user memories, summary and recent history."""
         
         # System prompt for therapeutic chatbot
         system_prompt = """You are a compassionate digital wellness therapist helping people achieve happiness and well-being through technology balance. You draw from Christian Dominique's "Beyond Happy" and "The Four Aces" frameworks.
@@ -172,18 +282,32 @@ Safety:
 
 Use the provided knowledge base context to inform your responses with the Four Aces, 7Cs, and 8Ps frameworks."""
         
-        # Build context section
-        context_section = "\n\n=== RELEVANT KNOWLEDGE BASE ===\n"
-        for i, context in enumerate(contexts, 1):
-            context_section += f"\n[Context {i}]\n{context}\n"
+        # Build context section; gated retrieval may leave it empty
+        context_section = ""
+        if contexts:
+            context_section = "\n\n=== RELEVANT KNOWLEDGE BASE ===\n"
+            for i, context in enumerate(contexts, 1):
+                context_section += f"\n[Context {i}]\n{context}\n"
+        
+        # Build section with the user's relevant past conversations
+        if memories:
+            context_section += "\n\n=== FROM PAST CONVERSATIONS WITH THIS USER ===\n"
+            for memory in memories:
+                context_section += f"- {memory}\n"
         
         # Build conversation history section
         history_section = ""
+        if conversation_summary:
+            history_section = f"\n\n=== CONVERSATION SUMMARY ===\n{conversation_summary}\n"
         if conversation_history:
-            history_section = "\n\n=== CONVERSATION HISTORY ===\n"
-            for msg in conversation_history[-6:]:  # Last 6 messages for context
+            history_section += "\n\n=== CONVERSATION HISTORY ===\n"
+            # The caller passes every message the summary does not cover yet
+            for msg in conversation_history:
                 role = "User" if msg["role"] == "user" else "Therapist"
-                history_section += f"{role}: {msg['content']}\n"
+                content = msg["content"]
+                if len(content) > MAX_HISTORY_MESSAGE_CHARS:
+                    content = content[:MAX_HISTORY_MESSAGE_CHARS] + "..."
+                history_section += f"{role}: {content}\n"
         
         # Build full prompt
         full_prompt = f"""{system_prompt}
@@ -212,12 +336,9 @@ def initialize_knowledge_base():
     # Initialize RAG system
     rag = TherapeuticRAG(openai_api_key)
     
-    # Create database session
-    db = SessionLocal()
-    
     try:
         # Check if knowledge base already exists
-        existing_docs = db.query(KnowledgeDocument).count()
+        existing_docs = get_storage().count_knowledge_documents()
         if existing_docs > 0:
             logger.info(f"Knowledge base already initialized with {existing_docs} documents")
             return True
@@ -230,7 +351,7 @@ def initialize_knowledge_base():
             return False
         
         # Index documents
-        rag.index_documents(db, chunks)
+        rag.index_documents(chunks)
         
         logger.info("Knowledge base initialization complete!")
         return True
@@ -238,9 +359,6 @@ def initialize_knowledge_base():
     except Exception as e:
         logger.error(f"Error initializing knowledge base: {e}")
         return False
-    
-    finally:
-        db.close()
 
 
 if __name__ == "__main__":
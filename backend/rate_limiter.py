@@ -0,0 +1,389 @@
+"""
+Token-bucket rate limiting and per-user LLM token accounting.
+Buckets live in-process by default, or in Redis when REDIS_URL is set for multi-worker deployments.
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rate limit configuration
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+USER_REQUESTS_PER_MINUTE = float(os.getenv("USER_REQUESTS_PER_MINUTE", "10"))
+USER_TOKENS_PER_HOUR = float(os.getenv("USER_TOKENS_PER_HOUR", "30000"))
+GLOBAL_REQUESTS_PER_MINUTE = float(os.getenv("GLOBAL_REQUESTS_PER_MINUTE", "300"))
+GLOBAL_TOKENS_PER_MINUTE = float(os.getenv("GLOBAL_TOKENS_PER_MINUTE", "150000"))
+# Share of the global budgets background jobs leave untouched for live traffic
+BACKGROUND_BUDGET_RESERVE = float(os.getenv("BACKGROUND_BUDGET_RESERVE", "0.5"))
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_TIMEOUT_SECONDS = float(os.getenv("REDIS_TIMEOUT_SECONDS", "0.5"))
+# Shared per-user usage counters expire this long after the user's last activity
+USAGE_RETENTION_DAYS = float(os.getenv("USAGE_RETENTION_DAYS", "30"))
+# Bearer token for the usage endpoints, which expose per-user activity
+USAGE_API_TOKEN = os.getenv("USAGE_API_TOKEN")
+
+# Minimum balance meaning "always allow" for post-call debits
+_FORCE = -1e18
+
+USAGE_FIELDS = ["requests", "rejected", "prompt_tokens", "completion_tokens", "embedding_tokens"]
+
+
+class InMemoryBucketStore:
+    """Token buckets and usage counters held in this process."""
+
+    # Idle buckets are pruned once this many exist
+    MAX_BUCKETS = 50000
+    # Usage counters of the least recently active subjects are dropped beyond this many
+    MAX_USAGE_SUBJECTS = 50000
+
+    def __init__(self):
+        """Initialize empty bucket and usage tables."""
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._usage: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, capacity: float, rate: float, amount: float, minimum: float) -> bool:
+        """Refill bucket, then deduct amount if its balance is at least minimum."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= minimum
+            if allowed:
+                tokens -= amount
+            self._buckets[key] = (tokens, now)
+
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune(now)
+        return allowed
+
+    def _prune(self, now: float):
+        """Drop buckets that have been idle long enough to be full again."""
+        stale = [key for key, (_, updated) in self._buckets.items() if now - updated > 3600]
+        for key in stale:
+            del self._buckets[key]
+
+    def add_usage(self, subject: str, field: str, amount: int):
+        """Increment a usage counter."""
+        with self._lock:
+            usage = self._usage.setdefault(subject, dict.fromkeys(USAGE_FIELDS, 0))
+            usage[field] += amount
+            self._usage.move_to_end(subject)
+
+            while len(self._usage) > self.MAX_USAGE_SUBJECTS:
+                oldest = next(iter(self._usage))
+                if oldest == "global":
+                    self._usage.move_to_end(oldest)
+                    oldest = next(iter(self._usage))
+                del self._usage[oldest]
+
+    def get_usage(self, subject: str) -> Dict[str, int]:
+        """Return usage counters for a subject."""
+        with self._lock:
+            return dict(self._usage.get(subject, dict.fromkeys(USAGE_FIELDS, 0)))
+
+    def top_usage(self, limit: int) -> Dict[str, Dict[str, int]]:
+        """Return the heaviest users by total tokens."""
+        with self._lock:
+            ranked = sorted(
+                ((subject, usage) for subject, usage in self._usage.items() if subject != "global"),
+                key=lambda item: -(item[1]["prompt_tokens"] + item[1]["completion_tokens"]
+                                   + item[1]["embedding_tokens"])
+            )
+            return {subject: dict(usage) for subject, usage in ranked[:limit]}
+
+
+class RedisBucketStore:
+    """
+    Token buckets and usage counters shared across workers through Redis.
+
+    Per-user usage expires USAGE_RETENTION_DAYS after the user's last activity and the
+    ranking keeps only the heaviest MAX_USAGE_SUBJECTS users, so neither grows without bound.
+    """
+
+    MAX_USAGE_SUBJECTS = InMemoryBucketStore.MAX_USAGE_SUBJECTS
+
+    ACQUIRE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local minimum = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= minimum then
+    tokens = tokens - amount
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 7200)
+return allowed
+"""
+
+    def __init__(self, url: str):
+        """Connect to Redis and register the bucket script."""
+        import redis  # Optional dependency, only needed for shared state
+
+        # Short timeouts, so an unreachable Redis fails fast and the limiter falls back
+        self.redis = redis.Redis.from_url(
+            url, socket_timeout=REDIS_TIMEOUT_SECONDS, socket_connect_timeout=REDIS_TIMEOUT_SECONDS
+        )
+        self.redis.ping()
+        self._acquire = self.redis.register_script(self.ACQUIRE_SCRIPT)
+
+    def acquire(self, key: str, capacity: float, rate: float, amount: float, minimum: float) -> bool:
+        """Atomically refill and deduct from a shared bucket."""
+        return bool(self._acquire(
+            keys=[f"ratelimit:{key}"], args=[capacity, rate, amount, minimum, time.time()]
+        ))
+
+    def add_usage(self, subject: str, field: str, amount: int):
+        """Increment a shared usage counter, extending the subject's retention."""
+        pipe = self.redis.pipeline()
+        pipe.hincrby(f"usage:{subject}", field, amount)
+        if subject != "global":
+            pipe.expire(f"usage:{subject}", int(USAGE_RETENTION_DAYS * 86400))
+            if field in ("prompt_tokens", "completion_tokens", "embedding_tokens"):
+                pipe.zincrby("usage:ranking", amount, subject)
+                # Drop the lightest users beyond the bound
+                pipe.zremrangebyrank("usage:ranking", 0, -self.MAX_USAGE_SUBJECTS - 1)
+        pipe.execute()
+
+    def get_usage(self, subject: str) -> Dict[str, int]:
+        """Return shared usage counters for a subject."""
+        raw = self.redis.hgetall(f"usage:{subject}")
+        usage = dict.fromkeys(USAGE_FIELDS, 0)
+        usage.update({key.decode(): int(value) for key, value in raw.items()})
+        return usage
+
+    def top_usage(self, limit: int) -> Dict[str, Dict[str, int]]:
+        """Return the heaviest users by total tokens."""
+        subjects = self.redis.zrevrange("usage:ranking", 0, limit - 1)
+        top, expired = {}, []
+        for subject in subjects:
+            if self.redis.exists(f"usage:{subject.decode()}"):
+                top[subject.decode()] = self.get_usage(subject.decode())
+            else:
+                expired.append(subject)
+        # Users whose counters expired leave the ranking as they are found
+        if expired:
+            self.redis.zrem("usage:ranking", *expired)
+        return top
+
+
+class FailoverBucketStore:
+    """
+    Shared bucket store that fails open to in-process buckets while it is unreachable.
+
+    A failed call is logged and served by the fallback; the shared store is retried
+    after RETRY_SECONDS, so an outage neither rejects every user nor slows each request.
+    """
+
+    RETRY_SECONDS = 5.0
+
+    def __init__(self, primary, fallback=None):
+        """Initialize with the shared store and the in-process store used during outages."""
+        self.primary = primary
+        self.fallback = fallback or InMemoryBucketStore()
+        self._failed_at: Optional[float] = None
+
+    def _call(self, method: str, *args):
+        """Run a store method on the primary, or on the fallback while the primary is down."""
+        if self._failed_at is not None and time.monotonic() - self._failed_at < self.RETRY_SECONDS:
+            return getattr(self.fallback, method)(*args)
+        try:
+            result = getattr(self.primary, method)(*args)
+        except Exception as e:
+            if self._failed_at is None:
+                logger.error(f"Shared rate limit store unavailable, using in-process buckets: {e}")
+            self._failed_at = time.monotonic()
+            return getattr(self.fallback, method)(*args)
+        if self._failed_at is not None:
+            logger.info("Shared rate limit store reachable again")
+            self._failed_at = None
+        return result
+
+    def acquire(self, key: str, capacity: float, rate: float, amount: float, minimum: float) -> bool:
+        return self._call("acquire", key, capacity, rate, amount, minimum)
+
+    def add_usage(self, subject: str, field: str, amount: int):
+        self._call("add_usage", subject, field, amount)
+
+    def get_usage(self, subject: str) -> Dict[str, int]:
+        return self._call("get_usage", subject)
+
+    def top_usage(self, limit: int) -> Dict[str, Dict[str, int]]:
+        return self._call("top_usage", limit)
+
+
+class RateLimiter:
+    """Per-user and global limits on requests and LLM tokens."""
+
+    def __init__(self, store=None, enabled: bool = RATE_LIMIT_ENABLED):
+        """Initialize limiter with a bucket store."""
+        self.store = store or InMemoryBucketStore()
+        self.enabled = enabled
+        # (capacity, refill per second) for each bucket type
+        self.user_requests = (USER_REQUESTS_PER_MINUTE, USER_REQUESTS_PER_MINUTE / 60)
+        self.user_tokens = (USER_TOKENS_PER_HOUR, USER_TOKENS_PER_HOUR / 3600)
+        self.global_requests = (GLOBAL_REQUESTS_PER_MINUTE, GLOBAL_REQUESTS_PER_MINUTE / 60)
+        self.global_tokens = (GLOBAL_TOKENS_PER_MINUTE, GLOBAL_TOKENS_PER_MINUTE / 60)
+
+    def check(self, whatsapp_number: str) -> Optional[str]:
+        """
+        Admit one LLM-backed request.
+
+        Returns:
+            None if allowed, otherwise the name of the exhausted limit
+        """
+        if not self.enabled:
+            return None
+
+        # Token budgets are debited after each call, so only require a positive balance
+        checks = [
+            ("user_tokens", f"user_tokens:{whatsapp_number}", self.user_tokens, 0, 1),
+            ("global_tokens", "global_tokens", self.global_tokens, 0, 1),
+            ("user_requests", f"user_requests:{whatsapp_number}", self.user_requests, 1, 1),
+            ("global_requests", "global_requests", self.global_requests, 1, 1),
+        ]
+        debited = []
+        for name, key, (capacity, rate), amount, minimum in checks:
+            if not self.store.acquire(key, capacity, rate, amount, minimum):
+                # A rejected request spends nothing, so return what earlier buckets took
+                for debited_key, (debited_capacity, debited_rate), debited_amount in debited:
+                    self.store.acquire(debited_key, debited_capacity, debited_rate, -debited_amount, _FORCE)
+                self.store.add_usage(whatsapp_number, "rejected", 1)
+                self.store.add_usage("global", "rejected", 1)
+                logger.warning(f"Rate limit {name} exceeded for {whatsapp_number}")
+                return name
+            if amount:
+                debited.append((key, (capacity, rate), amount))
+
+        self.store.add_usage(whatsapp_number, "requests", 1)
+        self.store.add_usage("global", "requests", 1)
+        return None
+
+    def record_usage(self, whatsapp_number: str, prompt_tokens: int = 0,
+                     completion_tokens: int = 0, embedding_tokens: int = 0):
+        """Debit token buckets and accumulate usage from an API response."""
+        total = prompt_tokens + completion_tokens + embedding_tokens
+        if total <= 0:
+            return
+
+        if self.enabled:
+            capacity, rate = self.user_tokens
+            self.store.acquire(f"user_tokens:{whatsapp_number}", capacity, rate, total, _FORCE)
+            capacity, rate = self.global_tokens
+            self.store.acquire("global_tokens", capacity, rate, total, _FORCE)
+
+        for field, amount in (("prompt_tokens", prompt_tokens),
+                              ("completion_tokens", completion_tokens),
+                              ("embedding_tokens", embedding_tokens)):
+            if amount:
+                self.store.add_usage(whatsapp_number, field, amount)
+                self.store.add_usage("global", field, amount)
+
+    def background_token_capacity(self, reserve: float = BACKGROUND_BUDGET_RESERVE) -> float:
+        """Largest background call, in tokens, the global budget can admit above its reserve."""
+        capacity, _ = self.global_tokens
+        return capacity * (1 - reserve)
+
+    def acquire_background(self, tokens: int, reserve: float = BACKGROUND_BUDGET_RESERVE) -> bool:
+        """
+        Admit one background API call estimated at `tokens` tokens.
+
+        Debits the global buckets only while they stay above `reserve` of their capacity,
+        so batch jobs soak up idle budget without starving user requests. Raises ValueError
+        for a call larger than that spare budget, which could never be admitted.
+        """
+        if not self.enabled:
+            return True
+        if tokens > self.background_token_capacity(reserve):
+            raise ValueError(
+                f"Background call of {tokens} tokens exceeds the {self.background_token_capacity(reserve):.0f} "
+                f"tokens the global budget leaves above its reserve"
+            )
+
+        capacity, rate = self.global_requests
+        if not self.store.acquire("global_requests", capacity, rate, 1, min(capacity, capacity * reserve + 1)):
+            return False
+
+        capacity, rate = self.global_tokens
+        if not self.store.acquire("global_tokens", capacity, rate, tokens, min(capacity, capacity * reserve + tokens)):
+            # Return the request slot taken above
+            capacity, rate = self.global_requests
+            self.store.acquire("global_requests", capacity, rate, -1, _FORCE)
+            return False
+        return True
+
+    def record_background_usage(self, subject: str, estimated_tokens: int, embedding_tokens: int,
+                                debited: bool = True):
+        """
+        Record a background call's usage under subject.
+
+        When the call was admitted through acquire_background (debited), the global
+        token bucket is also corrected from the estimate to the actual usage.
+        """
+        if self.enabled and debited and embedding_tokens != estimated_tokens:
+            capacity, rate = self.global_tokens
+            self.store.acquire("global_tokens", capacity, rate, embedding_tokens - estimated_tokens, _FORCE)
+
+        self.store.add_usage(subject, "requests", 1)
+        self.store.add_usage(subject, "embedding_tokens", embedding_tokens)
+        self.store.add_usage("global", "embedding_tokens", embedding_tokens)
+
+    def record_completion(self, whatsapp_number: str, response):
+        """Record token usage from a chat completion response."""
+        usage = getattr(response, "usage", None)
+        if usage:
+            self.record_usage(
+                whatsapp_number,
+                prompt_tokens=usage.prompt_tokens or 0,
+                completion_tokens=usage.completion_tokens or 0
+            )
+
+    def usage_report(self, whatsapp_number: str = None, limit: int = 20) -> Dict:
+        """Return usage for one user, or global usage with the top users."""
+        if whatsapp_number:
+            return {"whatsapp_number": whatsapp_number, "usage": self.store.get_usage(whatsapp_number)}
+
+        return {
+            "enabled": self.enabled,
+            "limits": {
+                "user_requests_per_minute": USER_REQUESTS_PER_MINUTE,
+                "user_tokens_per_hour": USER_TOKENS_PER_HOUR,
+                "global_requests_per_minute": GLOBAL_REQUESTS_PER_MINUTE,
+                "global_tokens_per_minute": GLOBAL_TOKENS_PER_MINUTE
+            },
+            "global": self.store.get_usage("global"),
+            "top_users": self.store.top_usage(limit)
+        }
+
+
+# Singleton instance
+_limiter_instance: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get or create rate limiter singleton instance."""
+    global _limiter_instance
+
+    if _limiter_instance is None:
+        store = None
+        if REDIS_URL:
+            try:
+                store = FailoverBucketStore(RedisBucketStore(REDIS_URL))
+                logger.info("Rate limiter using shared Redis backend")
+            except Exception as e:
+                logger.error(f"Redis unavailable for rate limiting, using in-process buckets: {e}")
+        _limiter_instance = RateLimiter(store)
+
+    return _limiter_instance
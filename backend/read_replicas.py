@@ -0,0 +1,121 @@
+"""
+Routing decisions for read-only queries across PostgreSQL read replicas.
+Tracks replica lag and recent writes so reads only go to replicas that can already see them.
+"""
+
+import os
+import time
+import itertools
+import threading
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Replica configuration
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "2"))
+RECENT_WRITES_MAX_ENTRIES = int(os.getenv("RECENT_WRITES_MAX_ENTRIES", "50000"))
+
+# Replay lag in seconds; zero when the replica has replayed everything it received
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaRouter:
+    """Picks a replica for each read, or None for the primary."""
+
+    def __init__(self, urls: List[str] = DATABASE_REPLICA_URLS,
+                 max_lag: float = REPLICA_MAX_LAG_SECONDS):
+        """Initialize with replica URLs; replicas are unused until their lag has been measured."""
+        self.urls = urls
+        self.max_lag = max_lag
+        self._lag: List[Optional[float]] = [None] * len(urls)
+        self._checked_at: List[float] = [0.0] * len(urls)
+        self._recent_writes: "OrderedDict[object, float]" = OrderedDict()
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {"replica_reads": 0, "primary_reads": 0, "read_your_writes": 0, "failures": 0}
+
+    def mark_written(self, *keys):
+        """Record a write affecting these keys so their reads stay on the primary for a while."""
+        if not self.urls:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._recent_writes[key] = now
+                self._recent_writes.move_to_end(key)
+            while len(self._recent_writes) > RECENT_WRITES_MAX_ENTRIES:
+                self._recent_writes.popitem(last=False)
+
+    def choose(self, key=None) -> Optional[int]:
+        """Return the index of a replica to read from, or None to use the primary."""
+        if not self.urls:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            # Any replica we pick lags by at most max_lag, so older writes are visible on it
+            written_at = self._recent_writes.get(key) if key is not None else None
+            if written_at is not None and now - written_at <= self.max_lag:
+                self._stats["read_your_writes"] += 1
+                self._stats["primary_reads"] += 1
+                return None
+
+            # Lag measurements go stale if the monitor stops, so require a recent one
+            fresh = REPLICA_LAG_CHECK_INTERVAL * 3
+            healthy = [
+                index for index, lag in enumerate(self._lag)
+                if lag is not None and lag <= self.max_lag and now - self._checked_at[index] <= fresh
+            ]
+            if not healthy:
+                self._stats["primary_reads"] += 1
+                return None
+
+            self._stats["replica_reads"] += 1
+            return healthy[next(self._round_robin) % len(healthy)]
+
+    def record_lag(self, index: int, lag: Optional[float]):
+        """Store a lag measurement; None marks the replica unreachable."""
+        with self._lock:
+            if lag is None and self._lag[index] is not None:
+                logger.warning(f"Read replica {index} unavailable, routing reads to primary")
+            self._lag[index] = lag
+            self._checked_at[index] = time.monotonic()
+
+    def record_failure(self, index: int):
+        """Take a replica out of rotation after a failed read until the next lag check."""
+        self._stats["failures"] += 1
+        self.record_lag(index, None)
+
+    def stats(self) -> Dict:
+        """Return routing counters and current replica lag."""
+        return {
+            **self._stats,
+            "replicas": len(self.urls),
+            "lag_seconds": list(self._lag)
+        }
+
+
+# Singleton instance
+_router_instance: Optional[ReplicaRouter] = None
+
+
+def get_replica_router() -> ReplicaRouter:
+    """Get or create replica router singleton instance."""
+    global _router_instance
+
+    if _router_instance is None:
+        _router_instance = ReplicaRouter()
+
+    return _router_instance
@@ -0,0 +1,184 @@
+"""
+Retrieval gating for the therapeutic chatbot.
+Skips knowledge and memory search for turns that need no grounding, drops chunks below a minimum
+similarity, and shrinks k where the scores of the remaining chunks drop off sharply.
+"""
+
+import os
+import re
+import json
+import logging
+from typing import List, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Gating configuration
+RETRIEVAL_GATING_ENABLED = os.getenv("RETRIEVAL_GATING_ENABLED", "true").lower() == "true"
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "5"))  # Candidates fetched per search
+RETRIEVAL_MIN_K = int(os.getenv("RETRIEVAL_MIN_K", "1"))  # Kept above the floor even after a drop-off
+# Unset uses the floor of the active space's model, since models spread cosine similarity differently
+RETRIEVAL_MIN_SIMILARITY = os.getenv("RETRIEVAL_MIN_SIMILARITY")
+# A fall between neighbours larger than this share of the top score's margin over the floor ends the list
+RETRIEVAL_DROP_OFF = float(os.getenv("RETRIEVAL_DROP_OFF", "0.4"))
+
+# Similarity floors per model; ada-002 scores even unrelated text around 0.7
+MODEL_MIN_SIMILARITY = {"text-embedding-ada-002": 0.75}
+DEFAULT_MIN_SIMILARITY = 0.3
+
+# Acknowledgements and small talk that carry nothing to ground
+PHATIC_WORDS = {
+    "yeah", "yea", "yep", "yes", "ya", "yup", "no", "nope", "nah", "ok", "okay", "k", "kk", "sure",
+    "fine", "right", "true", "cool", "nice", "great", "good", "alright", "thanks", "thank", "thx", "ty",
+    "you", "u", "so", "much", "i", "guess", "think", "maybe", "perhaps", "hmm", "hm", "mm", "mhm",
+    "uh", "um", "oh", "ah", "lol", "haha", "hah", "wow", "got", "it", "see", "makes", "sense", "agreed",
+    "hi", "hello", "hey", "bye", "goodbye", "night", "morning", "later", "well", "and", "a", "bit", "too"
+}
+WORD = re.compile(r"[a-z']+")
+MAX_PHATIC_WORDS = 6
+
+
+def min_similarity(model: Optional[str] = None) -> float:
+    """Similarity floor from RETRIEVAL_MIN_SIMILARITY, or the model's default."""
+    if RETRIEVAL_MIN_SIMILARITY:
+        return float(RETRIEVAL_MIN_SIMILARITY)
+    return MODEL_MIN_SIMILARITY.get(model, DEFAULT_MIN_SIMILARITY)
+
+
+class RetrievalGate:
+    """Decides whether a turn searches and how many scored chunks reach the prompt."""
+
+    def __init__(self, enabled: bool = RETRIEVAL_GATING_ENABLED, min_k: int = RETRIEVAL_MIN_K,
+                 drop_off: float = RETRIEVAL_DROP_OFF):
+        """Initialize with the gating settings and empty counters."""
+        self.enabled = enabled
+        self.min_k = min_k
+        self.drop_off = drop_off
+        self._stats = dict.fromkeys(
+            ["turns", "skipped", "searches", "candidates", "kept", "below_floor", "after_drop_off"], 0
+        )
+
+    def needs_retrieval(self, message: str) -> Tuple[bool, str]:
+        """
+        Cheap pre-check run before any search.
+
+        Returns:
+            (whether to search, reason)
+        """
+        self._stats["turns"] += 1
+        if not self.enabled:
+            return True, "gating_disabled"
+
+        words = WORD.findall(message.lower())
+        if not words:
+            reason = "no_words"
+        elif len(words) <= MAX_PHATIC_WORDS and all(word.strip("'") in PHATIC_WORDS for word in words):
+            reason = "acknowledgement"
+        else:
+            return True, "content"
+
+        self._stats["skipped"] += 1
+        logger.info(f"Retrieval skipped: reason={reason} message_chars={len(message)}")
+        return False, reason
+
+    def select(self, scored: List[Dict], model: Optional[str] = None) -> List[Dict]:
+        """Keep chunks above the similarity floor, cut where scores drop off sharply."""
+        self._stats["searches"] += 1
+        self._stats["candidates"] += len(scored)
+        if not self.enabled or not scored:
+            self._stats["kept"] += len(scored)
+            return scored
+
+        floor = min_similarity(model)
+        scored = sorted(scored, key=lambda result: -result["similarity"])
+        above = [result for result in scored if result["similarity"] >= floor]
+        self._stats["below_floor"] += len(scored) - len(above)
+
+        kept = above[:1]
+        if above:
+            # Scale the drop-off to how far the best chunk clears the floor
+            margin = max(above[0]["similarity"] - floor, 1e-6)
+            for previous, result in zip(above, above[1:]):
+                if len(kept) >= self.min_k and previous["similarity"] - result["similarity"] > self.drop_off * margin:
+                    self._stats["after_drop_off"] += len(above) - len(kept)
+                    break
+                kept.append(result)
+
+        self._stats["kept"] += len(kept)
+        logger.info(
+            f"Retrieval gating: kept={len(kept)}/{len(scored)} floor={floor} "
+            f"top={scored[0]['similarity']:.3f}"
+        )
+        return kept
+
+    def stats(self) -> Dict:
+        """Skip rate and average chunks kept per search."""
+        searches = self._stats["searches"]
+        return {
+            "enabled": self.enabled,
+            **self._stats,
+            "skip_rate": round(self._stats["skipped"] / self._stats["turns"], 4) if self._stats["turns"] else 0.0,
+            "average_k": round(self._stats["kept"] / searches, 2) if searches else None
+        }
+
+
+# Singleton instance
+_gate_instance: Optional[RetrievalGate] = None
+
+
+def get_retrieval_gate() -> RetrievalGate:
+    """Get or create the retrieval gate singleton."""
+    global _gate_instance
+    if _gate_instance is None:
+        _gate_instance = RetrievalGate()
+    return _gate_instance
+
+
+def evaluate(samples: int = 200, k: int = RETRIEVAL_MAX_K) -> Dict:
+    """
+    Replay recent user messages through the gate with their stored embeddings.
+
+    Reports how many turns would skip the search and how many chunks and
+    characters gating keeps out of the prompt.
+    """
+    from sqlalchemy import select
+    from database import engine, Message, vector_binary, knowledge_search_query
+    from embedding_spaces import get_space_registry, LEGACY_SPACE
+
+    model = get_space_registry().get(LEGACY_SPACE).model  # Model of the columns replayed here
+    gate = RetrievalGate(enabled=True)
+    chars = {"ungated": 0, "gated": 0}
+    with engine.connect() as connection:
+        messages = connection.execute(
+            select(Message.content, vector_binary(Message.embedding).label("embedding"))
+            .where(Message.role == "user", Message.embedding.isnot(None))
+            .order_by(Message.timestamp.desc()).limit(samples)
+        ).all()
+        for message in messages:
+            results = [
+                {"content": row.content, "similarity": 1.0 - float(row.distance)}
+                for row in connection.execute(knowledge_search_query(message.embedding.tolist(), k))
+            ]
+            chars["ungated"] += sum(len(result["content"]) for result in results)
+            if gate.needs_retrieval(message.content)[0]:
+                chars["gated"] += sum(len(result["content"]) for result in gate.select(results, model))
+
+    return {
+        "messages": len(messages),
+        "k": k,
+        "min_similarity": min_similarity(model),
+        **gate.stats(),
+        "context_chars_ungated": chars["ungated"],
+        "context_chars_gated": chars["gated"]
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # python retrieval_gate.py [SAMPLES]
+    print(json.dumps(evaluate(int(sys.argv[1]) if len(sys.argv) > 1 else 200), indent=2))
@@ -0,0 +1,266 @@
+"""
+Batch sentiment scoring for stored messages.
+A background job scores new user messages with a lexicon scorer vectorized in NumPy,
+writing Message.sentiment_score back in bulk behind a (timestamp, id) watermark.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+import numpy as np
+from sqlalchemy import text
+from database import SessionLocal, get_watermark
+
+logger = logging.getLogger(__name__)
+
+# Sentiment configuration
+SENTIMENT_ENABLED = os.getenv("SENTIMENT_ENABLED", "true").lower() == "true"
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "5000"))
+SENTIMENT_INTERVAL_SECONDS = int(os.getenv("SENTIMENT_INTERVAL_SECONDS", "300"))
+# Rows younger than this are left for the next cycle, so buffered writes
+# committed with an earlier timestamp are not skipped by the watermark
+SENTIMENT_SETTLE_SECONDS = int(os.getenv("SENTIMENT_SETTLE_SECONDS", "120"))
+SENTIMENT_LEXICON_PATH = os.getenv("SENTIMENT_LEXICON_PATH")  # Optional VADER-format lexicon file
+
+SENTIMENT_JOB = "sentiment"
+
+# Valences on VADER's -4..4 scale for words common in wellness conversations
+LEXICON = {
+    "good": 1.9, "great": 3.1, "better": 1.9, "best": 3.2, "happy": 2.7, "happier": 2.4,
+    "glad": 2.0, "calm": 1.3, "relaxed": 2.2, "peaceful": 2.2, "proud": 2.1, "hopeful": 2.3,
+    "hope": 1.9, "grateful": 2.3, "thankful": 2.3, "thanks": 1.9, "thank": 1.5, "love": 3.2,
+    "like": 1.5, "enjoy": 2.2, "enjoyed": 2.3, "fun": 2.3, "excited": 2.2, "confident": 2.2,
+    "motivated": 1.9, "productive": 1.6, "focused": 1.4, "rested": 1.5, "improving": 1.6,
+    "improved": 2.1, "progress": 1.8, "helpful": 1.8, "helped": 1.7, "helps": 1.6, "okay": 0.9,
+    "ok": 0.9, "fine": 0.8, "nice": 1.8, "awesome": 3.1, "amazing": 2.8, "wonderful": 2.7,
+    "success": 2.7, "succeeded": 2.2, "safe": 1.9, "supported": 1.9, "balanced": 1.2,
+    "sad": -2.1, "unhappy": -1.8, "depressed": -2.3, "depressing": -2.1, "anxious": -1.0,
+    "anxiety": -0.7, "worried": -1.2, "worry": -1.9, "stressed": -1.4, "stress": -1.8,
+    "stressful": -2.0, "overwhelmed": -1.5, "overwhelming": -1.3, "tired": -1.9,
+    "exhausted": -1.5, "lonely": -1.5, "alone": -1.0, "isolated": -1.3, "bored": -1.1,
+    "angry": -2.3, "mad": -2.2, "frustrated": -1.5, "frustrating": -1.9, "annoyed": -1.6,
+    "upset": -1.6, "scared": -1.9, "afraid": -2.0, "fear": -2.2, "panic": -2.3, "guilty": -1.8,
+    "guilt": -1.1, "ashamed": -2.1, "shame": -2.1, "hate": -2.7, "hated": -3.2, "awful": -2.0,
+    "terrible": -2.1, "horrible": -2.5, "bad": -2.5, "worse": -2.1, "worst": -3.1,
+    "hopeless": -2.0, "helpless": -2.0, "worthless": -1.9, "useless": -1.8, "pain": -2.3,
+    "hurt": -2.4, "hurting": -2.1, "cry": -2.1, "crying": -2.1, "cried": -1.6, "miserable": -2.2,
+    "addicted": -1.6, "addiction": -1.9, "addictive": -1.5, "distracted": -1.4,
+    "procrastinating": -1.1, "insomnia": -1.8, "sleepless": -1.6, "struggle": -1.4,
+    "struggling": -1.8, "fail": -2.5, "failed": -2.3, "failure": -2.3, "die": -2.9,
+    "dead": -3.3, "suicide": -3.5, "suicidal": -3.6, "kill": -3.7, "empty": -0.8,
+    "numb": -1.4, "broken": -2.0, "lost": -1.3, "stuck": -1.0, "problem": -1.7,
+    "problems": -1.7, "difficult": -1.5, "hard": -0.4,
+}
+
+# Negations carry no valence of their own, so none of them may appear in LEXICON
+NEGATIONS = {
+    "not", "no", "never", "dont", "don't", "doesnt", "doesn't", "didnt", "didn't", "isnt", "isn't",
+    "wasnt", "wasn't", "cant", "can't", "cannot", "wont", "won't", "nothing", "nobody", "without",
+    "aint", "ain't", "neither", "nor", "hardly",
+}
+
+# Multipliers applied to the valence of the following word
+MODIFIERS = {
+    "very": 1.3, "really": 1.3, "so": 1.3, "extremely": 1.4, "incredibly": 1.4, "super": 1.3,
+    "totally": 1.3, "completely": 1.3, "absolutely": 1.3, "too": 1.2, "quite": 1.1,
+    "slightly": 0.7, "somewhat": 0.8, "kinda": 0.7, "kind": 0.8, "sort": 0.8, "bit": 0.7,
+    "little": 0.8, "barely": 0.6,
+}
+
+NEGATION_SCALAR = -0.74  # VADER's factor for a negated word
+NEGATION_WINDOW = 3  # Words after a negation that it flips
+EXCLAMATION_BOOST = 0.292  # Per '!', up to four
+NORMALIZATION_ALPHA = 15.0  # Same squashing constant as VADER's compound score
+
+TOKEN_PATTERN = re.compile(r"[a-z']+")
+
+
+def load_lexicon(path: str) -> Dict[str, float]:
+    """Read a word<TAB>valence[<TAB>...] lexicon file such as vader_lexicon.txt."""
+    lexicon = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 2:
+                try:
+                    lexicon[fields[0].lower()] = float(fields[1])
+                except ValueError:
+                    continue
+    return lexicon
+
+
+class LexiconSentimentScorer:
+    """Scores texts in [-1, 1] in one vectorized pass over all of a batch's tokens."""
+
+    def __init__(self, lexicon: Optional[Dict[str, float]] = None):
+        """Initialize with a word -> valence mapping, defaulting to the built-in lexicon."""
+        self.lexicon = lexicon if lexicon is not None else LEXICON
+
+    def score(self, texts: List[str]) -> np.ndarray:
+        """Return one compound score per text; texts without lexicon words score 0."""
+        tokens = []
+        message_index = []
+        exclamations = np.zeros(len(texts), dtype=np.float64)
+        for i, content in enumerate(texts):
+            words = TOKEN_PATTERN.findall(content.lower())
+            tokens.extend(words)
+            message_index.extend([i] * len(words))
+            exclamations[i] = min(content.count("!"), 4)
+
+        if not tokens:
+            return np.zeros(len(texts), dtype=np.float64)
+
+        message_index = np.asarray(message_index)
+        valence = np.fromiter((self.lexicon.get(token, 0.0) for token in tokens), dtype=np.float64, count=len(tokens))
+        negation = np.fromiter((token in NEGATIONS for token in tokens), dtype=bool, count=len(tokens))
+        modifier = np.fromiter((MODIFIERS.get(token, 1.0) for token in tokens), dtype=np.float64, count=len(tokens))
+
+        # A word is scaled by the word before it and flipped by a negation shortly before it,
+        # counting only words from the same message
+        scale = np.ones(len(tokens))
+        same_message = message_index[1:] == message_index[:-1]
+        scale[1:] = np.where(same_message, modifier[:-1], 1.0)
+        negated = np.zeros(len(tokens), dtype=bool)
+        for distance in range(1, NEGATION_WINDOW + 1):
+            same_message = message_index[distance:] == message_index[:-distance]
+            negated[distance:] |= negation[:-distance] & same_message
+        valence = valence * scale * np.where(negated, NEGATION_SCALAR, 1.0)
+
+        totals = np.bincount(message_index, weights=valence, minlength=len(texts))
+        totals += np.sign(totals) * exclamations * EXCLAMATION_BOOST
+        return totals / np.sqrt(totals * totals + NORMALIZATION_ALPHA)
+
+
+class SentimentJob:
+    """Scores unscored user messages past the watermark in large batches."""
+
+    # Keyset page of unscored user messages after the watermark; the timestamp bound
+    # lets the planner range-scan the timestamp index and prune old partitions
+    FETCH_QUERY = text("""
+        SELECT id, timestamp, content FROM messages
+        WHERE timestamp >= :after_timestamp
+          AND (timestamp, id) > (:after_timestamp, :after_id)
+          AND timestamp < :settled_before
+          AND role = 'user' AND sentiment_score IS NULL
+        ORDER BY timestamp, id
+        LIMIT :limit
+    """)
+
+    # One statement per batch; matching on the full key keeps each row to its partition
+    UPDATE_QUERY = text("""
+        UPDATE messages SET sentiment_score = scored.score
+        FROM unnest(CAST(:ids AS uuid[]), CAST(:timestamps AS timestamp[]), CAST(:scores AS float8[]))
+            AS scored(id, timestamp, score)
+        WHERE messages.id = scored.id AND messages.timestamp = scored.timestamp
+    """)
+
+    def __init__(self, scorer: LexiconSentimentScorer, batch_size: int = SENTIMENT_BATCH_SIZE,
+                 settle_seconds: int = SENTIMENT_SETTLE_SECONDS):
+        """Initialize with a scorer and batching settings."""
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self._last_cycle: Dict = {}
+
+    def run_once(self, db) -> int:
+        """Score one batch and advance the watermark in the same transaction. Returns rows scored."""
+        watermark = get_watermark(db, SENTIMENT_JOB)
+        rows = db.execute(self.FETCH_QUERY, {
+            "after_timestamp": watermark.last_timestamp or datetime.min,
+            "after_id": str(watermark.last_id or "00000000-0000-0000-0000-000000000000"),
+            "settled_before": datetime.utcnow() - timedelta(seconds=self.settle_seconds),
+            "limit": self.batch_size
+        }).all()
+        if not rows:
+            db.rollback()
+            return 0
+
+        scores = self.scorer.score([row.content for row in rows])
+        db.execute(self.UPDATE_QUERY, {
+            "ids": [str(row.id) for row in rows],
+            "timestamps": [row.timestamp for row in rows],
+            "scores": scores.tolist()
+        })
+        watermark.last_timestamp = rows[-1].timestamp
+        watermark.last_id = rows[-1].id
+        watermark.processed = (watermark.processed or 0) + len(rows)
+        db.commit()
+        return len(rows)
+
+    def run_cycle(self) -> int:
+        """Drain scoreable messages in batches using a dedicated session."""
+        db = SessionLocal()
+        total = 0
+        started = time.monotonic()
+
+        try:
+            while True:
+                scored = self.run_once(db)
+                total += scored
+                if scored < self.batch_size:
+                    break
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error in sentiment cycle: {e}")
+        finally:
+            db.close()
+
+        elapsed = time.monotonic() - started
+        self._last_cycle = {
+            "scored": total,
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+            "finished_at": datetime.utcnow().isoformat()
+        }
+        if total:
+            logger.info(
+                f"Scored sentiment for {total} messages in {elapsed:.1f}s "
+                f"({self._last_cycle['messages_per_second']} messages/s)"
+            )
+        return total
+
+    def stats(self) -> Dict:
+        """Return throughput of the last cycle."""
+        return dict(self._last_cycle)
+
+
+# Singleton instance
+_sentiment_instance: Optional[SentimentJob] = None
+
+
+def get_sentiment_job() -> SentimentJob:
+    """Get or create sentiment job singleton instance."""
+    global _sentiment_instance
+
+    if _sentiment_instance is None:
+        lexicon = dict(LEXICON)
+        if SENTIMENT_LEXICON_PATH:
+            lexicon.update(load_lexicon(SENTIMENT_LEXICON_PATH))
+        _sentiment_instance = SentimentJob(LexiconSentimentScorer(lexicon))
+
+    return _sentiment_instance
+
+
+async def run_sentiment_loop(interval: int = SENTIMENT_INTERVAL_SECONDS):
+    """Periodically run sentiment cycles in a worker thread until cancelled."""
+    logger.info(f"Sentiment scoring started (every {interval}s)")
+
+    while True:
+        await asyncio.to_thread(get_sentiment_job().run_cycle)
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Run a single scoring cycle and report throughput
+    job = get_sentiment_job()
+    job.run_cycle()
+    print(job.stats())
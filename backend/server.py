@@ -3,22 +3,39 @@ FastAPI server for WhatsApp Therapeutic Chatbot.
 Handles Twilio WhatsApp webhook integration and chatbot responses.
 """
 
-from fastapi import FastAPI, APIRouter, Request, HTTPException, Depends
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI, APIRouter, Request, HTTPException, Depends, Header
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.request_validator import RequestValidator
-from sqlalchemy.orm import Session
 from pathlib import Path
 import os
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
 # Import local modules
-from database import init_db, get_db
+from async_database import async_replica_engines, run_replica_lag_monitor
+from storage import get_storage, get_storage_session
 from chatbot import get_chatbot
 from rag_system import initialize_knowledge_base
+from model_router import get_model_router
+from summarizer import run_summarizer_loop
+from sentiment import run_sentiment_loop, get_sentiment_job, SENTIMENT_ENABLED
+from embedding_backfill import run_embedding_backfill_loop, EMBEDDING_BACKFILL_ENABLED
+from embedding_spaces import get_space_registry
+from embedding_scheduler import scheduler_stats
+from retrieval_gate import get_retrieval_gate
+from knowledge_versions import get_knowledge_versions
+from partitions import run_partition_maintenance_loop
+from rate_limiter import get_rate_limiter, USAGE_API_TOKEN
+from user_cache import get_user_cache
+from history_buffer import get_history_buffer
+from user_memory import get_memory_index
+from read_replicas import get_replica_router
+from write_behind import get_write_behind, WRITE_BEHIND_ENABLED
+from export import iter_export, EXPORT_API_TOKEN, EXPORT_FORMATS
 
 # Configure logging
 logging.basicConfig(
@@ -50,17 +67,51 @@ async def lifespan(app: FastAPI):
     """Handle startup and shutdown events."""
     # Startup
     logger.info("Starting WhatsApp Therapeutic Chatbot...")
+    background_tasks = []
+    storage = get_storage()
     
     try:
         # Initialize database
-        logger.info("Initializing database...")
-        init_db()
+        logger.info(f"Initializing {storage.name} storage...")
+        storage.init()
+        
+        # Partitions, replicas, write-behind and summaries are PostgreSQL features
+        use_postgres = storage.name == "postgres"
+        
+        # Keep future message partitions created and archive expired ones
+        if use_postgres:
+            background_tasks.append(asyncio.create_task(run_partition_maintenance_loop()))
+        
+        # Pick up embedding space and knowledge version switches without querying on the request path
+        if use_postgres:
+            background_tasks.append(asyncio.create_task(get_space_registry().run_refresh_loop()))
+            background_tasks.append(asyncio.create_task(get_knowledge_versions().run_refresh_loop()))
+        
+        # Replicas only serve reads while their lag is being measured
+        if use_postgres and async_replica_engines:
+            background_tasks.append(asyncio.create_task(run_replica_lag_monitor()))
+        
+        # Score message sentiment in batches, off the request path
+        if use_postgres and SENTIMENT_ENABLED:
+            background_tasks.append(asyncio.create_task(run_sentiment_loop()))
+        
+        # Replay any spilled messages and start batched message persistence
+        if use_postgres and WRITE_BEHIND_ENABLED:
+            get_write_behind().start()
         
         # Initialize knowledge base
         logger.info("Initializing knowledge base...")
         openai_key = os.getenv("OPENAI_API_KEY")
         if openai_key and openai_key != "your_openai_api_key_here":
             initialize_knowledge_base()
+            
+            # Start rolling conversation summaries in the background
+            if use_postgres:
+                background_tasks.append(asyncio.create_task(run_summarizer_loop()))
+            
+            # Embed messages missing a vector from the current model within spare API budget
+            if use_postgres and EMBEDDING_BACKFILL_ENABLED:
+                background_tasks.append(asyncio.create_task(run_embedding_backfill_loop()))
         else:
             logger.warning("OpenAI API key not configured. Knowledge base not initialized.")
         
@@ -72,6 +123,11 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down chatbot...")
+    for task in background_tasks:
+        task.cancel()
+    if get_write_behind().running:
+        await asyncio.to_thread(get_write_behind().stop)
+    await storage.close()
 
 
 # Create FastAPI app
@@ -116,29 +172,40 @@ async def root():
         "endpoints": {
             "health": "/api/health",
             "whatsapp_webhook": "/api/whatsapp (POST)",
-            "status": "/api/status"
+            "status": "/api/status",
+            "usage": "/api/usage",
+            "export": "/api/export/{conversations|messages}"
         }
     }
 
 
 @api_router.get("/status")
-async def status(db: Session = Depends(get_db)):
+async def status():
     """Get service status and statistics."""
     try:
-        from database import User, Message, KnowledgeDocument
-        
-        total_users = db.query(User).count()
-        total_messages = db.query(Message).count()
-        knowledge_docs = db.query(KnowledgeDocument).count()
+        # Counter or estimate based row counts, cached for a few seconds
+        statistics = await asyncio.to_thread(get_storage().statistics)
+        embedding_spaces = await asyncio.to_thread(get_space_registry().stats)
+        knowledge_versions = await asyncio.to_thread(get_knowledge_versions().stats)
         
         return {
             "status": "operational",
             "database": "connected",
-            "statistics": {
-                "total_users": total_users,
-                "total_messages": total_messages,
-                "knowledge_base_documents": knowledge_docs
+            "storage_backend": get_storage().name,
+            "statistics": statistics,
+            "model_routing": get_model_router().latency_summary(),
+            "retrieval_gating": get_retrieval_gate().stats(),
+            "caches": {
+                "user_lookup": get_user_cache().stats(),
+                "conversation_history": get_history_buffer().stats(),
+                "user_memory": get_memory_index().stats()
             },
+            "write_behind": get_write_behind().stats(),
+            "read_replicas": get_replica_router().stats(),
+            "sentiment": get_sentiment_job().stats(),
+            "embedding_spaces": embedding_spaces,
+            "embedding_scheduler": scheduler_stats(),
+            "knowledge_versions": knowledge_versions,
             "configuration": {
                 "twilio_configured": bool(TWILIO_ACCOUNT_SID and TWILIO_ACCOUNT_SID != "your_twilio_account_sid_here"),
                 "openai_configured": bool(os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY") != "your_openai_api_key_here")
@@ -152,8 +219,52 @@ async def status(db: Session = Depends(get_db)):
         }
 
 
+def require_api_token(authorization: str, token: str, setting: str, purpose: str):
+    """Reject requests without the bearer token configured in `setting`."""
+    if not token or authorization != f"Bearer {token}":
+        raise HTTPException(status_code=403, detail=f"{purpose} require {setting}")
+
+
+@api_router.get("/usage")
+async def usage(limit: int = 20, authorization: str = Header(default="")):
+    """Get global LLM usage, rate limits and the heaviest users."""
+    # Users are keyed by WhatsApp number
+    require_api_token(authorization, USAGE_API_TOKEN, "USAGE_API_TOKEN", "Usage reports")
+    return get_rate_limiter().usage_report(limit=limit)
+
+
+@api_router.get("/usage/{whatsapp_number}")
+async def user_usage(whatsapp_number: str, authorization: str = Header(default="")):
+    """Get LLM request and token usage for one user."""
+    require_api_token(authorization, USAGE_API_TOKEN, "USAGE_API_TOKEN", "Usage reports")
+    return get_rate_limiter().usage_report(whatsapp_number=whatsapp_number)
+
+
+@api_router.get("/export/{table}")
+async def export(table: str, format: str = "jsonl", include_embeddings: bool = False,
+                 authorization: str = Header(default="")):
+    """Stream a gzipped JSONL or Parquet export of conversations or messages."""
+    require_api_token(authorization, EXPORT_API_TOKEN, "EXPORT_API_TOKEN", "Exports")
+    if get_storage().name != "postgres":
+        raise HTTPException(status_code=501, detail="Exports are only available with PostgreSQL storage")
+    try:
+        chunks = iter_export(table, format, include_embeddings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet exports require pyarrow")
+    
+    # A sync iterator, so Starlette pulls each batch from the cursor in a worker thread
+    filename = f"{table}{EXPORT_FORMATS[format]}"
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if format == "jsonl" else "application/vnd.apache.parquet",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @api_router.post("/whatsapp")
-async def whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
+async def whatsapp_webhook(request: Request, db = Depends(get_storage_session)):
     """
     Twilio WhatsApp webhook endpoint.
     Receives messages from WhatsApp and sends therapeutic responses.
@@ -195,7 +306,7 @@ async def whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
             return PlainTextResponse(str(response), media_type="application/xml")
         
         # Generate therapeutic response
-        result = chatbot.generate_response(db, from_number, message_body)
+        result = await chatbot.generate_response(db, from_number, message_body)
         bot_response = result["response"]
         
         # Format for WhatsApp
@@ -225,7 +336,7 @@ async def whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
 async def test_message(
     message: str,
     whatsapp_number: str = "whatsapp:+1234567890",
-    db: Session = Depends(get_db)
+    db = Depends(get_storage_session)
 ):
     """
     Test endpoint for generating responses without Twilio.
@@ -233,7 +344,7 @@ async def test_message(
     """
     try:
         chatbot = get_chatbot()
-        result = chatbot.generate_response(db, whatsapp_number, message)
+        result = await chatbot.generate_response(db, whatsapp_number, message)
         
         return {
             "success": True,
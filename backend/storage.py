@@ -0,0 +1,192 @@
+"""
+Storage backend abstraction for the chatbot's request path and knowledge base.
+PostgreSQL with pgvector is the default; an embedded SQLite + NumPy backend serves single-node deployments.
+"""
+
+import os
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Dict, Optional
+from user_cache import TurnContext
+
+logger = logging.getLogger(__name__)
+
+# Storage configuration
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")  # 'postgres' or 'embedded'
+
+
+class StorageBackend(ABC):
+    """
+    Data access used by the chatbot and knowledge base.
+
+    Request-path methods are async and take the handle yielded by session(); knowledge base
+    maintenance methods are sync. Embeddings go in as float lists and come back as NumPy arrays.
+    This module imports no database driver; each backend loads its own on first use.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def init(self):
+        """Create or migrate the schema."""
+
+    @abstractmethod
+    def session(self):
+        """Async context manager yielding a per-request handle."""
+
+    @abstractmethod
+    async def begin_turn(self, db, whatsapp_number: str) -> TurnContext:
+        """Upsert the user and resolve the active conversation."""
+
+    @abstractmethod
+    async def finish_turn(self, db, conversation_id, user_id, messages: List[Dict],
+                          crisis: bool = False) -> List:
+        """Store a turn's messages and update counters. Returns the new message ids."""
+
+    @abstractmethod
+    async def get_conversation_history(self, db, conversation_id, limit: int = 10) -> List:
+        """Return the last `limit` messages (role, content) in chronological order."""
+
+    @abstractmethod
+    async def search_knowledge(self, db, embedding, k: int = 5) -> List:
+        """Return the k nearest knowledge chunks as (content, distance) rows."""
+
+    @abstractmethod
+    async def search_similar_messages(self, db, user_id, embedding, limit: int = 5, window_conversation_id=None,
+                                      window_start=None, role: str = "user") -> List:
+        """Return one user's nearest past messages outside the prompt window, with their cosine distance."""
+
+    @abstractmethod
+    async def load_user_memories(self, db, user_id, limit: int = 2000, role: str = "user") -> List:
+        """Return a user's newest embedded messages as (id, conversation_id, content, timestamp, embedding) rows."""
+
+    @abstractmethod
+    def count_knowledge_documents(self) -> int:
+        """Number of indexed knowledge chunks."""
+
+    @abstractmethod
+    def add_knowledge_documents(self, documents: List[Dict]):
+        """Store knowledge chunks with source_file, chunk_index, content, embedding and doc_metadata."""
+
+    @abstractmethod
+    def statistics(self) -> Dict:
+        """Row counts for the status endpoint."""
+
+    async def close(self):
+        """Release connections and files."""
+
+
+class PostgresStorage(StorageBackend):
+    """
+    PostgreSQL + pgvector backend over database.py and async_database.py.
+
+    Those modules create their engines when imported, so each method imports them on first
+    use; the embedded backend and its tests never load the PostgreSQL driver.
+    """
+
+    name = "postgres"
+
+    def init(self):
+        """Create tables, schema updates, partitions and row counters."""
+        from database import init_db
+        init_db()
+
+    def session(self):
+        """Open an async SQLAlchemy session."""
+        from async_database import AsyncSessionLocal
+        return AsyncSessionLocal()
+
+    async def begin_turn(self, db, whatsapp_number: str):
+        from async_database import begin_turn_async
+        return await begin_turn_async(db, whatsapp_number)
+
+    async def finish_turn(self, db, conversation_id, user_id, messages: List[Dict],
+                          crisis: bool = False) -> List:
+        from async_database import finish_turn_async
+        return await finish_turn_async(db, conversation_id, user_id, messages, crisis=crisis)
+
+    async def get_conversation_history(self, db, conversation_id, limit: int = 10) -> List:
+        from async_database import get_conversation_history_async
+        return await get_conversation_history_async(db, conversation_id, limit=limit)
+
+    async def search_knowledge(self, db, embedding, k: int = 5) -> List:
+        from database import knowledge_search_query
+        from async_database import run_read_async
+        query = knowledge_search_query(embedding, k)
+        return await run_read_async(db, lambda session: session.execute(query))
+
+    async def search_similar_messages(self, db, user_id, embedding, limit: int = 5, window_conversation_id=None,
+                                      window_start=None, role: str = "user") -> List:
+        from async_database import search_similar_messages_async
+        return await search_similar_messages_async(
+            db, user_id, embedding, limit=limit, window_conversation_id=window_conversation_id,
+            window_start=window_start, role=role
+        )
+
+    async def load_user_memories(self, db, user_id, limit: int = 2000, role: str = "user") -> List:
+        from async_database import load_user_memories_async
+        return await load_user_memories_async(db, user_id, limit=limit, role=role)
+
+    def count_knowledge_documents(self) -> int:
+        from database import SessionLocal, KnowledgeDocument, knowledge_version_filter
+        db = SessionLocal()
+        try:
+            return db.query(KnowledgeDocument).filter(knowledge_version_filter()).count()
+        finally:
+            db.close()
+
+    def add_knowledge_documents(self, documents: List[Dict]):
+        from database import SessionLocal, KnowledgeDocument
+        from embedding_spaces import knowledge_vector_inserts
+        db = SessionLocal()
+        try:
+            space_embeddings = [document.get("space_embeddings") or {} for document in documents]
+            records = [
+                KnowledgeDocument(**{key: value for key, value in document.items() if key != "space_embeddings"})
+                for document in documents
+            ]
+            db.add_all(records)
+            db.flush()
+            # Vectors for other embedding spaces commit with their chunks
+            for statement in knowledge_vector_inserts(
+                [(record.id, record.version, embeddings) for record, embeddings in zip(records, space_embeddings)]
+            ):
+                db.execute(statement)
+            db.commit()
+        finally:
+            db.close()
+
+    def statistics(self) -> Dict:
+        from table_stats import get_table_statistics
+        return get_table_statistics().get()
+
+    async def close(self):
+        from async_database import async_engine, async_replica_engines
+        await async_engine.dispose()
+        for replica_engine in async_replica_engines:
+            await replica_engine.dispose()
+
+
+# Singleton instance
+_storage_instance: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """Get or create the configured storage backend singleton instance."""
+    global _storage_instance
+
+    if _storage_instance is None:
+        if STORAGE_BACKEND == "embedded":
+            from embedded_storage import EmbeddedStorage  # Subclasses StorageBackend, so imported late
+            _storage_instance = EmbeddedStorage()
+        else:
+            _storage_instance = PostgresStorage()
+        logger.info(f"Using {_storage_instance.name} storage backend")
+
+    return _storage_instance
+
+
+async def get_storage_session():
+    """Dependency for getting a request handle from the configured storage backend."""
+    async with get_storage().session() as db:
+        yield db
@@ -0,0 +1,269 @@
+"""
+Rolling conversation summaries for the therapeutic chatbot.
+A background job folds older messages into Conversation.summary, off the request path.
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+from openai import OpenAI
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session
+from database import User, Conversation, Message, SessionLocal
+from user_cache import get_user_cache
+from model_router import SMALL_MODEL
+from rag_system import RECENT_HISTORY_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Summarizer configuration
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", SMALL_MODEL)
+SUMMARY_EVERY_N_MESSAGES = int(os.getenv("SUMMARY_EVERY_N_MESSAGES", "10"))
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "20"))
+SUMMARY_INTERVAL_SECONDS = int(os.getenv("SUMMARY_INTERVAL_SECONDS", "60"))
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+# Transcript tokens folded into a summary per step; longer backlogs take several steps
+SUMMARY_MAX_INPUT_TOKENS = int(os.getenv("SUMMARY_MAX_INPUT_TOKENS", "4000"))
+
+# Messages loaded for the prompt: the recent window plus those waiting for the next summary
+HISTORY_WINDOW_MESSAGES = RECENT_HISTORY_MESSAGES + SUMMARY_EVERY_N_MESSAGES
+
+
+def unsummarized_history(history: List, summarized_through: Optional[datetime]) -> List:
+    """
+    Messages the summary does not cover, from chronological history entries.
+
+    The summary only folds messages older than the recent window, so this is every
+    message after summarized_through, and never fewer than the recent window.
+    """
+    recent = history[-RECENT_HISTORY_MESSAGES:] if RECENT_HISTORY_MESSAGES else []
+    if summarized_through is None or any(entry.timestamp is None for entry in history):
+        return recent
+    newer = [entry for entry in history if entry.timestamp > summarized_through]
+    return newer if len(newer) > len(recent) else recent
+
+
+def transcript_line(message) -> str:
+    """One message as it appears in a summarization transcript."""
+    return f"{'User' if message.role == 'user' else 'Therapist'}: {message.content}"
+
+
+class ConversationSummarizer:
+    """
+    Incrementally updates rolling summaries for conversations in batches.
+
+    Only messages older than the prompt's recent window are folded in, so the summary and
+    the window never repeat each other. Each step folds in at most max_input_tokens of
+    transcript, oldest first; a longer backlog, such as a long conversation's first
+    summary, is folded in over several steps.
+    """
+
+    SUMMARY_PROMPT = """You maintain a running summary of a supportive digital wellness conversation between a user and a therapist.
+Update the existing summary with the new messages. Keep the user's key concerns, goals, feelings, coping strategies discussed, and any commitments or progress.
+Write in third person, at most 150 words, with no preamble."""
+
+    def __init__(self, openai_api_key: str, model: str = SUMMARY_MODEL,
+                 every_n: int = SUMMARY_EVERY_N_MESSAGES, batch_size: int = SUMMARY_BATCH_SIZE,
+                 max_workers: int = SUMMARY_MAX_WORKERS, recent_window: int = RECENT_HISTORY_MESSAGES,
+                 max_input_tokens: int = SUMMARY_MAX_INPUT_TOKENS):
+        """Initialize summarizer with OpenAI client and batching settings."""
+        self.client = OpenAI(api_key=openai_api_key)
+        self.model = model
+        self.every_n = every_n
+        self.recent_window = recent_window
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_input_tokens = max_input_tokens
+        self._count_tokens = None
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Token count of each text, from tiktoken or its approximation."""
+        if self._count_tokens is None:
+            # text_chunker falls back to an approximation when tiktoken's encoding is unavailable
+            from text_chunker import get_token_counter
+            self._count_tokens = get_token_counter()
+        return self._count_tokens(texts)
+
+    def next_step(self, messages: List) -> List:
+        """
+        Oldest messages whose transcript fits max_input_tokens, the next step of a backlog.
+
+        A single message over the cap still makes up a step on its own, so every step
+        makes progress.
+        """
+        total, taken = 0, 0
+        for tokens in self.count_tokens([transcript_line(message) for message in messages]):
+            if taken and total + tokens > self.max_input_tokens:
+                break
+            total += tokens
+            taken += 1
+        return messages[:taken]
+
+    def find_pending_conversations(self, db: Session) -> List[Conversation]:
+        """Find conversations with at least N messages older than the recent window not yet summarized."""
+        return db.query(Conversation).filter(
+            Conversation.message_count - Conversation.summarized_message_count - self.recent_window >= self.every_n
+        ).order_by(Conversation.last_message_at.desc()).limit(self.batch_size).all()
+
+    def fetch_new_messages(self, db: Session, conversations: List[Conversation]) -> Dict:
+        """Fetch unsummarized messages older than the recent window for a batch, in a single query."""
+        conditions = []
+        for conversation in conversations:
+            if conversation.summarized_through:
+                conditions.append(and_(
+                    Message.conversation_id == conversation.id,
+                    Message.timestamp > conversation.summarized_through
+                ))
+            else:
+                conditions.append(Message.conversation_id == conversation.id)
+
+        rows = db.query(
+            Message.conversation_id, Message.role, Message.content, Message.timestamp
+        ).filter(or_(*conditions)).order_by(Message.timestamp).all()
+
+        messages_by_conversation = {conversation.id: [] for conversation in conversations}
+        for row in rows:
+            messages_by_conversation[row.conversation_id].append(row)
+
+        # The prompt carries the recent window verbatim
+        if self.recent_window:
+            for conversation_id, messages in messages_by_conversation.items():
+                messages_by_conversation[conversation_id] = messages[:-self.recent_window]
+        return messages_by_conversation
+
+    def summarize(self, previous_summary: Optional[str], messages: List) -> str:
+        """Fold new messages into the previous summary."""
+        transcript = "\n".join(transcript_line(message) for message in messages)
+
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self.SUMMARY_PROMPT},
+                {"role": "user", "content": (
+                    f"Existing summary:\n{previous_summary or '(none)'}\n\n"
+                    f"New messages:\n{transcript}"
+                )}
+            ],
+            temperature=0.2,
+            max_tokens=300
+        )
+        return response.choices[0].message.content.strip()
+
+    def run_once(self, db: Session) -> int:
+        """
+        Fold one step of each pending conversation's backlog into its summary. Returns number updated.
+
+        Conversations whose backlog is longer than one step stay pending for the next run.
+        """
+        conversations = self.find_pending_conversations(db)
+        if not conversations:
+            return 0
+
+        messages_by_conversation = {
+            conversation_id: self.next_step(messages)
+            for conversation_id, messages in self.fetch_new_messages(db, conversations).items()
+        }
+        pending = [c for c in conversations if messages_by_conversation[c.id]]
+
+        # LLM calls run concurrently; database writes stay on this thread
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                conversation.id: executor.submit(
+                    self.summarize, conversation.summary, messages_by_conversation[conversation.id]
+                )
+                for conversation in pending
+            }
+
+        updated_user_ids = []
+        for conversation in pending:
+            try:
+                summary = futures[conversation.id].result()
+            except Exception as e:
+                logger.error(f"Error summarizing conversation {conversation.id}: {e}")
+                continue
+
+            new_messages = messages_by_conversation[conversation.id]
+            conversation.summary = summary
+            conversation.summarized_message_count = (
+                (conversation.summarized_message_count or 0) + len(new_messages)
+            )
+            conversation.summarized_through = new_messages[-1].timestamp
+            updated_user_ids.append(conversation.user_id)
+
+        db.commit()
+        updated = len(updated_user_ids)
+
+        # Cached turn contexts carry the summary, so drop them for updated users
+        if updated_user_ids:
+            cache = get_user_cache()
+            for (number,) in db.query(User.whatsapp_number).filter(User.id.in_(updated_user_ids)):
+                cache.invalidate(number)
+
+        logger.info(f"Updated summaries for {updated}/{len(conversations)} conversations")
+        return updated
+
+
+# Singleton instance
+_summarizer_instance: Optional[ConversationSummarizer] = None
+
+
+def get_summarizer() -> ConversationSummarizer:
+    """Get or create summarizer singleton instance."""
+    global _summarizer_instance
+
+    if _summarizer_instance is None:
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        if not openai_api_key or openai_api_key == "your_openai_api_key_here":
+            raise ValueError("OPENAI_API_KEY environment variable not set")
+
+        _summarizer_instance = ConversationSummarizer(openai_api_key)
+
+    return _summarizer_instance
+
+
+def run_summary_cycle() -> int:
+    """Drain pending conversations, one step of each backlog per batch, using a dedicated session."""
+    summarizer = get_summarizer()
+    db = SessionLocal()
+    total = 0
+
+    try:
+        # Every successful step advances its conversation, so this ends once nothing is pending
+        while True:
+            updated = summarizer.run_once(db)
+            total += updated
+            if not updated:
+                break
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error in summary cycle: {e}")
+    finally:
+        db.close()
+
+    return total
+
+
+async def run_summarizer_loop(interval: int = SUMMARY_INTERVAL_SECONDS):
+    """Periodically run summary cycles in a worker thread until cancelled."""
+    logger.info(f"Conversation summarizer started (every {interval}s)")
+
+    while True:
+        started = datetime.utcnow()
+        total = await asyncio.to_thread(run_summary_cycle)
+        if total:
+            elapsed = (datetime.utcnow() - started).total_seconds()
+            logger.info(f"Summary cycle made {total} summary updates in {elapsed:.1f}s")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Run a single summary cycle
+    print(f"Made {run_summary_cycle()} summary updates")
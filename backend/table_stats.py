@@ -0,0 +1,301 @@
+"""
+Cheap table statistics for the status endpoint.
+Row counts come from trigger-maintained counters or pg_class estimates instead of count(*) scans,
+behind a short-TTL in-process cache.
+"""
+
+import os
+import time
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import text, select, func
+from sqlalchemy.exc import OperationalError
+from database import engine, SessionLocal, KnowledgeDocument, run_read, knowledge_version_filter
+
+logger = logging.getLogger(__name__)
+
+# Statistics configuration
+TABLE_STATS_MODE = os.getenv("TABLE_STATS_MODE", "counters")  # 'counters', 'estimate' or 'exact'
+TABLE_STATS_CACHE_TTL = float(os.getenv("TABLE_STATS_CACHE_TTL", "10"))  # seconds
+
+# Reported statistic name for each counted table
+COUNTED_TABLES = {
+    "users": "total_users",
+    "messages": "total_messages",
+}
+
+# Tables whose counter triggers older installs created; knowledge_documents holds every knowledge
+# version, so its reported count is taken from the active version instead
+RETIRED_COUNTED_TABLES = ["knowledge_documents"]
+
+# Triggers append one delta row per statement rather than updating a single hot row,
+# so concurrent writers never contend on a counter; compact_row_counts folds them together
+ROW_COUNTS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS table_row_counts (
+        table_name TEXT NOT NULL,
+        delta BIGINT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_table_row_counts_table ON table_row_counts (table_name)",
+    # Tables whose counter has been seeded with its existing rows; until then it isn't reported
+    """
+    CREATE TABLE IF NOT EXISTS table_row_count_seeds (
+        table_name TEXT PRIMARY KEY,
+        seeded_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION count_inserted_rows() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO table_row_counts (table_name, delta)
+        SELECT TG_TABLE_NAME, count(*) FROM new_rows HAVING count(*) > 0;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION count_deleted_rows() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO table_row_counts (table_name, delta)
+        SELECT TG_TABLE_NAME, -count(*) FROM old_rows HAVING count(*) > 0;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION reset_row_count() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM table_row_counts WHERE table_name = TG_TABLE_NAME;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+]
+
+
+def create_row_count_triggers(connection, table: str, target: str = None):
+    """Create the counter triggers of table on target, which defaults to table itself."""
+    target = target or table
+    connection.execute(text(
+        f"CREATE TRIGGER {table}_count_insert AFTER INSERT ON {target} "
+        f"REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_inserted_rows()"
+    ))
+    connection.execute(text(
+        f"CREATE TRIGGER {table}_count_delete AFTER DELETE ON {target} "
+        f"REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION count_deleted_rows()"
+    ))
+    connection.execute(text(
+        f"CREATE TRIGGER {table}_count_truncate AFTER TRUNCATE ON {target} "
+        f"FOR EACH STATEMENT EXECUTE FUNCTION reset_row_count()"
+    ))
+
+
+def drop_row_count_triggers(connection, table: str, target: str = None) -> bool:
+    """
+    Drop the counter triggers of table from target, e.g. a table about to become a partition,
+    since partitions can't have triggers with transition tables. Returns whether they existed.
+    """
+    target = target or table
+    existed = connection.execute(text(
+        "SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(:target) AND tgname = :name"
+    ), {"target": target, "name": f"{table}_count_insert"}).scalar()
+    for event in ("insert", "delete", "truncate"):
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {table}_count_{event} ON {target}"))
+    return bool(existed)
+
+
+def seed_row_count(table: str) -> bool:
+    """
+    Add the rows that existed before the triggers to the table's counter, once.
+
+    Runs after the triggers are committed, so the count(*) scan holds no lock that blocks
+    writers. The count and the deltas already recorded are read from one snapshot, so rows
+    written while the scan runs are counted exactly once. Returns whether this call seeded.
+    """
+    connection = engine.connect().execution_options(isolation_level="REPEATABLE READ")
+    try:
+        with connection.begin():
+            # The first statement takes the snapshot; a concurrent seeder makes it fail
+            claimed = connection.execute(text(
+                "INSERT INTO table_row_count_seeds (table_name) VALUES (:table) "
+                "ON CONFLICT DO NOTHING RETURNING table_name"
+            ), {"table": table}).scalar()
+            if not claimed:
+                return False
+
+            existing = connection.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+            recorded = connection.execute(text(
+                "SELECT COALESCE(sum(delta), 0) FROM table_row_counts WHERE table_name = :table"
+            ), {"table": table}).scalar()
+            adjust_row_count(connection, table, existing - int(recorded))
+        return True
+    except OperationalError as e:
+        logger.info(f"Row counter on {table} seeded elsewhere: {e.orig}")
+        return False
+    finally:
+        connection.close()
+
+
+def install_row_counters():
+    """
+    Create counter triggers on each counted table that doesn't have them yet, then seed the
+    counters that haven't been. CREATE TRIGGER briefly blocks writes; the seeding scan doesn't.
+    """
+    with engine.begin() as connection:
+        for statement in ROW_COUNTS_DDL:
+            connection.execute(text(statement))
+        for table in RETIRED_COUNTED_TABLES:
+            if drop_row_count_triggers(connection, table):
+                connection.execute(text("DELETE FROM table_row_counts WHERE table_name = :table"), {"table": table})
+                connection.execute(text("DELETE FROM table_row_count_seeds WHERE table_name = :table"),
+                                   {"table": table})
+
+    for table in COUNTED_TABLES:
+        with engine.begin() as connection:
+            installed = connection.execute(text(
+                "SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(:table) AND tgname = :name"
+            ), {"table": table, "name": f"{table}_count_insert"}).scalar()
+            if not installed:
+                create_row_count_triggers(connection, table)
+                logger.info(f"Installed row counter on {table}")
+
+        with engine.connect() as connection:
+            seeded = connection.execute(text(
+                "SELECT 1 FROM table_row_count_seeds WHERE table_name = :table"
+            ), {"table": table}).scalar()
+        if not seeded and seed_row_count(table):
+            logger.info(f"Seeded row counter on {table}")
+
+
+def adjust_row_count(connection, table: str, delta: int):
+    """Record a row count change the triggers can't see, such as a detached partition."""
+    connection.execute(text(
+        "INSERT INTO table_row_counts (table_name, delta) VALUES (:table, :delta)"
+    ), {"table": table, "delta": delta})
+
+
+def compact_row_counts(connection):
+    """Fold accumulated delta rows into one row per table."""
+    connection.execute(text("""
+        WITH folded AS (
+            DELETE FROM table_row_counts RETURNING table_name, delta
+        )
+        INSERT INTO table_row_counts (table_name, delta)
+        SELECT table_name, sum(delta) FROM folded GROUP BY table_name
+    """))
+
+
+class TableStatistics:
+    """Row counts for the counted tables, cached for a short TTL."""
+
+    def __init__(self, mode: str = TABLE_STATS_MODE, ttl: float = TABLE_STATS_CACHE_TTL):
+        """Initialize with a counting mode and cache TTL."""
+        self.mode = mode
+        self.ttl = ttl
+        self._cached: Optional[Dict] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Drop the cached statistics, e.g. when another knowledge version becomes active."""
+        with self._lock:
+            self._cached = None
+
+    def get(self) -> Dict:
+        """Return cached statistics, refreshing them once the TTL has passed."""
+        with self._lock:
+            if self._cached is None or time.monotonic() >= self._expires_at:
+                self._cached = self._load()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._cached
+
+    def _load(self) -> Dict:
+        """Read row counts using the configured mode, falling back to estimates."""
+        mode = self.mode
+        db = SessionLocal()
+        try:
+            try:
+                if mode == "counters":
+                    # Compaction writes, so it runs on the primary; the sums can be read anywhere
+                    with engine.begin() as connection:
+                        compact_row_counts(connection)
+                    counts = run_read(db, self._counters)
+                elif mode == "exact":
+                    counts = run_read(db, self._exact)
+                else:
+                    counts = run_read(db, self._estimates)
+            except Exception as e:
+                logger.error(f"Error reading {mode} statistics, using estimates: {e}")
+                db.rollback()
+                mode = "estimate"
+                counts = run_read(db, self._estimates)
+
+            try:
+                knowledge_documents = run_read(db, self._knowledge_documents)
+            except Exception as e:
+                logger.error(f"Error counting knowledge base documents: {e}")
+                db.rollback()
+                knowledge_documents = None
+        finally:
+            db.close()
+
+        return {
+            **{COUNTED_TABLES[table]: count for table, count in counts.items()},
+            "knowledge_base_documents": knowledge_documents,
+            "source": mode,
+            "as_of": datetime.utcnow().isoformat()
+        }
+
+    def _counters(self, session) -> Dict[str, int]:
+        """Sum trigger-maintained deltas of the seeded counters."""
+        rows = session.execute(text("""
+            SELECT s.table_name, COALESCE(sum(c.delta), 0) FROM table_row_count_seeds s
+            LEFT JOIN table_row_counts c ON c.table_name = s.table_name
+            GROUP BY s.table_name
+        """)).all()
+        totals = {row[0]: int(row[1]) for row in rows}
+        missing = [table for table in COUNTED_TABLES if table not in totals]
+        if missing:
+            raise RuntimeError(f"Row counters not seeded for {', '.join(missing)}")
+        return {table: totals[table] for table in COUNTED_TABLES}
+
+    def _knowledge_documents(self, session) -> int:
+        """Chunks of the active knowledge version; a small table, so counted exactly in every mode."""
+        return session.execute(
+            select(func.count()).select_from(KnowledgeDocument).where(knowledge_version_filter())
+        ).scalar()
+
+    def _estimates(self, session) -> Dict[str, int]:
+        """Planner estimates from pg_class, summed over partitions."""
+        counts = {}
+        for table in COUNTED_TABLES:
+            counts[table] = int(session.execute(text("""
+                SELECT COALESCE(sum(GREATEST(reltuples, 0)), 0) FROM pg_class
+                WHERE oid = to_regclass(:table)
+                   OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:table))
+            """), {"table": table}).scalar())
+        return counts
+
+    def _exact(self, session) -> Dict[str, int]:
+        """Exact counts; scans every table."""
+        return {
+            table: session.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+            for table in COUNTED_TABLES
+        }
+
+
+# Singleton instance
+_stats_instance: Optional[TableStatistics] = None
+
+
+def get_table_statistics() -> TableStatistics:
+    """Get or create table statistics singleton instance."""
+    global _stats_instance
+
+    if _stats_instance is None:
+        _stats_instance = TableStatistics()
+        # The knowledge chunk count changes with the active version
+        from knowledge_versions import get_knowledge_versions  # Only needed once statistics are used
+        get_knowledge_versions().on_activate(_stats_instance.invalidate)
+
+    return _stats_instance
@@ -4,8 +4,8 @@ This doesn't require database or OpenAI API - just tests PDF reading.
 """
 
 from pathlib import Path
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pdf_cache import get_pdf_cache
+from text_chunker import TextChunker
 
 def test_pdf_loading():
     """Test that PDFs can be loaded and chunked."""
@@ -18,11 +18,7 @@ def test_pdf_loading():
     print("="*60)
     print(f"\nFound {len(pdf_files)} PDF files:\n")
     
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
+    text_chunker = TextChunker()
     
     total_chunks = 0
     total_chars = 0
@@ -31,18 +27,19 @@ def test_pdf_loading():
         try:
             print(f"📄 Processing: {pdf_file.name}")
             
-            # Load PDF
-            loader = PyPDFLoader(str(pdf_file))
-            documents = loader.load()
+            # Load PDF, from the extraction cache after the first run
+            documents = get_pdf_cache().load(pdf_file)
             
             print(f"   ✅ Loaded {len(documents)} pages")
             
             # Split into chunks
-            chunks = text_splitter.split_documents(documents)
+            chunks = text_chunker.split_pages([
+                (document.metadata.get("page", i), document.page_content) for i, document in enumerate(documents)
+            ])
             total_chunks += len(chunks)
             
             # Calculate total characters
-            chars_in_file = sum(len(chunk.page_content) for chunk in chunks)
+            chars_in_file = sum(len(chunk.content) for chunk in chunks)
             total_chars += chars_in_file
             
             print(f"   ✅ Created {len(chunks)} chunks")
@@ -50,8 +47,10 @@ def test_pdf_loading():
             
             # Show sample chunk
             if chunks:
-                sample = chunks[0].page_content[:200]
+                sample = chunks[0].content[:200]
                 print(f"   📝 Sample text: {sample}...")
+                print(f"   📍 Cited as page {chunks[0].page + 1} char {chunks[0].char_start} "
+                      f"to page {chunks[0].end_page + 1} char {chunks[0].char_end}")
             
             print()
             
@@ -66,6 +65,7 @@ def test_pdf_loading():
     print(f"Total chunks created: {total_chunks}")
     print(f"Total characters: {total_chars:,}")
     print(f"Average chunk size: {total_chars // total_chunks if total_chunks > 0 else 0} chars")
+    print(f"Extraction cache: {get_pdf_cache().hits} hits, {get_pdf_cache().misses} misses")
     print()
     print("✅ PDF loading test completed successfully!")
     print("="*60)
@@ -0,0 +1,263 @@
+"""
+Structure-aware chunking of knowledge documents.
+Splits on headings, paragraphs and sentences, sizes chunks in tokens, and records the page and
+character range of every chunk so retrieved passages can be cited.
+"""
+
+import os
+import re
+import bisect
+import logging
+from collections import namedtuple
+from typing import List, Tuple, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Chunk sizes in tokens of the embedding model's tokenizer
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "250"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "60"))  # Smaller sections are merged into the next one
+CHUNK_ENCODING = os.getenv("CHUNK_ENCODING", "cl100k_base")  # Tokenizer of text-embedding-3-*
+
+# Pages are joined with a paragraph break so a page boundary also ends a paragraph
+PAGE_SEPARATOR = "\n\n"
+
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+# End of a sentence: terminal punctuation, optional closing quotes, then whitespace before a capital or digit
+SENTENCE_END = re.compile(r"[.!?…][\"'”’)\]]*\s+(?=[\"'“‘(\[]?[A-Z0-9])")
+NUMBERED_HEADING = re.compile(r"(?:chapter|part|section|step)\s+\w+|\d+(?:\.\d+)*\.?\s+\S", re.IGNORECASE)
+WORD = re.compile(r"[^\W\d_][\w'’\-]*")
+# Approximate BPE tokens: short word pieces, digit groups and punctuation, with runs such as dot leaders merged
+APPROXIMATE_TOKEN = re.compile(r"[^\W\d_]{1,8}|\d{1,3}|([^\w\s])\1{0,7}")
+
+HEADING_MAX_CHARS = 80
+SENTENCE_CLOSERS = ".!?…:\"'”’)"
+
+# A chunk with its citation: pages and character offsets within those pages
+Chunk = namedtuple("Chunk", ["content", "page", "end_page", "char_start", "char_end", "tokens", "heading"])
+
+
+def approximate_token_counts(texts: List[str]) -> List[int]:
+    """Token counts estimated from word pieces, close to cl100k_base on English prose."""
+    return [len(APPROXIMATE_TOKEN.findall(text)) for text in texts]
+
+
+# Singleton instance, so the encoding is loaded (or found missing) once per process
+_token_counter: Optional[Callable[[List[str]], List[int]]] = None
+
+
+def get_token_counter() -> Callable[[List[str]], List[int]]:
+    """Batch token counter using tiktoken when its encoding is available, else the approximation."""
+    global _token_counter
+
+    if _token_counter is None:
+        try:
+            # Optional dependency; the encoding file is downloaded on first use
+            import tiktoken
+            encoding = tiktoken.get_encoding(CHUNK_ENCODING)
+            _token_counter = lambda texts: [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+        except Exception as e:
+            logger.warning(f"tiktoken encoding {CHUNK_ENCODING} unavailable ({e}); approximating token counts")
+            _token_counter = approximate_token_counts
+
+    return _token_counter
+
+
+def _is_heading(text: str, start: int, end: int) -> bool:
+    """Whether a line is a heading: short without closing punctuation, titled or numbered."""
+    if end - start > HEADING_MAX_CHARS or text[end - 1] in ".,;:!?":
+        return False
+    if NUMBERED_HEADING.match(text, start, end):
+        return True
+    words = [match.group() for match in WORD.finditer(text, start, end)]
+    if not words or len(words) > 12:
+        return False
+    # Title case or capitals; short function words may stay lowercase
+    titled = sum(1 for word in words if word[0].isupper() or len(word) <= 3)
+    return words[0][0].isupper() and titled == len(words)
+
+
+class TextChunker:
+    """Greedy token packing of heading, sentence and paragraph units in one pass over the text."""
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 min_tokens: int = CHUNK_MIN_TOKENS, count_tokens: Optional[Callable[[List[str]], List[int]]] = None):
+        """Set chunk sizes; count_tokens maps a list of texts to their token counts."""
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.min_tokens = min_tokens
+        self._count_tokens = count_tokens
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Token count of each text, loading the tokenizer on first use rather than at construction."""
+        if self._count_tokens is None:
+            self._count_tokens = get_token_counter()
+        return self._count_tokens(texts)
+
+    def _sentences(self, text: str, start: int, end: int, units: List[Tuple[int, int, bool]]):
+        """Append the sentences of text[start:end], searching in place without slicing."""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            for match in SENTENCE_END.finditer(text, start, end):
+                units.append((start, match.start() + 1, False))
+                start = match.end()
+            units.append((start, end, False))
+
+    def _units(self, text: str) -> List[Tuple[int, int, bool]]:
+        """(start, end, is_heading) of each heading and sentence, as offsets into text."""
+        units = []
+        position = 0
+        length = len(text)
+        while position < length:
+            paragraph = PARAGRAPH_BREAK.search(text, position)
+            paragraph_end = paragraph.start() if paragraph else length
+            # Extracted PDF text rarely sets headings apart with blank lines, so check each line
+            # that opens the paragraph or follows the end of a sentence
+            run = line = position
+            follows_sentence = True
+            while line < paragraph_end:
+                line_end = text.find("\n", line, paragraph_end)
+                line_end = paragraph_end if line_end == -1 else line_end
+                start, end = line, line_end
+                while start < end and text[start].isspace():
+                    start += 1
+                while end > start and text[end - 1].isspace():
+                    end -= 1
+                if start < end:
+                    if follows_sentence and _is_heading(text, start, end):
+                        self._sentences(text, run, start, units)
+                        units.append((start, end, True))
+                        run = line_end
+                    follows_sentence = text[end - 1] in SENTENCE_CLOSERS
+                line = line_end + 1
+            self._sentences(text, run, paragraph_end, units)
+            position = paragraph.end() if paragraph else length
+        return units
+
+    def _split_unit(self, text: str, start: int, end: int, tokens: int) -> List[Tuple[int, int, int]]:
+        """
+        Cut a unit longer than max_tokens into word-aligned (start, end, tokens) windows of at most max_tokens.
+
+        Windows are sized by the unit's average characters per token, so a denser stretch can
+        still run over; those are cut again, each time into windows shorter than before.
+        """
+        window = max(1, (end - start) * self.max_tokens // max(tokens, 1))
+        windows = []
+        while end - start > window:
+            cut = text.rfind(" ", start + window // 2, start + window)
+            cut = cut if cut != -1 else start + window
+            windows.append((start, cut))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        if start < end:
+            windows.append((start, end))
+
+        split = []
+        for (window_start, window_end), count in zip(windows, self.count_tokens([text[a:b] for a, b in windows])):
+            if count > self.max_tokens:
+                split.extend(self._split_unit(text, window_start, window_end, count))
+            else:
+                split.append((window_start, window_end, count))
+        return split
+
+    def split_pages(self, pages: List[Tuple[int, str]]) -> List[Chunk]:
+        """Chunk a document given as (page number, text) pairs; chunks may span page breaks."""
+        page_numbers = [number for number, _ in pages]
+        page_starts = []
+        offset = 0
+        for _, page_text in pages:
+            page_starts.append(offset)
+            offset += len(page_text) + len(PAGE_SEPARATOR)
+        text = PAGE_SEPARATOR.join(page_text for _, page_text in pages)
+
+        units = self._units(text)
+        counts = self.count_tokens([text[start:end] for start, end, _ in units])
+
+        # Oversized units become several word-aligned units
+        packed_units = []
+        for (start, end, heading), tokens in zip(units, counts):
+            if tokens <= self.max_tokens:
+                packed_units.append((start, end, heading, tokens))
+                continue
+            packed_units.extend((a, b, False, count) for a, b, count in self._split_unit(text, start, end, tokens))
+
+        # Section of each unit: the latest heading at or before it
+        sections = []
+        section = None
+        for start, end, heading, _ in packed_units:
+            if heading:
+                section = text[start:end]
+            sections.append(section)
+
+        chunks = []
+
+        def locate(position: int) -> Tuple[int, int]:
+            index = bisect.bisect_right(page_starts, position) - 1
+            return page_numbers[index], position - page_starts[index]
+
+        def emit(members: List[int]):
+            start, end = packed_units[members[0]][0], packed_units[members[-1]][1]
+            page, char_start = locate(start)
+            end_page, char_end = locate(end - 1)
+            chunks.append(Chunk(
+                content=text[start:end], page=page, end_page=end_page, char_start=char_start,
+                char_end=char_end + 1, tokens=sum(packed_units[index][3] for index in members),
+                heading=sections[members[0]]
+            ))
+
+        current: List[int] = []
+        current_tokens = 0
+        for index, (_, _, heading, tokens) in enumerate(packed_units):
+            if current and (
+                current_tokens + tokens > self.max_tokens
+                or (heading and current_tokens >= self.min_tokens)
+            ):
+                # A trailing heading belongs with the text after it
+                carried = []
+                while current and packed_units[current[-1]][2]:
+                    carried.insert(0, current.pop())
+                if current:
+                    emit(current)
+                # Sentence-aligned overlap that leaves room for the next unit, never into a new section
+                overlap = []
+                if not heading and not carried:
+                    overlap_tokens = 0
+                    for member in reversed(current[1:]):
+                        overlap_tokens += packed_units[member][3]
+                        if overlap_tokens > self.overlap_tokens or overlap_tokens + tokens > self.max_tokens:
+                            break
+                        overlap.insert(0, member)
+                current = overlap + carried
+                current_tokens = sum(packed_units[member][3] for member in current)
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            emit(current)
+
+        return chunks
+
+    def split_text(self, text: str, page: int = 0) -> List[Chunk]:
+        """Chunk a single text, reported as one page."""
+        return self.split_pages([(page, text)])
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    from pathlib import Path
+    from pdf_cache import load_pdf
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # python text_chunker.py PDF_FILE [COUNT]
+    documents = load_pdf(Path(sys.argv[1]))
+    chunks = TextChunker().split_pages([(document.metadata.get("page", 0), document.page_content) for document in documents])
+    for chunk in chunks[:int(sys.argv[2]) if len(sys.argv) > 2 else 5]:
+        print(json.dumps(chunk._asdict(), indent=2, ensure_ascii=False))
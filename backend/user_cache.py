@@ -0,0 +1,204 @@
+"""
+Two-tier cache for per-message user and active-conversation lookups.
+An in-process LRU with TTL sits in front of an optional shared Redis tier for multi-worker deployments.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import logging
+from datetime import datetime
+from collections import OrderedDict, namedtuple
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "true").lower() == "true"
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_LOCAL_TTL = float(os.getenv("USER_CACHE_LOCAL_TTL", "60"))
+USER_CACHE_SHARED_TTL = int(os.getenv("USER_CACHE_SHARED_TTL", "600"))
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Same fields as the row returned by begin_turn
+TurnContext = namedtuple(
+    "TurnContext", ["user_id", "crisis_flag", "conversation_id", "summary", "summarized_through"],
+    defaults=(None,)
+)
+
+
+class LRUTTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        """Initialize empty cache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Return a live value or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        """Store a value, evicting the least recently used entries past capacity."""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        """Remove a key."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisTier:
+    """Shared cache tier in Redis, storing TurnContext values as JSON."""
+
+    def __init__(self, url: str, ttl: int):
+        """Connect to Redis."""
+        import redis  # Optional dependency, only needed for shared state
+
+        self.redis = redis.Redis.from_url(url)
+        self.redis.ping()
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[TurnContext]:
+        """Return a cached value or None."""
+        raw = self.redis.get(f"turn:{key}")
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return TurnContext(
+            user_id=uuid.UUID(data["user_id"]),
+            crisis_flag=data["crisis_flag"],
+            conversation_id=uuid.UUID(data["conversation_id"]),
+            summary=data["summary"],
+            summarized_through=(
+                datetime.fromisoformat(data["summarized_through"]) if data.get("summarized_through") else None
+            )
+        )
+
+    def set(self, key: str, value: TurnContext):
+        """Store a value with the shared TTL."""
+        self.redis.set(f"turn:{key}", json.dumps({
+            "user_id": str(value.user_id),
+            "crisis_flag": bool(value.crisis_flag),
+            "conversation_id": str(value.conversation_id),
+            "summary": value.summary,
+            "summarized_through": value.summarized_through.isoformat() if value.summarized_through else None
+        }), ex=self.ttl)
+
+    def delete(self, key: str):
+        """Remove a key."""
+        self.redis.delete(f"turn:{key}")
+
+
+class UserLookupCache:
+    """Maps whatsapp_number to TurnContext through a local tier and an optional shared tier."""
+
+    def __init__(self, shared: RedisTier = None, enabled: bool = USER_CACHE_ENABLED):
+        """Initialize cache tiers and hit/miss counters."""
+        self.local = LRUTTLCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_LOCAL_TTL)
+        self.shared = shared
+        self.enabled = enabled
+        self._stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, whatsapp_number: str) -> Optional[TurnContext]:
+        """Look up a number in the local tier, then the shared tier."""
+        if not self.enabled:
+            return None
+
+        value = self.local.get(whatsapp_number)
+        if value is not None:
+            self._stats["local_hits"] += 1
+            return value
+
+        if self.shared:
+            try:
+                value = self.shared.get(whatsapp_number)
+            except Exception as e:
+                logger.error(f"Shared user cache unavailable: {e}")
+                value = None
+            if value is not None:
+                self._stats["shared_hits"] += 1
+                self.local.set(whatsapp_number, value)
+                return value
+
+        self._stats["misses"] += 1
+        return None
+
+    def set(self, whatsapp_number: str, turn):
+        """Cache the lookup result for a number in both tiers."""
+        if not self.enabled:
+            return
+
+        value = TurnContext(
+            turn.user_id, bool(turn.crisis_flag), turn.conversation_id, turn.summary,
+            getattr(turn, "summarized_through", None)
+        )
+        self.local.set(whatsapp_number, value)
+        if self.shared:
+            try:
+                self.shared.set(whatsapp_number, value)
+            except Exception as e:
+                logger.error(f"Shared user cache unavailable: {e}")
+
+    def invalidate(self, whatsapp_number: str):
+        """Drop a number from both tiers after a write that changes its cached fields."""
+        self._stats["invalidations"] += 1
+        self.local.delete(whatsapp_number)
+        if self.shared:
+            try:
+                self.shared.delete(whatsapp_number)
+            except Exception as e:
+                logger.error(f"Shared user cache unavailable: {e}")
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and local size."""
+        lookups = self._stats["local_hits"] + self._stats["shared_hits"] + self._stats["misses"]
+        hits = self._stats["local_hits"] + self._stats["shared_hits"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "local_entries": len(self.local),
+            "shared_tier": self.shared is not None
+        }
+
+
+# Singleton instance
+_cache_instance: Optional[UserLookupCache] = None
+
+
+def get_user_cache() -> UserLookupCache:
+    """Get or create user lookup cache singleton instance."""
+    global _cache_instance
+
+    if _cache_instance is None:
+        shared = None
+        if REDIS_URL:
+            try:
+                shared = RedisTier(REDIS_URL, USER_CACHE_SHARED_TTL)
+                logger.info("User cache using shared Redis tier")
+            except Exception as e:
+                logger.error(f"Redis unavailable for user cache, using local tier only: {e}")
+        _cache_instance = UserLookupCache(shared)
+
+    return _cache_instance
@@ -0,0 +1,295 @@
+"""
+User-scoped long-term memory retrieval for the therapeutic chatbot.
+Keeps an in-memory vector index per active user and falls back to a per-user database search.
+"""
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import load_user_memories, search_similar_messages
+from storage import get_storage
+from embedding_spaces import get_space_registry
+
+logger = logging.getLogger(__name__)
+
+# Memory configuration
+USER_MEMORY_ENABLED = os.getenv("USER_MEMORY_ENABLED", "true").lower() == "true"
+MEMORY_MAX_ACTIVE_USERS = int(os.getenv("MEMORY_MAX_ACTIVE_USERS", "1000"))
+MEMORY_MAX_MESSAGES_PER_USER = int(os.getenv("MEMORY_MAX_MESSAGES_PER_USER", "2000"))
+# Memory cap across all loaded indexes; a full 1536-dimension index takes about 12 MB
+MEMORY_MAX_BYTES = int(os.getenv("MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+MEMORY_MIN_SIMILARITY = float(os.getenv("MEMORY_MIN_SIMILARITY", "0.8"))
+
+
+class _UserIndex:
+    """
+    Normalized embedding matrix and payloads for one user's past messages.
+
+    Rows live in a preallocated array that grows geometrically up to the per-user cap, then
+    wraps around and overwrites the oldest row. Row order doesn't matter for ranking.
+    """
+
+    def __init__(self, rows, max_messages: int):
+        """Build index from (id, conversation_id, content, timestamp, embedding) rows, oldest first."""
+        rows = rows[-max_messages:] if max_messages else []
+        self.max_messages = max_messages
+        self.message_ids = [row.id for row in rows]
+        self.conversation_ids = [row.conversation_id for row in rows]
+        self.contents = [row.content for row in rows]
+        self.count = len(rows)
+        self.oldest = 0  # Next row to overwrite once full
+        # Small integer per conversation so excluding one is a vectorized comparison
+        self._codes: Dict[object, int] = {}
+        self.conversation_codes = np.array(
+            [self._code(conversation_id) for conversation_id in self.conversation_ids], dtype=np.int32
+        )
+        self.timestamps = np.array([row.timestamp for row in rows], dtype="datetime64[us]")
+        self.vectors = (
+            _normalize(np.asarray([row.embedding for row in rows], dtype=np.float32)) if rows else None
+        )
+        self.content_bytes = sum(len(content) for content in self.contents)
+
+    def _code(self, conversation_id) -> int:
+        """Code of a conversation, assigned on first sight."""
+        return self._codes.setdefault(conversation_id, len(self._codes))
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Rows in use."""
+        return self.vectors[:self.count] if self.vectors is not None else np.empty((0, 0), dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held, counting allocated rows and message text."""
+        vectors = self.vectors.nbytes if self.vectors is not None else 0
+        return (vectors + self.conversation_codes.nbytes + self.timestamps.nbytes
+                + self.content_bytes + 64 * len(self.contents))
+
+    def _grow(self, dimension: int):
+        """Double the allocated rows, up to the per-user cap."""
+        capacity = len(self.conversation_codes)
+        new_capacity = min(self.max_messages, max(16, capacity * 2))
+        vectors = np.empty((new_capacity, dimension), dtype=np.float32)
+        codes = np.empty(new_capacity, dtype=np.int32)
+        timestamps = np.empty(new_capacity, dtype="datetime64[us]")
+        if self.count:
+            vectors[:self.count] = self.vectors[:self.count]
+            codes[:self.count] = self.conversation_codes[:self.count]
+            timestamps[:self.count] = self.timestamps[:self.count]
+        self.vectors = vectors
+        self.conversation_codes = codes
+        self.timestamps = timestamps
+
+    def add(self, message_id, conversation_id, content: str, embedding, timestamp: datetime):
+        """Add a message, overwriting the oldest once the per-user cap is reached."""
+        if not self.max_messages:
+            return
+        vector = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        if self.count < self.max_messages:
+            if self.vectors is None or self.count == len(self.conversation_codes):
+                self._grow(len(vector))
+            slot = self.count
+            self.count += 1
+            self.message_ids.append(message_id)
+            self.conversation_ids.append(conversation_id)
+            self.contents.append(content)
+        else:
+            slot = self.oldest
+            self.oldest = (self.oldest + 1) % self.max_messages
+            self.content_bytes -= len(self.contents[slot])
+            self.message_ids[slot] = message_id
+            self.conversation_ids[slot] = conversation_id
+            self.contents[slot] = content
+        self.vectors[slot] = vector
+        self.conversation_codes[slot] = self._code(conversation_id)
+        self.timestamps[slot] = np.datetime64(timestamp, "us")
+        self.content_bytes += len(content)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so a dot product is cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class UserMemoryIndex:
+    """LRU of per-user vector indexes for active users, bounded by user count and bytes."""
+
+    def __init__(self, max_users: int = MEMORY_MAX_ACTIVE_USERS,
+                 max_messages_per_user: int = MEMORY_MAX_MESSAGES_PER_USER,
+                 min_similarity: float = MEMORY_MIN_SIMILARITY, max_bytes: int = MEMORY_MAX_BYTES):
+        """Initialize empty index with capacity limits."""
+        self.max_users = max_users
+        self.max_messages_per_user = max_messages_per_user
+        self.min_similarity = min_similarity
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[object, _UserIndex]" = OrderedDict()
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id) -> Optional[_UserIndex]:
+        """Return the user's loaded index, marking it recently used."""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+            return index
+
+    def _store(self, user_id, rows) -> _UserIndex:
+        """Build and cache a user's index from newest-first rows."""
+        index = _UserIndex(list(reversed(rows)), self.max_messages_per_user)
+
+        with self._lock:
+            self._remove(user_id)
+            self._indexes[user_id] = index
+            self._bytes += index.nbytes
+            self._enforce_caps()
+
+        logger.info(f"Loaded {len(rows)} memories for user {user_id}")
+        return index
+
+    def _get_or_load(self, db: Session, user_id) -> _UserIndex:
+        """Return the user's index, loading it from the database on first access."""
+        index = self._cached(user_id)
+        if index is None:
+            index = self._store(user_id, load_user_memories(db, user_id, limit=self.max_messages_per_user))
+        return index
+
+    def search(self, db: Session, user_id, query_embedding: List[float], k: int = 3,
+               window_conversation_id=None, window_start: datetime = None) -> List[Dict]:
+        """
+        Return the user's most similar past messages above the similarity cutoff.
+
+        Messages of window_conversation_id from window_start on are already in the prompt
+        and are skipped; older messages of the same conversation remain candidates.
+        """
+        index = self._get_or_load(db, user_id)
+        return self._rank(index, query_embedding, k, window_conversation_id, window_start)
+
+    async def search_async(self, db: AsyncSession, user_id, query_embedding: List[float], k: int = 3,
+                           window_conversation_id=None, window_start: datetime = None) -> List[Dict]:
+        """Async variant of search that loads cold users through an async session."""
+        index = self._cached(user_id)
+        if index is None:
+            rows = await get_storage().load_user_memories(db, user_id, limit=self.max_messages_per_user)
+            index = self._store(user_id, rows)
+        return self._rank(index, query_embedding, k, window_conversation_id, window_start)
+
+    def _rank(self, index: _UserIndex, query_embedding: List[float], k: int,
+              window_conversation_id=None, window_start: datetime = None) -> List[Dict]:
+        """Rank a user's messages by cosine similarity to the query."""
+        with self._lock:
+            if index.count == 0 or k <= 0:
+                return []
+            query = _normalize(np.asarray([query_embedding], dtype=np.float32))[0]
+            similarities = index.matrix @ query
+
+            # Mask the messages already in the prompt window out before ranking, however many
+            code = index._codes.get(window_conversation_id) if window_conversation_id is not None else None
+            if code is not None and window_start is not None:
+                in_window = (index.conversation_codes[:index.count] == code) & (
+                    index.timestamps[:index.count] >= np.datetime64(window_start, "us")
+                )
+                similarities[in_window] = -np.inf
+
+            candidates = min(len(similarities), k)
+            top = np.argpartition(-similarities, candidates - 1)[:candidates]
+            top = top[np.argsort(-similarities[top])]
+
+            results = []
+            for i in top:
+                if similarities[i] < self.min_similarity:
+                    break
+                results.append({
+                    "content": index.contents[i],
+                    "similarity": float(similarities[i]),
+                    "conversation_id": index.conversation_ids[i]
+                })
+
+        return results
+
+    def add(self, user_id, message_id, conversation_id, content: str, embedding,
+            timestamp: datetime = None):
+        """Add a freshly saved message to the user's index if it is loaded."""
+        if embedding is None:
+            return
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                before = index.nbytes
+                index.add(message_id, conversation_id, content, embedding, timestamp or datetime.utcnow())
+                self._bytes += index.nbytes - before
+                self._enforce_caps()
+
+    def evict(self, user_id):
+        """Drop a user's index."""
+        with self._lock:
+            self._remove(user_id)
+
+    def clear(self):
+        """Drop every loaded index, e.g. after another embedding space became active."""
+        with self._lock:
+            self._indexes.clear()
+            self._bytes = 0
+
+    def _remove(self, user_id):
+        """Remove an index and release its bytes. Caller holds the lock."""
+        index = self._indexes.pop(user_id, None)
+        if index is not None:
+            self._bytes -= index.nbytes
+
+    def _enforce_caps(self):
+        """Evict least recently used indexes until under both caps. Caller holds the lock."""
+        while self._indexes and (len(self._indexes) > self.max_users or self._bytes > self.max_bytes):
+            _, index = self._indexes.popitem(last=False)
+            self._bytes -= index.nbytes
+            self._evictions += 1
+
+    def stats(self) -> Dict:
+        """Loaded users, memory use and evictions."""
+        return {
+            "users": len(self._indexes),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self._evictions
+        }
+
+
+def search_user_memories_db(db: Session, user_id, query_embedding: List[float], k: int = 3,
+                            window_conversation_id=None, window_start: datetime = None,
+                            min_similarity: float = MEMORY_MIN_SIMILARITY) -> List[Dict]:
+    """Per-user memory search in the database, for callers without the in-memory index."""
+    rows = search_similar_messages(
+        db, user_id, query_embedding, limit=k,
+        window_conversation_id=window_conversation_id, window_start=window_start
+    )
+    return [
+        {"content": row.content, "similarity": 1.0 - float(row.distance),
+         "conversation_id": row.conversation_id}
+        for row in rows
+        if 1.0 - float(row.distance) >= min_similarity
+    ]
+
+
+# Singleton instance
+_memory_index: Optional[UserMemoryIndex] = None
+
+
+def get_memory_index() -> UserMemoryIndex:
+    """Get or create user memory index singleton instance."""
+    global _memory_index
+
+    if _memory_index is None:
+        _memory_index = UserMemoryIndex()
+        # Loaded vectors belong to the previous space after a cutover
+        get_space_registry().on_activate(_memory_index.clear)
+
+    return _memory_index
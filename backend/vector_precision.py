@@ -0,0 +1,233 @@
+"""
+Full (vector) or half (halfvec) precision storage for embeddings.
+Migrates existing embedding columns and their ANN indexes to the configured precision, measures
+the recall cost of half precision, and reports table, index and buffer cache sizes.
+"""
+
+import os
+import re
+import json
+import logging
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from database import engine, VECTOR_PRECISION
+
+logger = logging.getLogger(__name__)
+
+VECTOR_MIGRATION_LOCK_TIMEOUT = os.getenv("VECTOR_MIGRATION_LOCK_TIMEOUT", "5s")
+
+# halfvec arrived in pgvector 0.7
+HALFVEC_MIN_VERSION = (0, 7)
+
+# Opclasses of ANN indexes, which name the vector type and must change with it
+OPCLASS_PATTERN = re.compile(r"\b(?:vector|halfvec)_(cosine|l2|ip)_ops\b")
+
+# Top-level tables with an embedding column: messages, knowledge_documents and embedding space tables
+VECTOR_COLUMNS_QUERY = text("""
+    SELECT c.relname AS table_name, t.typname AS type_name, a.atttypmod AS dimension
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_type t ON t.oid = a.atttypid
+    WHERE n.nspname = current_schema() AND a.attname = 'embedding' AND NOT a.attisdropped
+      AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+      AND t.typname IN ('vector', 'halfvec')
+    ORDER BY c.relname
+""")
+
+# Storage relations of a table: its partitions when partitioned, else the table itself
+TABLE_RELATIONS = """
+    SELECT relid FROM pg_partition_tree(:table) WHERE isleaf
+    UNION ALL
+    SELECT CAST(:table AS regclass) WHERE NOT EXISTS (SELECT 1 FROM pg_partition_tree(:table))
+"""
+
+
+def target_type() -> str:
+    """pgvector type for the configured precision."""
+    return "halfvec" if VECTOR_PRECISION == "half" else "vector"
+
+
+def pgvector_version(connection) -> Optional[Tuple[int, ...]]:
+    """Installed pgvector version, e.g. (0, 7, 4), or None when the extension is missing."""
+    version = connection.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(part) for part in re.findall(r"\d+", version)) if version else None
+
+
+def require_halfvec(connection):
+    """Stop with a clear message when the installed pgvector has no halfvec type."""
+    version = pgvector_version(connection)
+    if version is None or version < HALFVEC_MIN_VERSION:
+        installed = ".".join(map(str, version)) if version else "not installed"
+        raise RuntimeError(
+            f"halfvec needs pgvector {'.'.join(map(str, HALFVEC_MIN_VERSION))} or later (installed: {installed}); "
+            f"upgrade the extension and run ALTER EXTENSION vector UPDATE"
+        )
+
+
+def vector_columns(connection) -> List:
+    """Embedding columns with their current type and dimension."""
+    return connection.execute(VECTOR_COLUMNS_QUERY).all()
+
+
+def ann_indexes(connection, table: str) -> List:
+    """ANN indexes on a table's embedding column, with their definitions."""
+    rows = connection.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {"table": table}).all()
+    return [row for row in rows if OPCLASS_PATTERN.search(row.indexdef)]
+
+
+def check_precision():
+    """Warn when stored columns don't match VECTOR_PRECISION, since queries would then fail."""
+    with engine.connect() as connection:
+        if target_type() == "halfvec":
+            try:
+                require_halfvec(connection)
+            except RuntimeError as e:
+                logger.error(f"VECTOR_PRECISION=half can't be used: {e}")
+        mismatched = [row.table_name for row in vector_columns(connection) if row.type_name != target_type()]
+    if mismatched:
+        logger.warning(
+            f"Embedding columns of {', '.join(mismatched)} are not {target_type()}; "
+            f"run `python vector_precision.py migrate`"
+        )
+    return mismatched
+
+
+def migrate() -> List[str]:
+    """
+    Convert every embedding column to the configured precision, one table per transaction.
+
+    ALTER COLUMN TYPE rewrites the table under an exclusive lock, so run this in a
+    maintenance window. ANN indexes are dropped and rebuilt with the matching opclass.
+    """
+    migrated = []
+    with engine.connect() as connection:
+        if target_type() == "halfvec":
+            require_halfvec(connection)
+        columns = [row for row in vector_columns(connection) if row.type_name != target_type()]
+
+    for column in columns:
+        new_type = f"{target_type()}({column.dimension})"
+        with engine.begin() as connection:
+            connection.execute(text(f"SET LOCAL lock_timeout = '{VECTOR_MIGRATION_LOCK_TIMEOUT}'"))
+            indexes = ann_indexes(connection, column.table_name)
+            for index in indexes:
+                connection.execute(text(f"DROP INDEX {index.indexname}"))
+            connection.execute(text(
+                f"ALTER TABLE {column.table_name} ALTER COLUMN embedding TYPE {new_type} "
+                f"USING embedding::{new_type}"
+            ))
+            for index in indexes:
+                # Partitioned parents report ON ONLY, which would skip building the partitions' indexes
+                definition = index.indexdef.replace(" ON ONLY ", " ON ")
+                connection.execute(text(OPCLASS_PATTERN.sub(fr"{target_type()}_\1_ops", definition)))
+        with engine.connect() as connection:
+            connection.execute(text(f"ANALYZE {column.table_name}"))
+            connection.commit()
+
+        migrated.append(column.table_name)
+        logger.info(f"Migrated {column.table_name}.embedding to {new_type} ({len(indexes)} indexes rebuilt)")
+
+    return migrated
+
+
+def _recall(connection, table: str, filters: str, params: Dict, query_vector: str, dimension: int, k: int) -> float:
+    """Share of the exact full precision top-k that exact half precision search also returns."""
+    ranked = {}
+    for vector_type in ("vector", "halfvec"):
+        # Casting the column keeps ANN indexes out of it, so both rankings are exact
+        rows = connection.execute(text(
+            f"SELECT id FROM {table} WHERE embedding IS NOT NULL {filters} "
+            f"ORDER BY embedding::{vector_type}({dimension}) <=> CAST(:query AS {vector_type}({dimension})) "
+            f"LIMIT :k"
+        ), {**params, "query": query_vector, "k": k}).scalars().all()
+        ranked[vector_type] = set(rows)
+    return len(ranked["vector"] & ranked["halfvec"]) / len(ranked["vector"]) if ranked["vector"] else 1.0
+
+
+def compare_precision(samples: int = 100, k: int = 10) -> Dict:
+    """
+    Recall@k of half precision against full precision retrieval.
+
+    Uses stored vectors as queries, over the knowledge base and each query's own user
+    memories. Run it before migrating, while full precision values still exist.
+    """
+    results = {}
+    with engine.connect() as connection:
+        require_halfvec(connection)
+        dimensions = {row.table_name: row.dimension for row in vector_columns(connection)}
+        targets = {
+            "knowledge_documents": ("", lambda row: {}),
+            "messages": ("AND user_id = :user_id AND role = 'user'", lambda row: {"user_id": row.user_id})
+        }
+        for table, (filters, params) in targets.items():
+            columns = "id, user_id" if table == "messages" else "id"
+            queries = connection.execute(text(
+                f"SELECT {columns}, embedding::vector::text AS embedding FROM {table} "
+                f"WHERE embedding IS NOT NULL ORDER BY random() LIMIT :samples"
+            ), {"samples": samples}).all()
+            recalls = [
+                _recall(connection, table, filters, params(row), row.embedding, dimensions[table], k)
+                for row in queries
+            ]
+            results[table] = {
+                "samples": len(recalls),
+                "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+                "min_recall_at_k": round(float(np.min(recalls)), 4) if recalls else None
+            }
+    return {"k": k, **results}
+
+
+def sizes() -> Dict:
+    """Table, index and (with pg_buffercache) cached bytes of each table with embeddings."""
+    report = {}
+    with engine.connect() as connection:
+        has_buffercache = connection.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_buffercache')"
+        )).scalar()
+        for column in vector_columns(connection):
+            # Table size includes TOAST, where vectors of this size are stored
+            size = connection.execute(text(f"""
+                SELECT sum(pg_table_size(relid)) AS table_bytes, sum(pg_indexes_size(relid)) AS index_bytes
+                FROM ({TABLE_RELATIONS}) relations
+            """), {"table": column.table_name}).one()
+            report[column.table_name] = {
+                "type": f"{column.type_name}({column.dimension})",
+                "table_bytes": int(size.table_bytes or 0),
+                "index_bytes": int(size.index_bytes or 0)
+            }
+            if has_buffercache:
+                report[column.table_name]["cached_bytes"] = int(connection.execute(text(f"""
+                    WITH relations AS ({TABLE_RELATIONS})
+                    SELECT count(*) * current_setting('block_size')::int FROM pg_buffercache b
+                    JOIN pg_class c ON pg_relation_filenode(c.oid) = b.relfilenode
+                    WHERE b.reldatabase = (SELECT oid FROM pg_database WHERE datname = current_database())
+                      AND (c.oid IN (SELECT relid FROM relations)
+                           OR c.oid IN (SELECT reltoastrelid FROM pg_class WHERE oid IN (SELECT relid FROM relations))
+                           OR c.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid IN (SELECT relid FROM relations)))
+                """), {"table": column.table_name}).scalar())
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # python vector_precision.py [sizes | compare [SAMPLES] [K] | migrate]
+    command = sys.argv[1] if len(sys.argv) > 1 else "sizes"
+    try:
+        if command == "compare":
+            arguments = [int(argument) for argument in sys.argv[2:4]]
+            print(json.dumps(compare_precision(*arguments), indent=2))
+        elif command == "migrate":
+            migrate()
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print(json.dumps(sizes(), indent=2))
@@ -0,0 +1,426 @@
+"""
+Write-behind persistence for chat messages.
+Turns are appended to a durable spill file, then flushed to PostgreSQL in multi-row batches
+with conversation and user counter updates aggregated per batch.
+"""
+
+import os
+import json
+import glob
+import fcntl
+import uuid
+import asyncio
+import threading
+import logging
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+from sqlalchemy import update, values, column, func, Integer, DateTime, Boolean
+from sqlalchemy.exc import OperationalError, InterfaceError
+from sqlalchemy.dialects.postgresql import insert, UUID
+from database import (
+    SessionLocal, User, Conversation, Message,
+    turn_message_rows, append_to_history_buffer
+)
+from read_replicas import get_replica_router
+from embedding_spaces import split_space_vectors, space_vector_inserts
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration; off by default since acknowledged turns reach PostgreSQL asynchronously
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))  # seconds
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))  # rows
+WRITE_BEHIND_SPILL_DIR = os.getenv("WRITE_BEHIND_SPILL_DIR", "data/spill")
+# Flushes a row may fail on its own before it moves to a dead-letter segment
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+
+# Errors meaning the database is unreachable rather than a row being unwritable
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+
+def _encode_row(row: Dict) -> Dict:
+    """Make a message row JSON-serializable for the spill file."""
+    embedding = row["embedding"]
+    return {
+        **row,
+        "id": str(row["id"]),
+        "conversation_id": str(row["conversation_id"]),
+        "user_id": str(row["user_id"]),
+        "timestamp": row["timestamp"].isoformat(),
+        "embedding": [float(v) for v in embedding] if embedding is not None else None,
+        "space_embeddings": {
+            name: [float(v) for v in vector] for name, vector in (row.get("space_embeddings") or {}).items()
+        }
+    }
+
+
+def _decode_row(data: Dict) -> Dict:
+    """Restore a message row read back from the spill file."""
+    return {
+        **data,
+        "id": uuid.UUID(data["id"]),
+        "conversation_id": uuid.UUID(data["conversation_id"]),
+        "user_id": uuid.UUID(data["user_id"]),
+        "timestamp": datetime.fromisoformat(data["timestamp"])
+    }
+
+
+class WriteBehindBuffer:
+    """
+    Collects message rows from all requests and flushes them in batches from a background thread.
+
+    When a batch fails on its data, its rows are retried one at a time so a single unwritable
+    row can't hold back the rest. Rows failing WRITE_BEHIND_MAX_ATTEMPTS flushes are moved to a
+    dead-letter segment (dead-*.jsonl in the spill directory, same format as spill segments;
+    rename one to spill-*.jsonl to have the next start replay it).
+    """
+
+    def __init__(self, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH, spill_dir: str = WRITE_BEHIND_SPILL_DIR,
+                 session_factory=SessionLocal, max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS):
+        """Initialize buffer; call start() to replay spills and begin flushing."""
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.spill_dir = spill_dir
+        self.session_factory = session_factory
+        self.max_attempts = max_attempts
+
+        self._pending: List[Dict] = []
+        self._crisis_users = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._spill = None
+        self._retained = []  # Segments whose rows failed to flush and are still pending
+        self._spill_sequence = 0
+        self._attempts: Dict[uuid.UUID, int] = {}  # Failed flushes per pending row id
+        self._stats = {
+            "enqueued": 0, "flushed": 0, "batches": 0, "failures": 0, "replayed": 0, "dead_lettered": 0
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _open_spill(self):
+        """Open and lock a fresh spill segment for appending. Caller holds the lock."""
+        self._spill_sequence += 1
+        path = os.path.join(
+            self.spill_dir, f"spill-{os.getpid()}-{self._spill_sequence:08d}.jsonl"
+        )
+        self._spill = open(path, "a", encoding="utf-8")
+        # Held until the segment is flushed, so other workers never replay a live segment
+        fcntl.flock(self._spill.fileno(), fcntl.LOCK_EX)
+
+    def start(self):
+        """Replay spill segments left by a previous process, then start the flush thread."""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._replay()
+
+        with self._lock:
+            self._open_spill()
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        logger.info(f"Write-behind buffer started (every {self.flush_interval * 1000:.0f}ms "
+                    f"or {self.max_batch} rows)")
+
+    def stop(self):
+        """Stop the flush thread and flush everything still pending; unflushed rows stay spilled."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Final write-behind flush failed, rows stay in the spill for replay: {e}")
+        with self._lock:
+            if self._spill:
+                # Everything in the open segment was flushed unless rows are still pending
+                if not self._pending:
+                    os.remove(self._spill.name)
+                self._spill.close()
+                self._spill = None
+            # Closing releases the locks, so the next start replays these
+            for segment in self._retained:
+                segment.close()
+            self._retained = []
+        logger.info("Write-behind buffer stopped")
+
+    def enqueue_turn(self, conversation_id: uuid.UUID, user_id: uuid.UUID,
+                     messages: List[Dict], crisis: bool = False) -> List[uuid.UUID]:
+        """
+        Durably accept a turn's messages for batched persistence.
+
+        Rows are fsynced to the spill file before returning, so acknowledged messages
+        survive a crash. Returns the new message ids in order.
+        """
+        rows = turn_message_rows(conversation_id, user_id, messages, datetime.utcnow())
+        lines = "".join(
+            json.dumps({**_encode_row(row), "crisis": crisis}) + "\n" for row in rows
+        )
+
+        with self._lock:
+            self._spill.write(lines)
+            self._spill.flush()
+            os.fsync(self._spill.fileno())
+            self._pending.extend(rows)
+            if crisis:
+                self._crisis_users.add(user_id)
+            self._stats["enqueued"] += len(rows)
+            full = len(self._pending) >= self.max_batch
+
+        append_to_history_buffer(conversation_id, rows)
+        get_replica_router().mark_written(conversation_id, user_id)
+        if full:
+            self._wakeup.set()
+        return [row["id"] for row in rows]
+
+    async def aenqueue_turn(self, conversation_id: uuid.UUID, user_id: uuid.UUID,
+                            messages: List[Dict], crisis: bool = False) -> List[uuid.UUID]:
+        """enqueue_turn in a worker thread, keeping the fsync off the event loop."""
+        return await asyncio.to_thread(self.enqueue_turn, conversation_id, user_id, messages, crisis)
+
+    def _run(self):
+        """Flush loop for the background thread."""
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    def flush(self) -> int:
+        """Write all pending rows in one transaction, isolating unwritable rows. Returns rows inserted."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                rows, self._pending = self._pending, []
+                crisis_users, self._crisis_users = self._crisis_users, set()
+
+                # Rotate the spill so rows enqueued during the flush land in a new segment
+                flushing = self._spill
+                if flushing:
+                    self._open_spill()
+
+            try:
+                inserted, failed = self._write_isolating(rows, crisis_users)
+            except Exception:
+                # Database unreachable: rows stay durable in the still-locked segment and are retried
+                self._requeue(flushing, rows, crisis_users)
+                raise
+
+            # Rows that keep failing on their own go to a dead-letter segment
+            for row in failed:
+                self._attempts[row["id"]] = self._attempts.get(row["id"], 0) + 1
+            dead = [row for row in failed if self._attempts[row["id"]] >= self.max_attempts]
+            if dead:
+                self._dead_letter(dead, crisis_users)
+            failed = [row for row in failed if self._attempts[row["id"]] < self.max_attempts]
+            retrying = {row["id"] for row in failed}
+            for row in rows:
+                if row["id"] not in retrying:
+                    self._attempts.pop(row["id"], None)
+
+            if failed:
+                # The segment still holds rows that are pending, so it can't be removed yet
+                self._requeue(flushing, failed, crisis_users & {row["user_id"] for row in failed})
+            elif flushing:
+                with self._lock:
+                    done, self._retained = self._retained + [flushing], []
+                for segment in done:
+                    os.remove(segment.name)
+                    segment.close()
+            with self._lock:
+                self._stats["flushed"] += inserted
+                self._stats["batches"] += 1
+            return inserted
+
+    def _requeue(self, flushing, rows: List[Dict], crisis_users: set):
+        """Put rows back at the front of the queue, retaining their spill segment."""
+        with self._lock:
+            if flushing:
+                self._retained.append(flushing)
+            self._pending = rows + self._pending
+            self._crisis_users |= crisis_users
+            self._stats["failures"] += 1
+
+    def _write_isolating(self, rows: List[Dict], crisis_users: set) -> Tuple[int, List[Dict]]:
+        """
+        Write rows as one batch, or one at a time when the batch fails on its data.
+
+        Connection errors are raised, since no row could be written.
+
+        Returns:
+            (rows inserted, rows that failed)
+        """
+        try:
+            return self._write(rows, crisis_users), []
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as e:
+            logger.warning(f"Write-behind batch of {len(rows)} rows failed, writing rows one at a time: {e}")
+
+        inserted, failed = 0, []
+        for row in rows:
+            try:
+                inserted += self._write([row], crisis_users & {row["user_id"]})
+            except CONNECTION_ERRORS:
+                raise
+            except Exception as e:
+                logger.error(f"Write-behind could not write message {row['id']}: {e}")
+                failed.append(row)
+        return inserted, failed
+
+    def _dead_letter(self, rows: List[Dict], crisis_users: set):
+        """Durably move rows that can't be written to a dead-letter segment."""
+        with self._lock:
+            self._spill_sequence += 1
+            path = os.path.join(self.spill_dir, f"dead-{os.getpid()}-{self._spill_sequence:08d}.jsonl")
+            self._stats["dead_lettered"] += len(rows)
+        with open(path, "a", encoding="utf-8") as dead_letters:
+            for row in rows:
+                line = json.dumps({**_encode_row(row), "crisis": row["user_id"] in crisis_users})
+                dead_letters.write(line + "\n")
+            dead_letters.flush()
+            os.fsync(dead_letters.fileno())
+        logger.error(f"Moved {len(rows)} unwritable messages to dead-letter segment {path}")
+
+    def _write(self, rows: List[Dict], crisis_users: set) -> int:
+        """Insert rows and apply aggregated counter updates in a single transaction."""
+        db = self.session_factory()
+        try:
+            inserted = 0
+            conversations: Dict[uuid.UUID, List] = {}
+            users: Dict[uuid.UUID, List] = {}
+
+            for start in range(0, len(rows), self.max_batch):
+                batch, vectors = split_space_vectors(rows[start:start + self.max_batch])
+                # Ids are generated client-side, so replaying a spill never double-inserts
+                for statement in space_vector_inserts(vectors):
+                    db.execute(statement)
+                result = db.execute(
+                    insert(Message).values(batch)
+                    .on_conflict_do_nothing()
+                    .returning(Message.conversation_id, Message.user_id, Message.role,
+                               Message.timestamp)
+                ).all()
+                inserted += len(result)
+
+                # Aggregate counters from rows actually inserted
+                for row in result:
+                    count, last_at = conversations.get(row.conversation_id, (0, row.timestamp))
+                    conversations[row.conversation_id] = (count + 1, max(last_at, row.timestamp))
+                    turns, last_seen = users.get(row.user_id, (0, row.timestamp))
+                    users[row.user_id] = (
+                        turns + (1 if row.role == "user" else 0), max(last_seen, row.timestamp)
+                    )
+
+            if conversations:
+                counts = values(
+                    column("id", UUID(as_uuid=True)), column("n", Integer),
+                    column("last_at", DateTime), name="counts"
+                ).data([(cid, n, last_at) for cid, (n, last_at) in conversations.items()])
+                db.execute(
+                    update(Conversation).where(Conversation.id == counts.c.id).values(
+                        message_count=Conversation.message_count + counts.c.n,
+                        last_message_at=func.greatest(Conversation.last_message_at, counts.c.last_at)
+                    )
+                )
+
+            if users or crisis_users:
+                for user_id in crisis_users:
+                    users.setdefault(user_id, (0, datetime.utcnow()))
+                user_counts = values(
+                    column("id", UUID(as_uuid=True)), column("n", Integer),
+                    column("last_at", DateTime), column("crisis", Boolean), name="user_counts"
+                ).data([
+                    (user_id, n, last_at, user_id in crisis_users)
+                    for user_id, (n, last_at) in users.items()
+                ])
+                db.execute(
+                    update(User).where(User.id == user_counts.c.id).values(
+                        total_messages=User.total_messages + user_counts.c.n,
+                        last_interaction=func.greatest(User.last_interaction, user_counts.c.last_at),
+                        crisis_flag=User.crisis_flag | user_counts.c.crisis
+                    )
+                )
+
+            db.commit()
+            return inserted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _replay(self):
+        """Re-apply spill segments left by dead processes that were never confirmed flushed."""
+        segments = []
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "spill-*.jsonl"))):
+            segment = open(path, encoding="utf-8")
+            try:
+                fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Still locked by a live worker
+                segment.close()
+                continue
+            segments.append(segment)
+
+        if not segments:
+            return
+
+        try:
+            rows, crisis_users = [], set()
+            for segment in segments:
+                for line in segment:
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line was never acknowledged
+                        continue
+                    crisis = data.pop("crisis", False)
+                    row = _decode_row(data)
+                    rows.append(row)
+                    if crisis:
+                        crisis_users.add(row["user_id"])
+
+            if rows:
+                inserted, failed = self._write_isolating(rows, crisis_users)
+                if failed:
+                    self._dead_letter(failed, crisis_users)
+                self._stats["replayed"] += inserted
+                logger.info(f"Replayed {inserted}/{len(rows)} spilled messages "
+                            f"from {len(segments)} segments")
+
+            for segment in segments:
+                os.remove(segment.name)
+        finally:
+            for segment in segments:
+                segment.close()
+
+    def stats(self) -> Dict:
+        """Return buffer counters and current backlog."""
+        with self._lock:
+            return {**self._stats, "pending": len(self._pending), "running": self.running}
+
+
+# Singleton instance
+_buffer_instance: Optional[WriteBehindBuffer] = None
+
+
+def get_write_behind() -> WriteBehindBuffer:
+    """Get or create write-behind buffer singleton instance."""
+    global _buffer_instance
+
+    if _buffer_instance is None:
+        _buffer_instance = WriteBehindBuffer()
+
+    return _buffer_instance
@@ -21,21 +21,41 @@ CREATE TABLE IF NOT EXISTS conversations (
     started_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
     last_message_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
     message_count INTEGER DEFAULT 0,
-    is_active BOOLEAN DEFAULT TRUE
+    is_active BOOLEAN DEFAULT TRUE,
+    summary TEXT,
+    summarized_message_count INTEGER DEFAULT 0,
+    summarized_through TIMESTAMP WITHOUT TIME ZONE
 );
 
--- Create messages table
+-- Create messages table, range partitioned by month (partitions.py keeps future months created)
 CREATE TABLE IF NOT EXISTS messages (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
     conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
     user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     role VARCHAR(20) NOT NULL CHECK (role IN ('user', 'assistant', 'system')),
     content TEXT NOT NULL,
-    timestamp TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
     embedding VECTOR(1536),
+    embedding_model VARCHAR(64),
     sentiment_score FLOAT,
-    contains_crisis_keywords BOOLEAN DEFAULT FALSE
-);
+    contains_crisis_keywords BOOLEAN DEFAULT FALSE,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Create partitions for the current and next three months
+DO $$
+DECLARE
+    month_start DATE := date_trunc('month', NOW());
+BEGIN
+    FOR i IN 0..3 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_' || to_char(month_start + make_interval(months => i), '"y"YYYY"m"MM'),
+            month_start + make_interval(months => i),
+            month_start + make_interval(months => i + 1)
+        );
+    END LOOP;
+END $$;
 
 -- Create knowledge_base table for PDF documents
 CREATE TABLE IF NOT EXISTS knowledge_base (
@@ -47,9 +67,42 @@ CREATE TABLE IF NOT EXISTS knowledge_base (
     created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
 );
 
+-- Create job_watermarks table for resumable batch jobs over messages
+CREATE TABLE IF NOT EXISTS job_watermarks (
+    job VARCHAR(50) PRIMARY KEY,
+    last_timestamp TIMESTAMP WITHOUT TIME ZONE,
+    last_id UUID,
+    processed INTEGER DEFAULT 0,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+);
+
+-- Create embedding_spaces table; vectors of non-legacy spaces live in
+-- message_vectors_<name> and knowledge_vectors_<name>, created by the application
+CREATE TABLE IF NOT EXISTS embedding_spaces (
+    name VARCHAR(30) PRIMARY KEY,
+    model VARCHAR(64) NOT NULL,
+    dimension INTEGER NOT NULL,
+    state VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+    activated_at TIMESTAMP WITHOUT TIME ZONE
+);
+
+-- Create knowledge_versions table; chunks carry their version and each version
+-- gets its own partial HNSW index, created by the application
+CREATE TABLE IF NOT EXISTS knowledge_versions (
+    version INTEGER PRIMARY KEY,
+    state VARCHAR(20) NOT NULL,
+    document_count INTEGER DEFAULT 0,
+    validation TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+    activated_at TIMESTAMP WITHOUT TIME ZONE
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_whatsapp ON users(whatsapp_number);
-CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id);
+-- History reads scan this in order and fetch role and content from the table; it does not
+-- INCLUDE content, since message bodies past the btree row size limit would fail to insert
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp ON messages(conversation_id, timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id);
 CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
 CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id);
@@ -0,0 +1,48 @@
+"""
+Shared pytest setup: the backend modules import each other as top-level modules.
+
+Tests that need PostgreSQL run against the scratch database named by TEST_DATABASE_URL,
+which they drop and recreate the schema of, and are skipped when it is unset.
+"""
+
+import os
+import sys
+from pathlib import Path
+import pytest
+
+BACKEND_DIRECTORY = Path(__file__).resolve().parent.parent / "backend"
+
+if str(BACKEND_DIRECTORY) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIRECTORY))
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # Set before any backend module creates its engine
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+
+@pytest.fixture
+def empty_database():
+    """Engine of the scratch database with an empty public schema and pgvector installed."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy import text
+    from database import engine
+
+    engine.dispose()
+    with engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA IF EXISTS public CASCADE"))
+        connection.execute(text("DROP SCHEMA IF EXISTS archive CASCADE"))
+        connection.execute(text("CREATE SCHEMA public"))
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def initialized_database(empty_database):
+    """Engine of the scratch database with the application schema created by init_db."""
+    from database import init_db
+
+    init_db()
+    return empty_database
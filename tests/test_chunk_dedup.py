@@ -0,0 +1,54 @@
+"""
+Tests for near-duplicate elimination of knowledge chunks.
+"""
+
+import json
+from chunk_dedup import deduplicate_chunks, redundant_slot_rate
+
+BREATHING = ("Box breathing calms the nervous system. Breathe in for four counts, hold for four counts, "
+             "breathe out for four counts and hold again for four counts. Repeat the cycle five times.")
+GROUNDING = ("The five four three two one grounding technique asks you to name five things you can see, "
+             "four you can touch, three you can hear, two you can smell and one you can taste.")
+SLEEP = ("Good sleep hygiene means keeping a regular bedtime, limiting screens in the evening, "
+         "avoiding caffeine late in the day and keeping the bedroom cool, dark and quiet.")
+
+
+def chunk(content: str, source_file: str = "book.pdf", chunk_index: int = 0, page: int = None):
+    metadata = {"page": page} if page is not None else {}
+    return {"content": content, "source_file": source_file, "chunk_index": chunk_index,
+            "doc_metadata": json.dumps(metadata)}
+
+
+def test_near_copies_collapse_into_the_longest_with_citations():
+    chunks = [
+        chunk(BREATHING, "workbook.pdf", 0, page=3),
+        chunk(GROUNDING, "workbook.pdf", 1, page=4),
+        chunk(BREATHING + " Practise it daily.", "guide.pdf", 7, page=12),
+        chunk(SLEEP, "guide.pdf", 8),
+    ]
+    kept, report = deduplicate_chunks(chunks)
+
+    assert [item["content"] for item in kept] == [GROUNDING, BREATHING + " Practise it daily.", SLEEP]
+    duplicates = json.loads(kept[1]["doc_metadata"])["duplicates"]
+    assert duplicates == [{"source_file": "workbook.pdf", "chunk_index": 0, "page": 3}]
+    assert json.loads(kept[1]["doc_metadata"])["page"] == 12
+    assert "duplicates" not in json.loads(kept[0]["doc_metadata"])
+
+    assert report["chunks"] == 4
+    assert report["kept"] == 3
+    assert report["removed"] == 1
+    assert report["cross_source_groups"] == 1
+    assert report["removed_chars"] == len(BREATHING)
+
+
+def test_distinct_chunks_are_all_kept():
+    chunks = [chunk(text, chunk_index=i) for i, text in enumerate((BREATHING, GROUNDING, SLEEP))]
+    kept, report = deduplicate_chunks(chunks)
+    assert kept == chunks
+    assert report["removed"] == 0
+    assert deduplicate_chunks([])[1]["reduction"] == 0.0
+
+
+def test_redundant_slot_rate_counts_repeats_of_higher_results():
+    assert redundant_slot_rate([BREATHING, GROUNDING, BREATHING, SLEEP]) == 0.25
+    assert redundant_slot_rate([BREATHING]) == 0.0
@@ -0,0 +1,78 @@
+"""
+Tests for the embedded SQLite + NumPy storage backend.
+"""
+
+import asyncio
+import sqlite3
+import uuid
+import numpy as np
+import pytest
+import embedded_storage
+from embedded_storage import EmbeddedStorage
+from embedding_space_types import EmbeddingSpace, legacy_space
+
+DIM = 8
+
+
+def open_storage(path) -> EmbeddedStorage:
+    storage = EmbeddedStorage(data_dir=str(path), dim=DIM)
+    storage.init()
+    return storage
+
+
+def documents(count: int):
+    return [
+        {"source_file": "book.pdf", "chunk_index": i, "content": f"chunk {i}", "embedding": np.eye(DIM)[i % DIM]}
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def legacy_only(monkeypatch):
+    """Registered spaces, as (active, written), that the backend checks at startup."""
+    spaces = {"snapshot": (legacy_space()._replace(dimension=DIM), [legacy_space()._replace(dimension=DIM)])}
+    monkeypatch.setattr(embedded_storage, "embedding_space_snapshot", lambda: spaces["snapshot"])
+    return spaces
+
+
+def test_vector_count_survives_restart(tmp_path, legacy_only):
+    storage = open_storage(tmp_path)
+    storage.add_knowledge_documents(documents(3))
+    asyncio.run(storage.close())
+
+    reopened = open_storage(tmp_path)
+    assert reopened.vectors["knowledge"].count == 3
+    assert [row.content for row in asyncio.run(reopened.search_knowledge(None, np.eye(DIM)[1], k=1))] == ["chunk 1"]
+    asyncio.run(reopened.close())
+
+
+def test_failed_commit_leaves_vector_count_unchanged(tmp_path, legacy_only):
+    storage = open_storage(tmp_path)
+    storage.add_knowledge_documents(documents(2))
+    # A deferred foreign key violation makes COMMIT itself fail
+    storage.db.execute("PRAGMA foreign_keys = ON")
+    storage.db.execute("CREATE TABLE parents (id INTEGER PRIMARY KEY)")
+    storage.db.execute("CREATE TABLE children (parent_id INTEGER REFERENCES parents (id) DEFERRABLE INITIALLY DEFERRED)")
+    storage.db.execute("CREATE TRIGGER orphan AFTER INSERT ON knowledge_documents "
+                       "WHEN NEW.chunk_index = 99 BEGIN INSERT INTO children VALUES (1); END")
+
+    with pytest.raises(sqlite3.IntegrityError):
+        storage.add_knowledge_documents([{**documents(1)[0], "chunk_index": 99}])
+    assert storage.vectors["knowledge"].count == 2
+
+    storage.add_knowledge_documents(documents(1))
+    assert storage.vectors["knowledge"].count == 3
+    asyncio.run(storage.close())
+
+
+def test_refuses_to_start_with_another_space(tmp_path, legacy_only):
+    small = EmbeddingSpace("small", "text-embedding-3-small", DIM, "active")
+    legacy_only["snapshot"] = (small, [legacy_space("shadow")._replace(dimension=DIM), small])
+    with pytest.raises(RuntimeError, match="small"):
+        open_storage(tmp_path)
+
+
+def test_refuses_mismatched_dimension(tmp_path, legacy_only):
+    legacy_only["snapshot"] = (legacy_space(), [legacy_space()])
+    with pytest.raises(RuntimeError, match="dimensions"):
+        EmbeddedStorage(data_dir=str(tmp_path / str(uuid.uuid4())), dim=DIM).init()
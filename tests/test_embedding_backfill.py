@@ -0,0 +1,54 @@
+"""
+Tests for the legacy-space embedding backfill and the model it embeds with.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import embedding_backfill
+from embedding_backfill import EmbeddingBackfill
+from embedding_spaces import SpaceRegistry, LEGACY_SPACE
+
+DIM = 1536
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.texts = []
+
+    def embed(self, texts, dimension, subject=None, request_size=None):
+        self.texts.extend(texts)
+        return [[0.5] * dimension for _ in texts]
+
+
+def add_message(connection, content: str, embedding=None, model=None):
+    connection.execute(text(
+        "INSERT INTO messages (id, conversation_id, user_id, role, content, timestamp, embedding, embedding_model) "
+        "VALUES (:id, :id, :id, 'user', :content, :timestamp, CAST(:embedding AS vector), :model)"
+    ), {"id": uuid.uuid4(), "content": content, "timestamp": datetime.utcnow() - timedelta(hours=1),
+        "embedding": str(embedding) if embedding else None, "model": model})
+
+
+def test_legacy_model_comes_from_the_registry(initialized_database):
+    with initialized_database.begin() as connection:
+        connection.execute(text("UPDATE embedding_spaces SET model = 'text-embedding-3-small' WHERE name = 'legacy'"))
+    registry = SpaceRegistry(enabled=True)
+    assert registry.active().model == "text-embedding-3-small"
+
+
+def test_legacy_backfill_only_fills_missing_vectors(initialized_database, monkeypatch):
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(embedding_backfill, "get_embedding_scheduler", lambda model, client: scheduler)
+    with initialized_database.begin() as connection:
+        add_message(connection, "old model", [0.1] * DIM, "text-embedding-ada-002")
+        add_message(connection, "untagged", [0.1] * DIM)
+        add_message(connection, "missing")
+
+    space = SpaceRegistry(enabled=True).get(LEGACY_SPACE)
+    backfill = EmbeddingBackfill(client=None, space=space._replace(model="text-embedding-3-large"))
+    assert backfill.run_cycle() == 1
+    assert scheduler.texts == ["missing"]
+
+    with initialized_database.connect() as connection:
+        rows = dict(connection.execute(text("SELECT content, embedding_model FROM messages")).all())
+    assert rows == {"old model": "text-embedding-ada-002", "untagged": None, "missing": "text-embedding-3-large"}
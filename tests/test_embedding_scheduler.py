@@ -0,0 +1,150 @@
+"""
+Tests for embedding request scheduling: packing, ordering, 429 handling and retries.
+"""
+
+import base64
+import json
+import random
+import array
+import httpx
+import pytest
+from openai import OpenAI, InternalServerError, BadRequestError
+from embedding_scheduler import EmbeddingScheduler
+from rate_limiter import RateLimiter, InMemoryBucketStore
+
+MODEL = "text-embedding-ada-002"
+
+
+class FakeProvider:
+    """Embeddings endpoint answering each request with the next scripted status, then 200."""
+
+    def __init__(self, statuses=(), headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body["input"])
+        if self.statuses:
+            status, headers = self.statuses.pop(0)
+            return httpx.Response(status, headers=headers, json={"error": {"message": "scripted", "type": "test"}})
+
+        # Each vector encodes its text's length; returned out of order as the API may do
+        data = []
+        for index, text in enumerate(body["input"]):
+            vector = [float(len(text)), float(index)]
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(array.array("f", vector).tobytes()).decode()
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(text.split()) for text in body["input"])
+        return httpx.Response(200, headers=self.headers, json={
+            "object": "list", "data": list(reversed(data)), "model": MODEL,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+
+def make_scheduler(provider: FakeProvider, **settings) -> EmbeddingScheduler:
+    client = OpenAI(api_key="test", base_url="http://provider.test/v1",
+                    http_client=httpx.Client(transport=httpx.MockTransport(provider)))
+    scheduler = EmbeddingScheduler(client, MODEL, **settings)
+    scheduler._count_tokens = lambda texts: [len(text.split()) for text in texts]
+    return scheduler
+
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(random, "uniform", lambda low, high: 0.0)
+
+
+def test_packs_requests_and_keeps_input_order():
+    provider = FakeProvider()
+    scheduler = make_scheduler(provider, request_size=2)
+    texts = ["a", "bb", "ccc", "dddd", ""]
+
+    vectors = scheduler.embed(texts, 1536)
+    assert [vector[0] for vector in vectors] == [1.0, 2.0, 3.0, 4.0, 1.0]  # Blank text is sent as " "
+    assert sorted(provider.requests) == [[" "], ["a", "bb"], ["ccc", "dddd"]]
+
+    stats = scheduler.stats()
+    assert stats["requests"] == 3
+    assert stats["texts"] == 5
+    assert stats["in_flight"] == 0
+
+
+def test_token_cap_splits_requests():
+    provider = FakeProvider()
+    scheduler = make_scheduler(provider, request_size=100, request_max_tokens=4)
+    scheduler.embed(["one two", "three four", "five"], 1536)
+    assert sorted(provider.requests) == [["five"], ["one two", "three four"]]
+
+
+def test_rate_limited_request_is_retried_and_halves_concurrency():
+    provider = FakeProvider(statuses=[(429, {"retry-after-ms": "10"})])
+    scheduler = make_scheduler(provider, max_concurrency=8)
+    concurrency = scheduler.stats()["concurrency"]
+
+    vectors = scheduler.embed(["hello"], 1536)
+    assert vectors == [[5.0, 0.0]]
+    assert len(provider.requests) == 2
+
+    stats = scheduler.stats()
+    assert stats["rate_limited"] == 1
+    assert stats["retries"] == 1
+    # Halved by the 429, then one additive step back up after the success
+    assert stats["concurrency"] == pytest.approx(concurrency / 2 + 1 / (concurrency / 2))
+
+
+def test_reported_limits_are_adopted():
+    provider = FakeProvider(headers={"x-ratelimit-limit-requests": "500", "x-ratelimit-limit-tokens": "20000"})
+    scheduler = make_scheduler(provider)
+    scheduler.embed(["hello"], 1536)
+    assert scheduler.requests_per_minute == 500
+    assert scheduler.tokens_per_minute == 20000
+
+
+def test_gives_up_after_max_retries():
+    provider = FakeProvider(statuses=[(500, {})] * 3)
+    scheduler = make_scheduler(provider, max_retries=2)
+
+    with pytest.raises(InternalServerError):
+        scheduler.embed(["hello"], 1536)
+    assert len(provider.requests) == 3
+    stats = scheduler.stats()
+    assert stats["failures"] == 1
+    assert stats["retries"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_client_errors_are_not_retried():
+    provider = FakeProvider(statuses=[(400, {})])
+    scheduler = make_scheduler(provider)
+
+    with pytest.raises(BadRequestError):
+        scheduler.embed(["hello"], 1536)
+    assert len(provider.requests) == 1
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_bulk_embedding_does_not_spend_the_chat_budget():
+    provider = FakeProvider()
+    scheduler = make_scheduler(provider, request_max_tokens=1000)
+    scheduler.limiter = RateLimiter(InMemoryBucketStore(), enabled=True)
+    scheduler.limiter.global_tokens = (10, 10 / 60)
+
+    scheduler.embed(["word " * 500], 1536)
+    assert scheduler.limiter.store.acquire("global_tokens", 10, 10 / 60, 0, 10)
+
+
+def test_shared_chat_budget_caps_requests_and_rejects_oversized_texts():
+    provider = FakeProvider()
+    scheduler = make_scheduler(provider, request_size=100, share_chat_budget=True)
+    scheduler.limiter = RateLimiter(InMemoryBucketStore(), enabled=True)
+    scheduler.limiter.global_tokens = (8, 100.0)  # Half is reserved, so 4 tokens per request
+
+    scheduler.embed(["one two", "three four", "five"], 1536)
+    assert sorted(provider.requests) == [["five"], ["one two", "three four"]]
+
+    with pytest.raises(ValueError):
+        scheduler.embed(["one two three four five"], 1536)
+    assert len(provider.requests) == 2
@@ -0,0 +1,40 @@
+"""
+Tests for the embedding space registry cache.
+"""
+
+import asyncio
+import threading
+from sqlalchemy import text
+import embedding_spaces
+from embedding_spaces import SpaceRegistry, LEGACY_SPACE
+
+
+def test_refresh_loop_keeps_queries_off_the_request_path(initialized_database, monkeypatch):
+    registry = SpaceRegistry(ttl=0.05, enabled=True)
+    query_threads = []
+    session_factory = embedding_spaces.SessionLocal
+
+    def recording_session():
+        query_threads.append(threading.current_thread())
+        return session_factory()
+
+    monkeypatch.setattr(embedding_spaces, "SessionLocal", recording_session)
+
+    async def serve():
+        refresh = asyncio.create_task(registry.run_refresh_loop())
+        await asyncio.sleep(0.1)
+        assert registry.snapshot()[0].name == LEGACY_SPACE
+
+        with initialized_database.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO embedding_spaces (name, model, dimension, state) "
+                "VALUES ('small', 'text-embedding-3-small', 512, 'shadow')"
+            ))
+        await asyncio.sleep(0.2)
+        written = [space.name for space in registry.snapshot()[1]]
+        refresh.cancel()
+        return written
+
+    assert sorted(asyncio.run(serve())) == [LEGACY_SPACE, "small"]
+    assert query_threads
+    assert threading.main_thread() not in query_threads
@@ -0,0 +1,106 @@
+"""
+Tests for blue/green knowledge versions.
+"""
+
+import asyncio
+import threading
+import uuid
+import numpy as np
+from sqlalchemy import text, event
+import embedding_spaces
+import knowledge_versions
+from knowledge_versions import KnowledgeVersionRegistry
+
+DIMENSION = 8
+
+
+def test_refresh_loop_keeps_queries_off_the_request_path(initialized_database, monkeypatch):
+    registry = KnowledgeVersionRegistry(ttl=0.05, enabled=True)
+    query_threads = []
+    session_factory = knowledge_versions.SessionLocal
+
+    def recording_session():
+        query_threads.append(threading.current_thread())
+        return session_factory()
+
+    monkeypatch.setattr(knowledge_versions, "SessionLocal", recording_session)
+
+    async def serve():
+        refresh = asyncio.create_task(registry.run_refresh_loop())
+        await asyncio.sleep(0.1)
+        assert registry.active_version() == 1
+
+        # Another process switches versions
+        with initialized_database.begin() as connection:
+            connection.execute(text("UPDATE knowledge_versions SET state = 'inactive'"))
+            connection.execute(text("INSERT INTO knowledge_versions (version, state, document_count) "
+                                    "VALUES (2, 'active', 0)"))
+        await asyncio.sleep(0.2)
+        active = registry.active_version()
+        refresh.cancel()
+        return active
+
+    assert asyncio.run(serve()) == 2
+    assert query_threads
+    assert threading.main_thread() not in query_threads
+
+
+def test_search_and_recall_stay_within_a_version_beside_larger_ones(initialized_database, monkeypatch):
+    engine = initialized_database
+    monkeypatch.setattr(embedding_spaces, "_registry_instance", None)
+    monkeypatch.setattr(knowledge_versions, "_registry_instance", None)
+    spaces = embedding_spaces.get_space_registry()
+    versions = knowledge_versions.get_knowledge_versions()
+    space = spaces.create("small", "text-embedding-3-small", DIMENSION)
+
+    # Version 2 is served; the kept version 1 holds many near copies of its vectors
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(30, DIMENSION))
+    documents = [(2, vector) for vector in vectors]
+    documents += [(1, vector + rng.normal(scale=0.001, size=DIMENSION)) for vector in vectors for _ in range(50)]
+    rows = [{"id": uuid.uuid4(), "version": version, "embedding": vector.tolist()} for version, vector in documents]
+    with engine.begin() as connection:
+        for i, row in enumerate(rows):
+            connection.execute(text(
+                "INSERT INTO knowledge_documents (id, source_file, chunk_index, content, version) "
+                "VALUES (:id, 'book.pdf', :i, 'chunk', :version)"
+            ), {"id": row["id"], "i": i, "version": row["version"]})
+        for statement in embedding_spaces.knowledge_vector_inserts(
+            [(row["id"], row["version"], {"small": row["embedding"]}) for row in rows]
+        ):
+            connection.execute(statement)
+        connection.execute(text("UPDATE knowledge_versions SET state = 'inactive', activated_at = now()"))
+        connection.execute(text("INSERT INTO knowledge_versions (version, state, document_count, activated_at) "
+                                "VALUES (2, 'active', 30, now())"))
+        connection.execute(text("UPDATE embedding_spaces SET state = CASE name WHEN 'small' THEN 'active' "
+                                "ELSE 'retired' END"))
+    spaces._refresh(force=True)
+    versions._refresh(force=True)
+    versions.create_indexes()
+
+    # Make the planner rank through the ANN indexes, as it does on real table sizes
+    def no_seqscan(connection, _):
+        connection.cursor().execute("SET enable_seqscan = off; SET enable_sort = off")
+
+    engine.dispose()
+    event.listen(engine, "connect", no_seqscan)
+    try:
+        with engine.connect() as connection:
+            plan = "\n".join(connection.execute(text(
+                "EXPLAIN " + str(embedding_spaces.knowledge_neighbors_query(space, vectors[0].tolist(), 5, 2)
+                                 .compile(engine, compile_kwargs={"literal_binds": True}))
+            )).scalars())
+            assert embedding_spaces.knowledge_index_name(space, 2) in plan
+            for vector in vectors[:5]:
+                neighbors = connection.execute(
+                    embedding_spaces.knowledge_neighbors_query(space, vector.tolist(), 5, 2)
+                ).scalars().all()
+                assert len(neighbors) == 5
+
+        validation = versions.validate(2, samples=30)
+        assert validation["space"] == "small"
+        assert validation["recall_at_5"] == 1.0
+        assert validation["failures"] == []
+    finally:
+        event.remove(engine, "connect", no_seqscan)
+        engine.dispose()
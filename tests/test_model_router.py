@@ -0,0 +1,60 @@
+"""
+Tests for per-turn model routing.
+"""
+
+from model_router import ModelRouter, LONG_MESSAGE_CHARS, LONG_HISTORY_CHARS, STRONG_RETRIEVAL_SIMILARITY
+
+
+def make_router(enabled: bool = True) -> ModelRouter:
+    return ModelRouter(small_model="small", large_model="large", enabled=enabled)
+
+
+def test_simple_turn_uses_small_model():
+    decision = make_router().route("thanks, that helps")
+    assert decision == {"model": "small", "tier": "small", "reasons": []}
+
+
+def test_long_message_escalates():
+    decision = make_router().route("a" * LONG_MESSAGE_CHARS)
+    assert decision["model"] == "large"
+    assert decision["reasons"] == ["long_message"]
+
+
+def test_long_history_escalates():
+    history = [{"role": "user", "content": "x" * (LONG_HISTORY_CHARS // 2)}] * 2
+    decision = make_router().route("ok", conversation_history=history)
+    assert decision["tier"] == "large"
+    assert "long_history" in decision["reasons"]
+
+
+def test_strong_retrieval_match_escalates_only_above_threshold():
+    router = make_router()
+    assert router.route("ok", retrieval_scores=[STRONG_RETRIEVAL_SIMILARITY - 0.01])["tier"] == "small"
+    assert router.route("ok", retrieval_scores=[0.1, STRONG_RETRIEVAL_SIMILARITY])["reasons"] == ["strong_knowledge_match"]
+
+
+def test_emotional_keywords_and_crisis_flag_escalate():
+    router = make_router()
+    decision = router.route("I feel so anxious and lonely")
+    assert decision["tier"] == "large"
+    assert decision["reasons"] == ["emotional:anxious,lonely"]
+    assert router.route("ok", crisis_flag=True)["reasons"] == ["crisis_history"]
+
+
+def test_keywords_match_whole_words_only():
+    router = make_router()
+    assert router.emotional_signals("Is there a standalone app? My shameless plug: it's emptying fast") == []
+    assert router.emotional_signals("I can\u2019t  cope and feel ALONE") == ["alone", "can't cope"]
+
+
+def test_disabled_routing_always_uses_large_model():
+    decision = make_router(enabled=False).route("hi")
+    assert decision["model"] == "large"
+    assert decision["reasons"] == ["routing_disabled"]
+
+
+def test_decisions_are_counted():
+    router = make_router()
+    router.route("hi")
+    router.route("I am overwhelmed")
+    assert router.latency_summary()["decisions"] == {"small": 1, "large": 1}
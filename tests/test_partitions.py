@@ -0,0 +1,125 @@
+"""
+Tests for converting a pre-partitioning messages table online and archiving old partitions.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from partitions import (
+    migrate_to_partitioned, archive_old_partitions, create_partition, partition_name, month_start, add_months,
+    LEGACY_TABLE
+)
+
+# The messages table as deployments created it before partitioning and the columns added since
+BASELINE_MESSAGES_DDL = """
+CREATE TABLE messages (
+    id UUID PRIMARY KEY,
+    conversation_id UUID NOT NULL,
+    user_id UUID NOT NULL,
+    role VARCHAR(20) NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMP,
+    embedding VECTOR(1536),
+    sentiment_score FLOAT,
+    contains_crisis_keywords BOOLEAN
+)
+"""
+
+ROWS = 5
+
+
+def create_baseline(engine):
+    from database import Base, User, Conversation, KnowledgeDocument
+
+    conversation_id, user_id = uuid.uuid4(), uuid.uuid4()
+    Base.metadata.create_all(engine, tables=[User.__table__, Conversation.__table__, KnowledgeDocument.__table__])
+    with engine.begin() as connection:
+        connection.execute(text(BASELINE_MESSAGES_DDL))
+        connection.execute(text("CREATE INDEX idx_messages_conversation ON messages (conversation_id)"))
+        connection.execute(text("CREATE INDEX idx_messages_timestamp ON messages (timestamp)"))
+        for i in range(ROWS):
+            connection.execute(text(
+                "INSERT INTO messages (id, conversation_id, user_id, role, content, timestamp) "
+                "VALUES (:id, :conversation_id, :user_id, 'user', :content, :timestamp)"
+            ), {
+                "id": uuid.uuid4(), "conversation_id": conversation_id, "user_id": user_id,
+                "content": f"baseline {i}", "timestamp": datetime.utcnow() - timedelta(days=40 * i)
+            })
+    return conversation_id, user_id
+
+
+def scalar(engine, sql: str):
+    with engine.connect() as connection:
+        return connection.execute(text(sql)).scalar()
+
+
+def assert_migrated(engine, conversation_id, user_id):
+    assert scalar(engine, "SELECT relkind FROM pg_class WHERE oid = 'messages'::regclass") == "p"
+    assert scalar(engine, f"SELECT count(*) FROM {LEGACY_TABLE}") == ROWS
+    assert scalar(engine, "SELECT count(*) FROM messages") == ROWS
+
+    # New rows land in the monthly partitions and use the added columns
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO messages (id, conversation_id, user_id, role, content, timestamp, embedding_model) "
+            "VALUES (:id, :conversation_id, :user_id, 'assistant', 'after', :timestamp, 'model')"
+        ), {"id": uuid.uuid4(), "conversation_id": conversation_id, "user_id": user_id,
+            "timestamp": datetime.utcnow() + timedelta(days=40)})
+    assert scalar(engine, "SELECT count(*) FROM messages") == ROWS + 1
+    assert scalar(engine, f"SELECT count(*) FROM {LEGACY_TABLE}") == ROWS
+
+    # The row counter moved to the parent and saw the insert
+    triggers = scalar(engine, "SELECT count(*) FROM pg_trigger WHERE tgrelid = 'messages'::regclass "
+                              "AND tgname LIKE 'messages_count_%'")
+    assert triggers == 3
+    counted = scalar(engine, "SELECT sum(delta) FROM table_row_counts WHERE table_name = 'messages'")
+    assert counted == ROWS + 1
+
+
+def test_migrates_baseline_table(empty_database):
+    conversation_id, user_id = create_baseline(empty_database)
+    migrate_to_partitioned()
+    assert_migrated(empty_database, conversation_id, user_id)
+
+
+def test_migrates_after_init_db(empty_database):
+    from database import init_db
+
+    conversation_id, user_id = create_baseline(empty_database)
+    init_db()  # Adds the later columns and the row counter triggers to the old table
+    assert scalar(empty_database, "SELECT count(*) FROM pg_trigger WHERE tgname = 'messages_count_delete'") == 1
+
+    migrate_to_partitioned()
+    assert_migrated(empty_database, conversation_id, user_id)
+
+
+def test_interrupted_detach_is_finalized(initialized_database):
+    engine = initialized_database
+    month = add_months(month_start(datetime.utcnow()), -6)
+    name = partition_name(month)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        create_partition(connection, month)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO messages (id, conversation_id, user_id, role, content, timestamp) "
+            "VALUES (:id, :id, :id, 'user', 'old', :timestamp)"
+        ), {"id": uuid.uuid4(), "timestamp": month + timedelta(days=3)})
+    counted = scalar(engine, "SELECT sum(delta) FROM table_row_counts WHERE table_name = 'messages'")
+
+    # A reader holding its snapshot makes the detach's second transaction wait until it times out
+    with engine.connect() as reader:
+        reader.execute(text("SELECT count(*) FROM messages"))
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("SET lock_timeout = '200ms'"))
+            with pytest.raises(OperationalError):
+                connection.execute(text(f"ALTER TABLE messages DETACH PARTITION {name} CONCURRENTLY"))
+        reader.rollback()
+    assert scalar(engine, f"SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = '{name}'::regclass")
+
+    # Finalized on the next run even though retention keeps everything
+    assert archive_old_partitions(retention_months=0) == [name]
+    assert scalar(engine, f"SELECT count(*) FROM archive.{name}") == 1
+    assert scalar(engine, f"SELECT to_regclass('{name}')") is None
+    assert scalar(engine, "SELECT sum(delta) FROM table_row_counts WHERE table_name = 'messages'") == counted - 1
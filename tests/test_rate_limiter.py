@@ -0,0 +1,134 @@
+"""
+Tests for token-bucket rate limiting and usage accounting.
+"""
+
+import time
+import pytest
+from rate_limiter import RateLimiter, InMemoryBucketStore, FailoverBucketStore
+
+NUMBER = "whatsapp:+15550000001"
+
+
+@pytest.fixture
+def frozen_clock(monkeypatch):
+    """Stop bucket refills so balances only change through debits."""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_limiter(user_requests: float = 2, global_requests: float = 100) -> RateLimiter:
+    limiter = RateLimiter(InMemoryBucketStore(), enabled=True)
+    limiter.user_requests = (user_requests, user_requests / 60)
+    limiter.user_tokens = (1000, 1000 / 3600)
+    limiter.global_requests = (global_requests, global_requests / 60)
+    limiter.global_tokens = (10000, 10000 / 60)
+    return limiter
+
+
+def test_bucket_refuses_below_minimum_and_refills(frozen_clock):
+    store = InMemoryBucketStore()
+    assert store.acquire("key", 2, 1.0, 1, 1)
+    assert store.acquire("key", 2, 1.0, 1, 1)
+    assert not store.acquire("key", 2, 1.0, 1, 1)
+
+    frozen_clock[0] += 1.0
+    assert store.acquire("key", 2, 1.0, 1, 1)
+
+
+def test_user_request_limit(frozen_clock):
+    limiter = make_limiter(user_requests=2)
+    assert limiter.check(NUMBER) is None
+    assert limiter.check(NUMBER) is None
+    assert limiter.check(NUMBER) == "user_requests"
+    # Other users keep their own budget
+    assert limiter.check("whatsapp:+15550000002") is None
+
+
+def test_rejection_by_a_later_bucket_refunds_earlier_debits(frozen_clock):
+    limiter = make_limiter(user_requests=5, global_requests=1)
+    assert limiter.check("whatsapp:+15550000002") is None
+    # The global bucket is now empty; the user's request slot must not be spent
+    for _ in range(10):
+        assert limiter.check(NUMBER) == "global_requests"
+
+    limiter.global_requests = (100, 100 / 60)
+    limiter.store._buckets.pop("global_requests")
+    for _ in range(5):
+        assert limiter.check(NUMBER) is None
+    assert limiter.check(NUMBER) == "user_requests"
+
+
+def test_token_budget_is_debited_after_calls(frozen_clock):
+    limiter = make_limiter()
+    limiter.record_usage(NUMBER, prompt_tokens=700, completion_tokens=299)
+    assert limiter.check(NUMBER) is None
+    limiter.record_usage(NUMBER, embedding_tokens=5)
+    assert limiter.check(NUMBER) == "user_tokens"
+
+    usage = limiter.usage_report(NUMBER)["usage"]
+    assert usage["prompt_tokens"] == 700
+    assert usage["embedding_tokens"] == 5
+    assert usage["rejected"] == 1
+
+
+def test_background_calls_leave_the_reserve(frozen_clock):
+    limiter = make_limiter(global_requests=10)
+    admitted = sum(limiter.acquire_background(1, reserve=0.5) for _ in range(10))
+    assert admitted == 5
+    # Live traffic still has the reserved half
+    assert limiter.check(NUMBER) is None
+
+
+def test_usage_subjects_are_bounded(frozen_clock, monkeypatch):
+    monkeypatch.setattr(InMemoryBucketStore, "MAX_USAGE_SUBJECTS", 3)
+    store = InMemoryBucketStore()
+    store.add_usage("global", "requests", 1)
+    for i in range(5):
+        store.add_usage(f"user{i}", "requests", 1)
+
+    assert len(store._usage) == 3
+    assert "global" in store._usage
+    assert list(store.top_usage(10)) == ["user3", "user4"]
+
+
+def test_background_call_larger_than_the_spare_budget_is_refused(frozen_clock):
+    limiter = make_limiter()
+    assert limiter.background_token_capacity(reserve=0.5) == 5000
+    assert limiter.acquire_background(5000, reserve=0.5)
+    with pytest.raises(ValueError):
+        limiter.acquire_background(5001, reserve=0.5)
+
+
+class UnreachableStore:
+    """Shared store whose every call fails until it is brought back."""
+
+    def __init__(self):
+        self.down = True
+        self.calls = 0
+        self.memory = InMemoryBucketStore()
+
+    def __getattr__(self, method):
+        def call(*args):
+            self.calls += 1
+            if self.down:
+                raise ConnectionError("connection refused")
+            return getattr(self.memory, method)(*args)
+        return call
+
+
+def test_unreachable_shared_store_fails_open(frozen_clock):
+    shared = UnreachableStore()
+    limiter = make_limiter()
+    limiter.store = FailoverBucketStore(shared)
+
+    assert limiter.check(NUMBER) is None
+    assert limiter.check(NUMBER) is None
+    assert limiter.check(NUMBER) == "user_requests"  # Still limited, by in-process buckets
+    assert shared.calls == 1  # Not retried on every call during the outage
+    assert limiter.store.get_usage(NUMBER)["requests"] == 2
+
+    shared.down = False
+    frozen_clock[0] += FailoverBucketStore.RETRY_SECONDS
+    assert limiter.check(NUMBER) is None
+    assert shared.memory.get_usage(NUMBER)["requests"] == 1
@@ -0,0 +1,68 @@
+"""
+Tests for retrieval gating: the acknowledgement pre-check, similarity floors and drop-off cuts.
+"""
+
+import pytest
+import retrieval_gate
+from retrieval_gate import RetrievalGate
+
+ADA = "text-embedding-ada-002"
+SMALL = "text-embedding-3-small"
+
+
+@pytest.fixture(autouse=True)
+def model_floors(monkeypatch):
+    monkeypatch.setattr(retrieval_gate, "RETRIEVAL_MIN_SIMILARITY", None)
+
+
+def scored(*similarities):
+    return [{"content": f"chunk {similarity}", "similarity": similarity} for similarity in similarities]
+
+
+def similarities(results):
+    return [result["similarity"] for result in results]
+
+
+def test_floor_follows_the_model():
+    gate = RetrievalGate(enabled=True)
+    assert similarities(gate.select(scored(0.86, 0.84, 0.82, 0.70), ADA)) == [0.86, 0.84, 0.82]
+    assert similarities(gate.select(scored(0.36, 0.34, 0.32, 0.20), SMALL)) == [0.36, 0.34, 0.32]
+    assert gate.select(scored(0.74, 0.72), ADA) == []
+    assert gate.stats()["below_floor"] == 4
+
+
+def test_configured_floor_overrides_the_model(monkeypatch):
+    monkeypatch.setattr(retrieval_gate, "RETRIEVAL_MIN_SIMILARITY", "0.5")
+    gate = RetrievalGate(enabled=True, drop_off=1.0)
+    assert similarities(gate.select(scored(0.9, 0.55, 0.45), ADA)) == [0.9, 0.55]
+
+
+def test_sharp_drop_off_cuts_the_list():
+    gate = RetrievalGate(enabled=True, min_k=1, drop_off=0.4)
+    # Margin over the 0.3 floor is 0.32, so a fall of more than 0.128 ends the list
+    results = gate.select(scored(0.35, 0.62, 0.34, 0.60), SMALL)
+    assert similarities(results) == [0.62, 0.60]
+    stats = gate.stats()
+    assert stats["after_drop_off"] == 2
+    assert stats["kept"] == 2
+    assert stats["average_k"] == 2.0
+
+
+def test_min_k_is_kept_through_a_drop_off():
+    gate = RetrievalGate(enabled=True, min_k=2, drop_off=0.4)
+    assert similarities(gate.select(scored(0.7, 0.4, 0.39), SMALL)) == [0.7, 0.4, 0.39]
+    assert similarities(RetrievalGate(enabled=True, min_k=1).select(scored(0.7, 0.4, 0.39), SMALL)) == [0.7]
+
+
+def test_disabled_gate_passes_results_through():
+    results = scored(0.1, 0.9)
+    assert RetrievalGate(enabled=False).select(results, ADA) == results
+
+
+def test_acknowledgements_skip_retrieval():
+    gate = RetrievalGate(enabled=True)
+    assert gate.needs_retrieval("Yeah, thanks so much!") == (False, "acknowledgement")
+    assert gate.needs_retrieval("🙂") == (False, "no_words")
+    assert gate.needs_retrieval("I can't sleep and my chest feels tight") == (True, "content")
+    assert gate.stats()["skip_rate"] == round(2 / 3, 4)
+    assert RetrievalGate(enabled=False).needs_retrieval("ok") == (True, "gating_disabled")
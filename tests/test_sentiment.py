@@ -0,0 +1,96 @@
+"""
+Tests for the vectorized lexicon sentiment scorer and the watermarked scoring job.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from sentiment import LexiconSentimentScorer, SentimentJob, LEXICON, NEGATIONS, SENTIMENT_JOB
+
+
+def score(*texts):
+    return LexiconSentimentScorer().score(list(texts)).tolist()
+
+
+def test_negations_are_not_scored_as_words():
+    assert not LEXICON.keys() & NEGATIONS
+    # "cant" only flips what follows it
+    assert score("cant sleep") == [0.0]
+    assert score("I cant be happy")[0] < 0
+
+
+def test_valence_sign_and_range():
+    positive, negative, neutral = score("I feel great today", "I feel awful and hopeless", "I went to the shop")
+    assert 0 < positive < 1
+    assert -1 < negative < 0
+    assert neutral == 0.0
+
+
+def test_modifiers_negations_and_exclamations():
+    plain, boosted, negated, exclaimed = score("I am happy", "I am very happy", "I am not happy", "I am happy!!")
+    assert boosted > plain
+    assert negated < 0
+    assert exclaimed > plain
+
+
+def test_messages_do_not_affect_each_other():
+    # A negation or modifier at the end of one message must not reach into the next
+    together = score("I am not", "happy", "so", "sad")
+    assert together == score("I am not") + score("happy") + score("so") + score("sad")
+    assert score("", "good") == [0.0, score("good")[0]]
+
+
+def add_message(engine, conversation_id, user_id, content, timestamp, role="user"):
+    message_id = uuid.uuid4()
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO messages (id, conversation_id, user_id, role, content, timestamp) "
+            "VALUES (:id, :conversation_id, :user_id, :role, :content, :timestamp)"
+        ), {"id": message_id, "conversation_id": conversation_id, "user_id": user_id, "role": role,
+            "content": content, "timestamp": timestamp})
+    return message_id
+
+
+def sentiment_scores(engine):
+    with engine.connect() as connection:
+        return dict(connection.execute(text("SELECT content, sentiment_score FROM messages")).all())
+
+
+def test_job_scores_settled_user_messages_behind_its_watermark(initialized_database):
+    from database import SessionLocal, JobWatermark
+
+    engine = initialized_database
+    conversation_id, user_id = uuid.uuid4(), uuid.uuid4()
+    settled = datetime.utcnow() - timedelta(minutes=30)
+    for i in range(3):
+        add_message(engine, conversation_id, user_id, f"good {i}", settled + timedelta(seconds=i))
+    add_message(engine, conversation_id, user_id, "great reply", settled, role="assistant")
+    add_message(engine, conversation_id, user_id, "happy now", datetime.utcnow())
+
+    job = SentimentJob(LexiconSentimentScorer(), batch_size=2, settle_seconds=120)
+    db = SessionLocal()
+    try:
+        assert job.run_once(db) == 2
+        assert job.run_once(db) == 1
+        assert job.run_once(db) == 0
+        watermark = db.get(JobWatermark, SENTIMENT_JOB)
+        assert watermark.processed == 3
+        assert watermark.last_timestamp == settled + timedelta(seconds=2)
+    finally:
+        db.close()
+
+    scores = sentiment_scores(engine)
+    assert scores["good 0"] == pytest.approx(score("good 0")[0])
+    assert scores["good 2"] is not None
+    # Assistant messages are never scored; unsettled ones wait for a later cycle
+    assert scores["great reply"] is None
+    assert scores["happy now"] is None
+
+    # A message committed late behind the watermark is not revisited
+    add_message(engine, conversation_id, user_id, "good late", settled - timedelta(seconds=1))
+    db = SessionLocal()
+    try:
+        assert job.run_once(db) == 0
+    finally:
+        db.close()
@@ -0,0 +1,95 @@
+"""
+Tests for the split between the rolling summary and the prompt's history window,
+and for folding a long backlog into the summary in capped steps.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from history_buffer import HistoryEntry
+from summarizer import unsummarized_history, transcript_line, ConversationSummarizer, RECENT_HISTORY_MESSAGES
+from text_chunker import approximate_token_counts
+
+START = datetime(2026, 1, 1)
+
+
+def history(count: int):
+    return [HistoryEntry("user", f"m{i}", START + timedelta(seconds=i)) for i in range(count)]
+
+
+def test_without_summary_keeps_recent_window():
+    assert unsummarized_history(history(20), None) == history(20)[-RECENT_HISTORY_MESSAGES:]
+
+
+def test_keeps_every_message_after_the_summary():
+    entries = history(20)
+    summarized_through = entries[5].timestamp
+    assert unsummarized_history(entries, summarized_through) == entries[6:]
+
+
+def test_never_fewer_than_recent_window():
+    entries = history(20)
+    assert unsummarized_history(entries, entries[-2].timestamp) == entries[-RECENT_HISTORY_MESSAGES:]
+
+
+def test_entries_without_timestamps_fall_back_to_recent_window():
+    entries = [HistoryEntry("user", f"m{i}") for i in range(20)]
+    assert unsummarized_history(entries, START) == entries[-RECENT_HISTORY_MESSAGES:]
+
+
+def make_summarizer(max_input_tokens: int) -> ConversationSummarizer:
+    summarizer = ConversationSummarizer("test", max_input_tokens=max_input_tokens, every_n=2, recent_window=4)
+    summarizer._count_tokens = approximate_token_counts
+    return summarizer
+
+
+def test_step_stays_under_the_token_cap():
+    summarizer = make_summarizer(max_input_tokens=10)
+    entries = [HistoryEntry("user", "one two three", START) for _ in range(5)]
+    assert len(summarizer.next_step(entries)) == 2  # "User: one two three" is 5 tokens
+    # A message over the cap still moves the backlog forward
+    assert len(summarizer.next_step([HistoryEntry("user", "word " * 50, START)] + entries)) == 1
+
+
+def test_first_summary_of_a_long_conversation_takes_several_capped_steps(initialized_database):
+    from database import SessionLocal, Conversation
+
+    user_id, conversation_id, count = uuid.uuid4(), uuid.uuid4(), 30
+    started = datetime.utcnow() - timedelta(hours=1)
+    with initialized_database.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, whatsapp_number) VALUES (:id, 'whatsapp:+15550000001')"),
+                           {"id": user_id})
+        connection.execute(text("INSERT INTO conversations (id, user_id, message_count, summarized_message_count, last_message_at) "
+                                "VALUES (:id, :user_id, :count, 0, :now)"),
+                           {"id": conversation_id, "user_id": user_id, "count": count, "now": started})
+        for i in range(count):
+            connection.execute(text(
+                "INSERT INTO messages (id, conversation_id, user_id, role, content, timestamp) "
+                "VALUES (:id, :conversation_id, :user_id, 'user', :content, :timestamp)"
+            ), {"id": uuid.uuid4(), "conversation_id": conversation_id, "user_id": user_id,
+                "content": f"message number {i}", "timestamp": started + timedelta(seconds=i)})
+
+    summarizer = make_summarizer(max_input_tokens=20)
+    steps = []
+
+    def summarize(previous_summary, messages):
+        steps.append((previous_summary, [message.content for message in messages]))
+        return f"summary {len(steps)}"
+
+    summarizer.summarize = summarize
+    db = SessionLocal()
+    try:
+        while summarizer.run_once(db):
+            pass
+        conversation = db.get(Conversation, conversation_id)
+        assert conversation.summary == f"summary {len(steps)}"
+        assert conversation.summarized_message_count == count - 4
+    finally:
+        db.close()
+
+    assert len(steps) > 1
+    assert [previous for previous, _ in steps] == [None] + [f"summary {i}" for i in range(1, len(steps))]
+    folded = [content for _, contents in steps for content in contents]
+    assert folded == [f"message number {i}" for i in range(count - 4)]
+    for _, contents in steps:
+        assert sum(approximate_token_counts([transcript_line(HistoryEntry("user", c)) for c in contents])) <= 20
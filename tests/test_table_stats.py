@@ -0,0 +1,69 @@
+"""
+Tests for trigger-maintained row counters.
+"""
+
+import uuid
+from sqlalchemy import text
+from table_stats import install_row_counters, TableStatistics
+
+
+def add_users(engine, count: int):
+    with engine.begin() as connection:
+        for _ in range(count):
+            connection.execute(text("INSERT INTO users (id, whatsapp_number) VALUES (:id, :number)"),
+                               {"id": uuid.uuid4(), "number": f"whatsapp:{uuid.uuid4().hex[:12]}"})
+
+
+def test_counters_track_inserts_and_deletes(initialized_database):
+    add_users(initialized_database, 3)
+    with initialized_database.begin() as connection:
+        connection.execute(text("DELETE FROM users WHERE id IN (SELECT id FROM users LIMIT 1)"))
+
+    stats = TableStatistics(mode="counters", ttl=0).get()
+    assert stats["source"] == "counters"
+    assert stats["total_users"] == 2
+    assert stats["total_messages"] == 0
+
+
+def test_seed_counts_existing_rows_once(initialized_database):
+    engine = initialized_database
+    # An older install: triggers present, deltas recorded, but no seed marker
+    with engine.begin() as connection:
+        connection.execute(text("DROP TRIGGER users_count_insert ON users"))
+    add_users(engine, 4)  # Written before the trigger existed
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TRIGGER users_count_insert AFTER INSERT ON users REFERENCING NEW TABLE AS new_rows "
+            "FOR EACH STATEMENT EXECUTE FUNCTION count_inserted_rows()"
+        ))
+        connection.execute(text("DELETE FROM table_row_count_seeds WHERE table_name = 'users'"))
+    add_users(engine, 2)  # Recorded by the trigger as well as by the count
+
+    assert TableStatistics(mode="counters", ttl=0).get()["source"] == "estimate"
+    install_row_counters()
+    install_row_counters()  # Seeding happens once
+    assert TableStatistics(mode="counters", ttl=0).get()["total_users"] == 6
+
+
+def test_knowledge_count_follows_the_active_version(initialized_database, monkeypatch):
+    import table_stats
+    import knowledge_versions
+
+    with initialized_database.begin() as connection:
+        for version, chunks in ((1, 3), (2, 5)):
+            for i in range(chunks):
+                connection.execute(text(
+                    "INSERT INTO knowledge_documents (id, source_file, chunk_index, content, version) "
+                    "VALUES (:id, 'book.pdf', :i, 'chunk', :version)"
+                ), {"id": uuid.uuid4(), "i": i, "version": version})
+        connection.execute(text("INSERT INTO knowledge_versions (version, state, document_count) "
+                                "VALUES (2, 'ready', 5)"))
+
+    monkeypatch.setattr(knowledge_versions, "_registry_instance", None)
+    monkeypatch.setattr(table_stats, "_stats_instance", None)
+    stats = table_stats.get_table_statistics()
+    assert stats.get()["knowledge_base_documents"] == 3
+
+    # Activation drops the cached statistics rather than waiting out their TTL
+    knowledge_versions.get_knowledge_versions().activate(2)
+    assert stats.get()["knowledge_base_documents"] == 5
@@ -0,0 +1,65 @@
+"""
+Tests for structure-aware chunking: size limits, citations and lazy tokenizer loading.
+"""
+
+import pytest
+import text_chunker
+from text_chunker import TextChunker, approximate_token_counts
+
+PROSE = ("When worries pile up, writing them down can make them feel smaller and easier to sort "
+         "into the ones you can act on and the ones you can let go of for now. ")
+
+
+def chunker(**sizes) -> TextChunker:
+    return TextChunker(count_tokens=approximate_token_counts, **sizes)
+
+
+def test_dense_stretch_of_a_long_unit_stays_within_max_tokens():
+    # One sentence whose second half packs far more tokens per character than its average
+    sparse = " ".join(["understanding"] * 300)
+    dense = " ".join(f"{i},{i}" for i in range(300))
+    text = f"{sparse} {dense}"
+    chunks = chunker(max_tokens=50, overlap_tokens=0, min_tokens=10).split_text(text)
+
+    counts = approximate_token_counts([chunk.content for chunk in chunks])
+    assert max(counts) <= 50
+    assert [chunk.tokens for chunk in chunks] == counts
+    assert " ".join(chunk.content for chunk in chunks).split() == text.split()
+
+
+def test_chunks_respect_max_tokens_on_prose():
+    text = "\n\n".join(PROSE * 6 for _ in range(5))
+    chunks = chunker(max_tokens=80, overlap_tokens=20, min_tokens=20).split_text(text)
+    assert len(chunks) > 1
+    assert max(approximate_token_counts([chunk.content for chunk in chunks])) <= 80
+
+
+def test_offsets_cite_pages_and_characters():
+    pages = [(1, "Coping Skills\n" + PROSE * 4), (2, PROSE * 4 + "\n\nSleep\n" + PROSE * 3)]
+    chunks = chunker(max_tokens=60, overlap_tokens=10, min_tokens=10).split_pages(pages)
+    text_of = dict(pages)
+
+    for chunk in chunks:
+        if chunk.page == chunk.end_page:
+            assert text_of[chunk.page][chunk.char_start:chunk.char_end] == chunk.content
+        else:
+            # A chunk spanning a page break starts and ends at its cited offsets
+            assert chunk.content.startswith(text_of[chunk.page][chunk.char_start:])
+            assert chunk.content.endswith(text_of[chunk.end_page][:chunk.char_end])
+
+    assert chunks[0].heading == "Coping Skills"
+    assert chunks[-1].heading == "Sleep"
+    assert chunks[-1].page == 2
+
+
+def test_tokenizer_loads_on_first_count(monkeypatch):
+    def unavailable():
+        raise AssertionError("tokenizer loaded at construction")
+
+    monkeypatch.setattr(text_chunker, "get_token_counter", unavailable)
+    lazy = TextChunker()
+    with pytest.raises(AssertionError):
+        lazy.count_tokens(["hello"])
+
+    monkeypatch.setattr(text_chunker, "get_token_counter", lambda: approximate_token_counts)
+    assert lazy.count_tokens(["hello there"]) == [2]
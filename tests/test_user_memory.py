@@ -0,0 +1,82 @@
+"""
+Tests for the in-memory per-user memory index.
+"""
+
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+import numpy as np
+from user_memory import UserMemoryIndex
+
+Row = namedtuple("Row", ["id", "conversation_id", "content", "timestamp", "embedding"])
+START = datetime(2026, 1, 1)
+
+
+def newest_first(rows):
+    return list(reversed(rows))
+
+
+def minutes(n):
+    return START + timedelta(minutes=n)
+
+
+def test_prompt_window_is_excluded_before_ranking():
+    current, earlier = uuid.uuid4(), uuid.uuid4()
+    query = np.ones(4)
+    # Far more in-window rows than k + a few, all closer to the query
+    rows = [Row(i, earlier, f"earlier {i}", minutes(i), np.array([1.0, 1.0, 1.0, -1.0])) for i in range(3)]
+    rows += [Row(100 + i, current, f"current {i}", minutes(10 + i), query) for i in range(200)]
+    memory = UserMemoryIndex(min_similarity=0.0)
+    index = memory._store("user", newest_first(rows))
+
+    results = memory._rank(index, query, 3, current, minutes(10))
+    assert sorted(result["content"] for result in results) == ["earlier 0", "earlier 1", "earlier 2"]
+    assert all(result["conversation_id"] == earlier for result in results)
+
+
+def test_older_messages_of_the_active_conversation_are_recalled():
+    # Conversations never close, so every memory comes from the active one
+    conversation = uuid.uuid4()
+    query = np.eye(4)[0]
+    rows = [Row(i, conversation, f"m{i}", minutes(i), np.eye(4)[i % 2]) for i in range(20)]
+    memory = UserMemoryIndex(min_similarity=0.5)
+    index = memory._store("user", newest_first(rows))
+
+    # The last six messages are in the prompt; older ones on the query's axis come back
+    results = memory._rank(index, query, 3, conversation, minutes(14))
+    recalled = [int(result["content"][1:]) for result in results]
+    assert len(recalled) == 3
+    assert all(i < 14 and i % 2 == 0 for i in recalled)
+
+    # A freshly added message is in the window until later messages push it out
+    memory.add("user", 20, conversation, "m20", query, minutes(20))
+    assert "m20" not in [result["content"] for result in memory._rank(index, query, 20, conversation, minutes(14))]
+    assert "m20" in [result["content"] for result in memory._rank(index, query, 20, conversation, minutes(30))]
+    assert len(memory._rank(index, query, 20)) == 11
+
+
+def test_add_grows_then_overwrites_oldest():
+    memory = UserMemoryIndex(max_messages_per_user=5, min_similarity=-1.0)
+    index = memory._store("user", [])
+    conversation = uuid.uuid4()
+    for i in range(8):
+        memory.add("user", i, conversation, f"m{i}", np.eye(4)[i % 4], minutes(i))
+
+    assert index.count == 5
+    assert sorted(index.contents) == ["m3", "m4", "m5", "m6", "m7"]
+    assert index.matrix.shape == (5, 4)
+
+
+def test_byte_cap_evicts_least_recently_used():
+    rows = newest_first([Row(i, uuid.uuid4(), "x" * 100, minutes(i), np.ones(64)) for i in range(10)])
+    memory = UserMemoryIndex(min_similarity=0.0)
+    one_index = memory._store("first", rows).nbytes
+    memory.max_bytes = one_index * 2
+    memory._store("second", rows)
+    memory._store("third", rows)
+
+    stats = memory.stats()
+    assert stats["users"] == 2
+    assert stats["evictions"] == 1
+    assert memory._cached("first") is None
+    assert stats["bytes"] <= memory.max_bytes
@@ -0,0 +1,18 @@
+"""
+Tests for the pgvector version guard in front of half precision tools.
+"""
+
+import pytest
+from vector_precision import compare_precision, pgvector_version, HALFVEC_MIN_VERSION
+
+
+def test_compare_needs_halfvec(initialized_database):
+    with initialized_database.connect() as connection:
+        version = pgvector_version(connection)
+    assert version is not None
+
+    if version < HALFVEC_MIN_VERSION:
+        with pytest.raises(RuntimeError, match="halfvec needs pgvector 0.7"):
+            compare_precision(samples=1)
+    else:
+        assert compare_precision(samples=1)["knowledge_documents"]["samples"] == 0
@@ -0,0 +1,138 @@
+"""
+Tests for write-behind message persistence: batched flushes, spill replay and unwritable rows.
+"""
+
+import glob
+import os
+import uuid
+from datetime import datetime
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+import write_behind
+from write_behind import WriteBehindBuffer
+
+
+def begin_turn(number: str):
+    from database import SessionLocal, begin_turn as begin
+    db = SessionLocal()
+    try:
+        return begin(db, number)
+    finally:
+        db.close()
+
+
+def turn_messages(text_prefix: str):
+    return [
+        {"role": "user", "content": f"{text_prefix} question"},
+        {"role": "assistant", "content": f"{text_prefix} answer"}
+    ]
+
+
+def scalar(engine, sql: str, **params):
+    with engine.connect() as connection:
+        return connection.execute(text(sql), params).scalar()
+
+
+def files(directory, pattern: str):
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+
+def crash(buffer: WriteBehindBuffer, monkeypatch):
+    """Stop the flush thread without flushing and release the spill lock, as a dead process would."""
+    monkeypatch.setattr(buffer, "flush", lambda: 0)
+    buffer._stopping.set()
+    buffer._wakeup.set()
+    buffer._thread.join()
+    buffer._spill.close()
+
+
+def test_flush_inserts_rows_and_counters(initialized_database, tmp_path):
+    turn = begin_turn("whatsapp:+15550000101")
+    buffer = WriteBehindBuffer(flush_interval=3600, spill_dir=str(tmp_path))
+    buffer.start()
+    buffer.enqueue_turn(turn.conversation_id, turn.user_id, turn_messages("first"))
+    buffer.enqueue_turn(turn.conversation_id, turn.user_id, turn_messages("second"), crisis=True)
+
+    assert buffer.flush() == 4
+    engine = initialized_database
+    assert scalar(engine, "SELECT count(*) FROM messages WHERE conversation_id = :id", id=turn.conversation_id) == 4
+    assert scalar(engine, "SELECT message_count FROM conversations WHERE id = :id", id=turn.conversation_id) == 4
+    assert scalar(engine, "SELECT total_messages FROM users WHERE id = :id", id=turn.user_id) == 2
+    assert scalar(engine, "SELECT crisis_flag FROM users WHERE id = :id", id=turn.user_id) is True
+
+    buffer.stop()
+    assert files(tmp_path, "*.jsonl") == []
+    assert buffer.stats()["flushed"] == 4
+
+
+def test_spilled_rows_are_replayed_after_a_crash(initialized_database, tmp_path, monkeypatch):
+    turn = begin_turn("whatsapp:+15550000102")
+    crashed = WriteBehindBuffer(flush_interval=3600, spill_dir=str(tmp_path))
+    crashed.start()
+    ids = crashed.enqueue_turn(turn.conversation_id, turn.user_id, turn_messages("unflushed"))
+    crash(crashed, monkeypatch)
+    assert scalar(initialized_database, "SELECT count(*) FROM messages") == 0
+
+    restarted = WriteBehindBuffer(flush_interval=3600, spill_dir=str(tmp_path))
+    restarted.start()
+    assert restarted.stats()["replayed"] == 2
+    assert scalar(initialized_database, "SELECT count(*) FROM messages WHERE id = ANY(:ids)", ids=ids) == 2
+    restarted.stop()
+    assert files(tmp_path, "*.jsonl") == []
+
+
+def test_unwritable_row_is_isolated_then_dead_lettered(initialized_database, tmp_path, monkeypatch):
+    turn = begin_turn("whatsapp:+15550000103")
+    buffer = WriteBehindBuffer(flush_interval=3600, spill_dir=str(tmp_path), max_attempts=2)
+    buffer.start()
+
+    # No partition exists for this timestamp, so the row can never be inserted
+    class FarFuture(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime(2100, 1, 1)
+
+    monkeypatch.setattr(write_behind, "datetime", FarFuture)
+    buffer.enqueue_turn(turn.conversation_id, turn.user_id, [{"role": "user", "content": "poison"}])
+    monkeypatch.undo()
+    buffer.enqueue_turn(turn.conversation_id, turn.user_id, turn_messages("healthy"))
+
+    # The healthy rows get through; the poison row waits for another attempt
+    assert buffer.flush() == 2
+    assert buffer.stats()["pending"] == 1
+    assert buffer.stats()["dead_lettered"] == 0
+
+    # A later turn isn't held back by it, and the second failure moves it aside
+    buffer.enqueue_turn(turn.conversation_id, turn.user_id, turn_messages("later"))
+    assert buffer.flush() == 2
+    stats = buffer.stats()
+    assert stats["pending"] == 0
+    assert stats["dead_lettered"] == 1
+
+    dead_letters = files(tmp_path, "dead-*.jsonl")
+    assert len(dead_letters) == 1
+    with open(dead_letters[0], encoding="utf-8") as dead_letter:
+        assert '"content": "poison"' in dead_letter.read()
+
+    buffer.stop()
+    assert files(tmp_path, "spill-*.jsonl") == []
+    assert scalar(initialized_database, "SELECT count(*) FROM messages") == 4
+
+
+def test_stop_keeps_rows_spilled_when_the_database_is_down(tmp_path):
+    def unreachable():
+        raise OperationalError("connect", {}, Exception("connection refused"))
+
+    buffer = WriteBehindBuffer(flush_interval=3600, spill_dir=str(tmp_path), session_factory=unreachable)
+    buffer.start()
+    buffer.enqueue_turn(uuid.uuid4(), uuid.uuid4(), turn_messages("offline"))
+
+    with pytest.raises(OperationalError):
+        buffer.flush()
+    assert buffer.stats()["pending"] == 2
+
+    buffer.stop()  # Must not raise, so shutdown goes on to close storage
+    spilled = files(tmp_path, "spill-*.jsonl")
+    assert spilled
+    assert sum(len(open(path, encoding="utf-8").readlines()) for path in spilled) == 2